@@ -0,0 +1,213 @@
+"""
+Benchmark homework13 Groth16 phases on random satisfiable R1CS instances
+
+    python bench_groth16.py                           # 2^6 .. 2^12 constraints
+    python bench_groth16.py --min-log 6 --max-log 10 --output results.json
+    python bench_groth16.py --tracemalloc             # peak Python heap per phase
+
+prepare_polinomials, prepare_trusted_setup, prove and verify are timed
+separately, and within them the profiling steps (setup.g2, prove.calculate_h
+and so on); the step that takes the largest share of the run is printed for
+every size. Setup and prove grow about linearly, a run to 2^12 takes around
+ten minutes and every further size doubles that. After every phase the
+process high-water mark (ru_maxrss) is recorded, it only grows, so it is the
+peak up to and including that phase.
+With --tracemalloc every phase also gets its own peak of traced Python
+allocations; tracing slows Python code down, so those runs are not
+comparable by time with plain ones.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, TypeVar
+from py_ecc.bn128 import curve_order
+
+import profiling
+from homework13 import (
+    build_interpolation_set,
+    prepare_polinomials,
+    prepare_trusted_setup,
+    prove,
+    verify,
+)
+from r1cs import SparseMatrix
+
+T = TypeVar("T")
+
+PUBLIC = 2
+INPUTS = 4
+
+
+def random_r1cs(
+    constraints: int, rnd: random.Random
+) -> tuple[SparseMatrix, SparseMatrix, SparseMatrix, list[int]]:
+    """
+    A, B, C and a witness satisfying them. The witness is 1, the public
+    output, INPUTS random inputs and one variable per constraint:
+
+        (r1 * w[a1] + r2 * w[a2]) * (r3 * w[b] + r4) = w[next]
+
+    with earlier variables a1, a2, b, and the last constraint writing the output.
+    """
+    assert constraints >= 1, "there must be at least one constraint"
+    variables = PUBLIC + INPUTS + constraints - 1
+    witness = [1, 0] + [rnd.randint(0, curve_order - 1) for _ in range(INPUTS)]
+    a_entries, b_entries, c_entries = [], [], []
+    for row in range(constraints):
+        # any variable computed so far except the output at index 1
+        a1, a2, b = (
+            idx + (idx >= 1) for idx in rnd.sample(range(len(witness) - 1), 3)
+        )
+        r1, r2, r3, r4 = (rnd.randint(1, curve_order - 1) for _ in range(4))
+        value = (r1 * witness[a1] + r2 * witness[a2]) * (r3 * witness[b] + r4)
+        a_entries += [(row, a1, r1), (row, a2, r2)]
+        b_entries += [(row, b, r3), (row, 0, r4)]
+        if row == constraints - 1:
+            witness[1] = value % curve_order
+            c_entries.append((row, 1, 1))
+        else:
+            c_entries.append((row, len(witness), 1))
+            witness.append(value % curve_order)
+    assert len(witness) == variables
+    A, B, C = (
+        SparseMatrix.from_coo(constraints, variables, entries)
+        for entries in (a_entries, b_entries, c_entries)
+    )
+    return A, B, C, witness
+
+
+def max_rss_bytes() -> int:
+    # kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def measure(fn: Callable[[], T], trace: bool) -> tuple[T, dict]:
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with profiling.profile() as sink:
+            result = fn()
+        seconds = time.perf_counter() - start
+        phase = {
+            "seconds": seconds,
+            "steps": {name: stats.seconds for name, stats in sink.phases.items()},
+        }
+        if trace:
+            phase["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    finally:
+        if trace:
+            tracemalloc.stop()
+    phase["max_rss_bytes"] = max_rss_bytes()
+    return result, phase
+
+
+def bench(
+    constraints: int, rnd: random.Random, workers: int | None, trace: bool
+) -> dict:
+    A, B, C, witness = random_r1cs(constraints, rnd)
+    interpolation_set = build_interpolation_set(constraints)
+    phases = {}
+    polynomials, phases["prepare_polinomials"] = measure(
+        lambda: prepare_polinomials(A, B, C, interpolation_set, A.cols, constraints),
+        trace,
+    )
+    ts, phases["prepare_trusted_setup"] = measure(
+        lambda: prepare_trusted_setup(
+            tuple(interpolation_set), polynomials, PUBLIC, workers
+        ),
+        trace,
+    )
+    pk, vk = ts.proving_key(), ts.verifying_key()
+    proof, phases["prove"] = measure(lambda: prove(polynomials, witness, pk), trace)
+    valid, phases["verify"] = measure(
+        lambda: verify(*proof, vk, witness[:PUBLIC]), trace
+    )
+    assert valid, f"proof is not valid at {constraints} constraints"
+    return {
+        "constraints": constraints,
+        "domain": polynomials.n,
+        "variables": A.cols,
+        "nnz": A.nnz + B.nnz + C.nnz,
+        "phases": phases,
+    }
+
+
+def slowest_step(phases: dict) -> tuple[str, float]:
+    """
+    Profiling step with the largest share of the total time over all phases
+    """
+    total = sum(phase["seconds"] for phase in phases.values())
+    steps = {
+        name: seconds
+        for phase in phases.values()
+        for name, seconds in phase["steps"].items()
+    }
+    name = max(steps, key=steps.__getitem__)
+    return name, steps[name] / total
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--min-log", type=int, default=6)
+    parser.add_argument("--max-log", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--tracemalloc", action="store_true")
+    parser.add_argument("--seed", type=int, default=100500)
+    parser.add_argument("--output", default="bench_groth16.json")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    # the trusted setup draws its toxic waste from the global generator
+    random.seed(args.seed)
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "workers": args.workers,
+        "tracemalloc": args.tracemalloc,
+        "results": [],
+    }
+    names = ["prepare_polinomials", "prepare_trusted_setup", "prove", "verify"]
+    labels = ["polynomials, s", "setup, s", "prove, s", "verify, s"]
+    print(f"{'n':>8}" + "".join(f" {label:>14}" for label in labels), end="")
+    print(f" {'max rss, MB':>12}  slowest step")
+    for log_n in range(args.min_log, args.max_log + 1):
+        result = bench(1 << log_n, rnd, args.workers, args.tracemalloc)
+        report["results"].append(result)
+        phases = result["phases"]
+        print(f"{result['constraints']:>8}", end="")
+        print("".join(f" {phases[name]['seconds']:>14.3f}" for name in names), end="")
+        print(f" {phases['verify']['max_rss_bytes'] / 2**20:>12.1f}", end="")
+        name, share = slowest_step(phases)
+        print(f"  {name} {share:.0%}", flush=True)
+        # rewritten after every size, so a long run that is stopped keeps its results
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark bucket MSM against the reduce(add, map(multiply, ...)) path
+
+    python bench_msm.py                 # n = 2^10 .. 2^16, G1
+    python bench_msm.py --min-log 10 --max-log 12 --group g2
+"""
+
+import argparse
+import random
+import time
+from py_ecc.bn128 import curve_order, add, multiply, G1, G2
+
+from msm import msm, msm_window, naive_msm
+
+
+def random_points(n: int, generator, rnd: random.Random) -> list:
+    # walking P_{i+1} = P_i + Q is much cheaper than n independent multiplies
+    step = multiply(generator, rnd.randint(2, curve_order - 1))
+    current = multiply(generator, rnd.randint(2, curve_order - 1))
+    points = []
+    for _ in range(n):
+        points.append(current)
+        current = add(current, step)
+    return points
+
+
+def witness_like_scalars(n: int, rnd: random.Random) -> list[int]:
+    # witness vectors are mostly bits with a few full-size field elements
+    return [
+        rnd.randint(0, curve_order - 1) if rnd.random() < 0.25 else rnd.randint(0, 1)
+        for _ in range(n)
+    ]
+
+
+def timed(fn, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--min-log", type=int, default=10)
+    parser.add_argument("--max-log", type=int, default=16)
+    parser.add_argument("--group", choices=["g1", "g2"], default="g1")
+    parser.add_argument("--skip-naive", action="store_true")
+    parser.add_argument("--seed", type=int, default=100500)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    generator = G1 if args.group == "g1" else G2
+    print(f"{'n':>8} {'window':>6} {'naive, s':>10} {'msm, s':>10} {'speedup':>8}")
+    for log_n in range(args.min_log, args.max_log + 1):
+        n = 1 << log_n
+        points = random_points(n, generator, rnd)
+        scalars = witness_like_scalars(n, rnd)
+        # zero and one scalars skip the buckets, so the window is smaller than for n
+        window = msm_window(points, scalars)
+        msm_time, fast = timed(msm, points, scalars)
+        if args.skip_naive:
+            print(f"{n:>8} {window:>6} {'-':>10} {msm_time:>10.2f} {'-':>8}")
+            continue
+        naive_time, slow = timed(naive_msm, points, scalars)
+        assert fast == slow, f"msm mismatch at n={n}"
+        print(
+            f"{n:>8} {window:>6} {naive_time:>10.2f} {msm_time:>10.2f}"
+            f" {naive_time / msm_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+On-disk cache of compiled circuits
+
+The QAP stays in Lagrange form, so a compiled circuit is what the prover
+keeps reusing: the sparse A, B and C with their entries reduced mod
+curve_order. It is stored under a content hash of the matrices and the
+domain size, in O(nnz) bytes:
+
+    header   magic (8 bytes), version, matrices (u32 each)
+    matrix   rows, cols, nnz (u64 each), indptr ((rows + 1) u64),
+             indices (nnz u64), data (nnz 32 byte big-endian integers)
+
+The cache directory is bounded in size; least recently used entries are
+removed first, and a hit counts as a use.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+import random
+import struct
+import tempfile
+from typing import Sequence
+import numpy as np
+from py_ecc.bn128 import curve_order
+import pytest
+
+from r1cs import DenseMatrix, SparseMatrix, as_sparse
+
+MAGIC = b"ZKQAP\x00\x00\x00"
+VERSION = 2
+HEADER = struct.Struct("<8sII")
+SHAPE = struct.Struct("<QQQ")
+COEFFICIENT_SIZE = 32
+SUFFIX = ".circuit"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class CircuitCacheError(Exception):
+    pass
+
+
+def circuit_key(
+    matrices: Sequence[DenseMatrix | SparseMatrix], domain_size: int
+) -> str:
+    """
+    Content hash of the matrices (entries reduced mod curve_order) and the domain
+    """
+    digest = hashlib.sha256(HEADER.pack(MAGIC, VERSION, len(matrices)))
+    digest.update(struct.pack("<Q", domain_size))
+    for matrix in map(as_sparse, matrices):
+        digest.update(struct.pack("<QQ", matrix.rows, matrix.cols))
+        digest.update(matrix.indptr.astype("<i8").tobytes())
+        digest.update(matrix.indices.astype("<i8").tobytes())
+        for value in matrix.data:
+            value = int(value) % curve_order
+            digest.update(value.to_bytes(COEFFICIENT_SIZE, "big"))
+    return digest.hexdigest()
+
+
+def compile_matrices(
+    matrices: Sequence[DenseMatrix | SparseMatrix],
+) -> list[SparseMatrix]:
+    """
+    CSR of every matrix with the entries reduced mod curve_order
+    """
+    result = []
+    for matrix in map(as_sparse, matrices):
+        data = np.empty(matrix.nnz, dtype=object)
+        data[:] = [int(value) % curve_order for value in matrix.data]
+        result.append(
+            SparseMatrix(
+                rows=matrix.rows,
+                cols=matrix.cols,
+                indptr=matrix.indptr,
+                indices=matrix.indices,
+                data=data,
+            )
+        )
+    return result
+
+
+def encode_matrices(matrices: Sequence[SparseMatrix]) -> bytes:
+    chunks = [HEADER.pack(MAGIC, VERSION, len(matrices))]
+    for matrix in matrices:
+        chunks.append(SHAPE.pack(matrix.rows, matrix.cols, matrix.nnz))
+        chunks.append(matrix.indptr.astype("<u8").tobytes())
+        chunks.append(matrix.indices.astype("<u8").tobytes())
+        chunks.append(
+            b"".join(
+                (int(value) % curve_order).to_bytes(COEFFICIENT_SIZE, "big")
+                for value in matrix.data
+            )
+        )
+    return b"".join(chunks)
+
+
+def decode_matrices(data: bytes) -> list[SparseMatrix]:
+    if len(data) < HEADER.size:
+        raise CircuitCacheError("artifact is too short")
+    magic, version, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise CircuitCacheError("not a compiled circuit of this version")
+    offset = HEADER.size
+    result = []
+    for _ in range(count):
+        if len(data) < offset + SHAPE.size:
+            raise CircuitCacheError("artifact has a wrong size")
+        rows, cols, nnz = SHAPE.unpack_from(data, offset)
+        offset += SHAPE.size
+        end = offset + 8 * (rows + 1) + 8 * nnz + COEFFICIENT_SIZE * nnz
+        if len(data) < end:
+            raise CircuitCacheError("artifact has a wrong size")
+        indptr = np.frombuffer(data, "<u8", rows + 1, offset).astype(np.int64)
+        offset += 8 * (rows + 1)
+        indices = np.frombuffer(data, "<u8", nnz, offset).astype(np.int64)
+        offset += 8 * nnz
+        values = np.empty(nnz, dtype=object)
+        values[:] = [
+            int.from_bytes(data[pos : pos + COEFFICIENT_SIZE], "big")
+            for pos in range(offset, end, COEFFICIENT_SIZE)
+        ]
+        offset = end
+        result.append(
+            SparseMatrix(
+                rows=rows, cols=cols, indptr=indptr, indices=indices, data=values
+            )
+        )
+    if offset != len(data):
+        raise CircuitCacheError("artifact has a wrong size")
+    return result
+
+
+class CircuitCache:
+    def __init__(
+        self, directory: str | os.PathLike, max_bytes: int = DEFAULT_MAX_BYTES
+    ) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}{SUFFIX}"
+
+    def _entries(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        for path in self.directory.glob(f"*{SUFFIX}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def get(self, key: str) -> list[SparseMatrix] | None:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            matrices = decode_matrices(data)
+        except CircuitCacheError:
+            path.unlink(missing_ok=True)
+            return None
+        # mtime is the recency used by eviction
+        os.utime(path)
+        return matrices
+
+    def put(self, key: str, matrices: Sequence[SparseMatrix]) -> None:
+        data = encode_matrices(matrices)
+        if len(data) > self.max_bytes:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key))
+        finally:
+            # only left over when the write or the rename failed
+            Path(tmp).unlink(missing_ok=True)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry[0])
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def clear(self) -> None:
+        for _, _, path in self._entries():
+            path.unlink(missing_ok=True)
+
+
+def test_circuit_key() -> None:
+    A = [[0, 1, 0], [1, 0, -1]]
+    key = circuit_key([A, A], 2)
+    assert key == circuit_key([SparseMatrix.from_dense(A), A], 2)
+    assert key == circuit_key([A, [[0, 1, 0], [1, 0, curve_order - 1]]], 2)
+    assert key != circuit_key([A, A], 4)
+    assert key != circuit_key([A, [[0, 1, 0], [1, 0, 1]]], 2)
+    assert key != circuit_key([A], 2)
+
+
+def _equal(a: SparseMatrix, b: SparseMatrix) -> bool:
+    return a.shape == b.shape and a.to_dense() == b.to_dense()
+
+
+def test_matrices_roundtrip() -> None:
+    rnd = random.Random(2)
+    values = [0, 0, 1, -1, curve_order + 5]
+    dense = [[rnd.choice(values) for _ in range(4)] for _ in range(3)]
+    matrices = compile_matrices([dense, [[0, 0]], []])
+    assert matrices[0].to_dense() == [[x % curve_order for x in row] for row in dense]
+    decoded = decode_matrices(encode_matrices(matrices))
+    assert all(_equal(a, b) for a, b in zip(decoded, matrices, strict=True))
+    assert decode_matrices(encode_matrices([])) == []
+    with pytest.raises(CircuitCacheError):
+        decode_matrices(encode_matrices(matrices)[:-1])
+    with pytest.raises(CircuitCacheError):
+        decode_matrices(encode_matrices(matrices) + b"\x00")
+
+
+def test_failed_put_leaves_no_temp_file(tmp_path, monkeypatch) -> None:
+    cache = CircuitCache(tmp_path)
+
+    def fail(*args) -> None:
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        cache.put("a", compile_matrices([[[1, 2]]]))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cache_lru_eviction(tmp_path) -> None:
+    matrices = compile_matrices([[[1, 2, 3, 4]]])
+    entry_size = len(encode_matrices(matrices))
+    cache = CircuitCache(tmp_path, max_bytes=2 * entry_size)
+    assert cache.get("a") is None
+    cache.put("a", matrices)
+    cache.put("b", matrices)
+    # make "a" the most recently used one, so "b" is evicted next
+    os.utime(tmp_path / f"b{SUFFIX}", (0, 0))
+    (hit,) = cache.get("a")
+    assert hit.to_dense() == [[1, 2, 3, 4]]
+    cache.put("c", matrices)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.size() == 2 * entry_size
+    (tmp_path / f"c{SUFFIX}").write_bytes(b"garbage")
+    assert cache.get("c") is None
+    cache.clear()
+    assert cache.size() == 0
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
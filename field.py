@@ -0,0 +1,379 @@
+"""
+BN254 scalar field (Fr) elements and vectors
+
+Fr is a single residue in a __slots__ object, FrVector is a list of
+canonical residues with elementwise arithmetic. Both convert to and from
+ints for free and to and from 32 byte big-endian strings, the encoding the
+key files and the circuit cache use.
+
+Elements are kept as canonical residues, not in Montgomery form: with
+CPython integers a product reduced by % is about 40% faster than a REDC,
+which needs two more big multiplications. Montgomery form pays off with
+fixed-width limbs, where there is no cheap division, see limbs.
+"""
+
+from collections.abc import Iterable, Iterator, Sequence
+import random
+from typing import Protocol, Self, overload
+from py_ecc.bn128 import curve_order
+import pytest
+
+MODULUS = curve_order
+BYTES = 32
+
+
+def batch_inverse(values: Sequence[int], modulus: int = MODULUS) -> list[int]:
+    """
+    Inverses of all values with one modular inversion and 3(n - 1)
+    multiplications (Montgomery's trick), zeros are not invertible
+    """
+    prefix = []
+    acc = 1
+    for x in values:
+        prefix.append(acc)
+        acc = acc * x % modulus
+    if acc == 0:
+        raise ZeroDivisionError("batch contains zero")
+    inv = pow(acc, -1, modulus)
+    result = [0] * len(values)
+    for idx in range(len(values) - 1, -1, -1):
+        result[idx] = inv * prefix[idx] % modulus
+        inv = inv * values[idx] % modulus
+    return result
+
+
+class FieldElement(Protocol):
+    def __mul__(self, other: Self) -> Self: ...
+
+    def __truediv__(self, other: Self) -> Self: ...
+
+
+def batch_inverse_elements[T: FieldElement](values: Sequence[T], one: T) -> list[T]:
+    """
+    batch_inverse for field element objects such as py_ecc's FQ and FQ2 or Fr,
+    one / x for every value at the price of a single division
+    """
+    prefix = []
+    acc = one
+    for x in values:
+        prefix.append(acc)
+        acc = acc * x
+    inv = one / acc
+    result = [one] * len(values)
+    for idx in range(len(values) - 1, -1, -1):
+        result[idx] = inv * prefix[idx]
+        inv = inv * values[idx]
+    return result
+
+
+class Fr:
+    __slots__ = ("value",)
+
+    def __init__(self, value: "int | Fr" = 0) -> None:
+        self.value = int(value) % MODULUS
+
+    @classmethod
+    def _wrap(cls, value: int) -> "Fr":
+        # value is already reduced
+        element = object.__new__(cls)
+        element.value = value
+        return element
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Fr":
+        value = int.from_bytes(data, "big")
+        if len(data) != BYTES or value >= MODULUS:
+            raise ValueError("not a canonical field element encoding")
+        return cls._wrap(value)
+
+    def to_bytes(self) -> bytes:
+        return self.value.to_bytes(BYTES, "big")
+
+    def __int__(self) -> int:
+        return self.value
+
+    __index__ = __int__
+
+    def __bool__(self) -> bool:
+        return self.value != 0
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Fr):
+            return self.value == other.value
+        if isinstance(other, int):
+            return self.value == other % MODULUS
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.value)
+
+    def __repr__(self) -> str:
+        return f"Fr({self.value})"
+
+    def __add__(self, other: "Fr | int") -> "Fr":
+        if isinstance(other, Fr):
+            return Fr._wrap((self.value + other.value) % MODULUS)
+        if isinstance(other, int):
+            return Fr._wrap((self.value + other) % MODULUS)
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other: "Fr | int") -> "Fr":
+        if isinstance(other, Fr):
+            return Fr._wrap((self.value - other.value) % MODULUS)
+        if isinstance(other, int):
+            return Fr._wrap((self.value - other) % MODULUS)
+        return NotImplemented
+
+    def __rsub__(self, other: int) -> "Fr":
+        if isinstance(other, int):
+            return Fr._wrap((other - self.value) % MODULUS)
+        return NotImplemented
+
+    def __neg__(self) -> "Fr":
+        return Fr._wrap(-self.value % MODULUS)
+
+    def __mul__(self, other: "Fr | int") -> "Fr":
+        if isinstance(other, Fr):
+            return Fr._wrap(self.value * other.value % MODULUS)
+        if isinstance(other, int):
+            return Fr._wrap(self.value * other % MODULUS)
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def inverse(self) -> "Fr":
+        if not self.value:
+            raise ZeroDivisionError("zero is not invertible")
+        return Fr._wrap(pow(self.value, -1, MODULUS))
+
+    def __truediv__(self, other: "Fr | int") -> "Fr":
+        if isinstance(other, (Fr, int)):
+            return self * Fr(other).inverse()
+        return NotImplemented
+
+    def __rtruediv__(self, other: int) -> "Fr":
+        if isinstance(other, int):
+            return self.inverse() * other
+        return NotImplemented
+
+    def __pow__(self, exponent: int) -> "Fr":
+        if exponent < 0:
+            return self.inverse() ** -exponent
+        return Fr._wrap(pow(self.value, exponent, MODULUS))
+
+
+class FrVector(Sequence[Fr]):
+    """
+    Vector of field elements backed by a list of canonical ints.
+    Arithmetic is elementwise, with an int or an Fr as the other operand it
+    is applied to every element. values is the list itself, for code that
+    works on ints directly (NTTs, MSMs); treat it as read-only.
+
+    The operations are plain Python loops over ints: they are neither
+    vectorized nor in Montgomery form. That part of replacing galois was not
+    implemented here; the NumPy limb arithmetic in limbs is separate and
+    FrVector does not use it.
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values: Iterable[int | Fr] = ()) -> None:
+        self.values = [int(x) % MODULUS for x in values]
+
+    @classmethod
+    def from_canonical(cls, values: list[int]) -> "FrVector":
+        """
+        Wrap a list of already reduced ints without copying it
+        """
+        vector = object.__new__(cls)
+        vector.values = values
+        return vector
+
+    @classmethod
+    def zeros(cls, size: int) -> "FrVector":
+        return cls.from_canonical([0] * size)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "FrVector":
+        if len(data) % BYTES:
+            raise ValueError("encoding is not a whole number of field elements")
+        values = [
+            int.from_bytes(data[start : start + BYTES], "big")
+            for start in range(0, len(data), BYTES)
+        ]
+        if any(x >= MODULUS for x in values):
+            raise ValueError("not a canonical field element encoding")
+        return cls.from_canonical(values)
+
+    def to_bytes(self) -> bytes:
+        return b"".join(x.to_bytes(BYTES, "big") for x in self.values)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @overload
+    def __getitem__(self, idx: int) -> Fr: ...
+
+    @overload
+    def __getitem__(self, idx: slice) -> "FrVector": ...
+
+    def __getitem__(self, idx: int | slice) -> "Fr | FrVector":
+        if isinstance(idx, slice):
+            return FrVector.from_canonical(self.values[idx])
+        return Fr._wrap(self.values[idx])
+
+    def __iter__(self) -> Iterator[Fr]:
+        return map(Fr._wrap, self.values)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, FrVector):
+            return NotImplemented
+        return self.values == other.values
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"FrVector({self.values})"
+
+    def _other(self, other: "FrVector | Fr | int") -> list[int] | int | None:
+        if isinstance(other, FrVector):
+            assert len(other) == len(self), "vectors size is not equal"
+            return other.values
+        if isinstance(other, (Fr, int)):
+            return int(other) % MODULUS
+        return None
+
+    def __add__(self, other: "FrVector | Fr | int") -> "FrVector":
+        values = self._other(other)
+        if values is None:
+            return NotImplemented
+        if isinstance(values, int):
+            return FrVector.from_canonical(
+                [(x + values) % MODULUS for x in self.values]
+            )
+        return FrVector.from_canonical(
+            [(x + y) % MODULUS for x, y in zip(self.values, values)]
+        )
+
+    __radd__ = __add__
+
+    def __sub__(self, other: "FrVector | Fr | int") -> "FrVector":
+        values = self._other(other)
+        if values is None:
+            return NotImplemented
+        if isinstance(values, int):
+            return FrVector.from_canonical(
+                [(x - values) % MODULUS for x in self.values]
+            )
+        return FrVector.from_canonical(
+            [(x - y) % MODULUS for x, y in zip(self.values, values)]
+        )
+
+    def __rsub__(self, other: "Fr | int") -> "FrVector":
+        if not isinstance(other, (Fr, int)):
+            return NotImplemented
+        value = int(other) % MODULUS
+        return FrVector.from_canonical([(value - x) % MODULUS for x in self.values])
+
+    def __neg__(self) -> "FrVector":
+        return FrVector.from_canonical([-x % MODULUS for x in self.values])
+
+    def __mul__(self, other: "FrVector | Fr | int") -> "FrVector":
+        values = self._other(other)
+        if values is None:
+            return NotImplemented
+        if isinstance(values, int):
+            return FrVector.from_canonical([x * values % MODULUS for x in self.values])
+        return FrVector.from_canonical(
+            [x * y % MODULUS for x, y in zip(self.values, values)]
+        )
+
+    __rmul__ = __mul__
+
+    def dot(self, other: "FrVector | Sequence[int]") -> Fr:
+        values = other.values if isinstance(other, FrVector) else other
+        assert len(values) == len(self), "vectors size is not equal"
+        return Fr(sum(x * int(y) for x, y in zip(self.values, values)))
+
+    def inverse(self) -> "FrVector":
+        """
+        Elementwise inverse with a single modular inversion
+        """
+        return FrVector.from_canonical(batch_inverse(self.values))
+
+    def evaluate(self, x: Fr | int) -> Fr:
+        """
+        Value at x of the polynomial with these ascending coefficients
+        """
+        x = int(x) % MODULUS
+        result = 0
+        for c in reversed(self.values):
+            result = (result * x + c) % MODULUS
+        return Fr._wrap(result)
+
+
+def test_fr_arithmetic() -> None:
+    rnd = random.Random(2)
+    a, b = rnd.randrange(MODULUS), rnd.randrange(1, MODULUS)
+    x, y = Fr(a), Fr(b)
+    assert int(x + y) == (a + b) % MODULUS
+    assert int(x - y) == (a - b) % MODULUS
+    assert int(3 - y) == (3 - b) % MODULUS
+    assert int(x * y) == a * b % MODULUS
+    assert (x / y) * y == x
+    assert 1 / y == y ** -1 == y.inverse()
+    assert int(-x) == -a % MODULUS
+    assert x ** 3 == x * x * x
+    assert Fr(-1) == MODULUS - 1 == Fr(MODULUS - 1)
+    assert Fr.from_bytes(x.to_bytes()) == x
+    assert {Fr(5): 1}[Fr(MODULUS + 5)] == 1
+    assert [0, 1, 2][Fr(1)] == 1
+    with pytest.raises(ZeroDivisionError):
+        Fr(0).inverse()
+    with pytest.raises(ValueError):
+        Fr.from_bytes(MODULUS.to_bytes(BYTES, "big"))
+
+
+def test_fr_vector() -> None:
+    rnd = random.Random(3)
+    a = [rnd.randrange(1, MODULUS) for _ in range(7)]
+    b = [rnd.randrange(MODULUS) for _ in range(7)]
+    u, v = FrVector(a), FrVector(b)
+    assert list(u + v) == [Fr(x) + y for x, y in zip(a, b)]
+    assert (u - v).values == [(x - y) % MODULUS for x, y in zip(a, b)]
+    assert (u * v).values == [x * y % MODULUS for x, y in zip(a, b)]
+    assert (u * 3).values == (3 * u).values == [3 * x % MODULUS for x in a]
+    assert (5 - u).values == (Fr(5) - u).values == [(5 - x) % MODULUS for x in a]
+    assert (5 - u).values == (-(u - 5)).values
+    assert (u * u.inverse()).values == [1] * len(a)
+    assert u.dot(v) == sum(x * y for x, y in zip(a, b))
+    assert u[2] == Fr(a[2]) and u[1:3] == FrVector(a[1:3])
+    assert FrVector.from_bytes(u.to_bytes()) == u
+    assert FrVector([-1, MODULUS]).values == [MODULUS - 1, 0]
+    assert u.evaluate(5) == sum(c * 5**i for i, c in enumerate(a))
+    assert FrVector.zeros(3).evaluate(7) == 0
+    with pytest.raises(ZeroDivisionError):
+        FrVector([1, 0]).inverse()
+
+
+def test_batch_inverse() -> None:
+    values = [3, 5, 7, MODULUS - 1]
+    assert batch_inverse(values) == [pow(x, -1, MODULUS) for x in values]
+    assert batch_inverse([2, 3], 11) == [6, 4]
+    assert batch_inverse([]) == []
+    with pytest.raises(ZeroDivisionError):
+        batch_inverse([3, 0])
+
+
+def test_batch_inverse_elements() -> None:
+    values = [Fr(3), Fr(5), Fr(-1)]
+    assert batch_inverse_elements(values, Fr(1)) == [1 / x for x in values]
+    assert batch_inverse_elements([], Fr(1)) == []
+    with pytest.raises(ZeroDivisionError):
+        batch_inverse_elements([Fr(3), Fr(0)], Fr(1))
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,229 @@
+"""
+Fixed-base scalar multiplication for BN254 G1/G2 generators
+
+A trusted setup multiplies the same generator by thousands of scalars. The
+table holds d * 2**(w*i) * G for every w-bit digit d and every window i, so a
+multiplication is one mixed addition per non-zero digit and no doublings.
+The table itself is normalized to affine with a single inversion.
+
+Every multiplication is independent, so multiply_batch can spread chunks of
+scalars over a process pool, which a setup opens once (worker_pool) for both
+generators. Each worker builds its own table once per generator, and
+points travel back in the fixed-width key file encoding instead of pickled
+FQ objects.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import functools
+import multiprocessing
+import random
+from typing import Sequence
+from py_ecc.bn128 import (
+    curve_order,
+    multiply,
+    G1,
+    G2,
+    FQ,
+    FQ2,
+)
+import pytest
+
+import profiling
+from jacobian import JacobianPoint, batch_to_affine
+from keyfile import decode_g1, decode_g2, encode_g1, encode_g2
+
+# Elliptic curve points can be None (point at infinity)
+type G1Point = tuple[FQ, FQ] | None
+type G2Point = tuple[FQ2, FQ2] | None
+type Point = G1Point | G2Point
+
+SCALAR_BITS = curve_order.bit_length()
+MAX_WINDOW = 16
+CHUNK_SIZE = 256
+
+
+def window_for(count: int) -> int:
+    """
+    Window width for count multiplications by the same base: building the
+    table costs windows * 2**w additions and every scalar costs windows more
+    """
+    return min(
+        range(1, MAX_WINDOW + 1),
+        key=lambda w: -(-SCALAR_BITS // w) * (2**w + count),
+    )
+
+
+class FixedBase:
+    __slots__ = ("field", "window", "table")
+
+    def __init__(self, generator: Point, window: int = 4) -> None:
+        assert generator is not None, "generator can't be the point at infinity"
+        assert 1 <= window <= MAX_WINDOW, "window is out of range"
+        self.field = type(generator[0])
+        self.window = window
+        digits = (1 << window) - 1
+        base = JacobianPoint.from_affine(generator)
+        multiples = []
+        for _ in range(-(-SCALAR_BITS // window)):
+            row = [base]
+            for _ in range(digits - 1):
+                row.append(row[-1] + base)
+            multiples.extend(row)
+            base = row[-1] + base
+        points = batch_to_affine(multiples)
+        self.table = [
+            points[start : start + digits] for start in range(0, len(points), digits)
+        ]
+
+    def multiply_jacobian(self, scalar: int) -> JacobianPoint:
+        scalar = int(scalar) % curve_order
+        profiling.count(profiling.SCALAR_MULTIPLICATIONS)
+        mask = (1 << self.window) - 1
+        result = JacobianPoint.infinity(self.field)
+        for row in self.table:
+            if not scalar:
+                break
+            digit = scalar & mask
+            if digit:
+                result = result.add_affine(row[digit - 1])
+            scalar >>= self.window
+        return result
+
+    def multiply(self, scalar: int) -> Point:
+        return self.multiply_jacobian(scalar).to_affine()
+
+    def batch_multiply(self, scalars: Sequence[int]) -> list[Point]:
+        return batch_to_affine([self.multiply_jacobian(s) for s in scalars])
+
+
+# tables of the current worker process by encoded generator and window,
+# built by the first chunk that needs one
+_worker_tables: dict[tuple[bytes, int], FixedBase] = {}
+
+
+def _codec(field: type[FQ] | type[FQ2]) -> tuple:
+    if field is FQ2:
+        return encode_g2, decode_g2
+    return encode_g1, decode_g1
+
+
+def _multiply_chunk(
+    generator: bytes, field: type[FQ] | type[FQ2], window: int, scalars: list[int]
+) -> bytes:
+    encode, decode = _codec(field)
+    table = _worker_tables.get((generator, window))
+    if table is None:
+        table = _worker_tables[generator, window] = FixedBase(decode(generator), window)
+    return b"".join(map(encode, table.batch_multiply(scalars)))
+
+
+def worker_pool(
+    workers: int | None,
+) -> contextlib.AbstractContextManager[ProcessPoolExecutor | None]:
+    """
+    Process pool for multiply_batch, or None when workers does not ask for
+    one. A setup opens it once for all of its generators and scalar lists.
+    """
+    if workers is None or workers <= 1:
+        return contextlib.nullcontext()
+    # numpy starts threads, which makes forking the caller unsafe
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("forkserver")
+    )
+
+
+def multiply_batch(
+    generator: Point,
+    scalars: Sequence[int],
+    workers: int | None = None,
+    chunk_size: int | None = None,
+    pool: ProcessPoolExecutor | None = None,
+) -> list[Point]:
+    """
+    [s * generator for s in scalars] with a table sized for len(scalars).
+
+    With workers > 1 the scalars are split into chunks of chunk_size
+    (CHUNK_SIZE by default) and multiplied in pool, a worker_pool(workers)
+    of the caller's or one opened for this call; the result is the same as
+    the sequential one.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    if not scalars:
+        return []
+    if workers is None or workers <= 1 or len(scalars) <= chunk_size:
+        return FixedBase(generator, window_for(len(scalars))).batch_multiply(scalars)
+    if pool is None:
+        with worker_pool(workers) as pool:
+            return multiply_batch(generator, scalars, workers, chunk_size, pool)
+
+    field = type(generator[0])
+    encode, decode = _codec(field)
+    size = len(encode(None))
+    chunks = [
+        [int(s) for s in scalars[start : start + chunk_size]]
+        for start in range(0, len(scalars), chunk_size)
+    ]
+    # every worker builds its own table, so size it for the worker's share
+    window = window_for(-(-len(scalars) // workers))
+    task = functools.partial(_multiply_chunk, encode(generator), field, window)
+    encoded = b"".join(pool.map(task, chunks))
+    return [
+        decode(encoded[start : start + size]) for start in range(0, len(encoded), size)
+    ]
+
+
+def multiply_groups(
+    generator: Point,
+    groups: Sequence[Sequence[int]],
+    workers: int | None = None,
+    pool: ProcessPoolExecutor | None = None,
+) -> list[tuple[Point, ...]]:
+    """
+    multiply_batch over several scalar lists at once, so that they share one
+    table, with the points split back into the same groups
+    """
+    scalars = [s for group in groups for s in group]
+    points = multiply_batch(generator, scalars, workers, pool=pool)
+    result = []
+    start = 0
+    for group in groups:
+        result.append(tuple(points[start : start + len(group)]))
+        start += len(group)
+    return result
+
+
+@pytest.mark.parametrize("generator,window", [(G1, 1), (G1, 5), (G2, 3)])
+def test_fixed_base_matches_multiply(generator, window: int) -> None:
+    rnd = random.Random(window)
+    table = FixedBase(generator, window)
+    scalars = [0, 1, 2, curve_order - 1, curve_order + 5, -3]
+    scalars += [rnd.randint(0, curve_order - 1) for _ in range(5)]
+    expected = [multiply(generator, s % curve_order) for s in scalars]
+    assert table.batch_multiply(scalars) == expected
+    assert [table.multiply(s) for s in scalars] == expected
+
+
+def test_multiply_batch() -> None:
+    scalars = [pow(7, x, curve_order) for x in range(10)]
+    assert multiply_batch(G1, scalars) == [multiply(G1, s) for s in scalars]
+    assert multiply_batch(G2, []) == []
+    assert multiply_batch(G2, scalars, workers=2, chunk_size=3) == multiply_batch(
+        G2, scalars
+    )
+    assert multiply_groups(G1, [scalars[:3], [], scalars[3:]]) == [
+        tuple(multiply_batch(G1, scalars[:3])),
+        (),
+        tuple(multiply_batch(G1, scalars[3:])),
+    ]
+    # one pool serves both generators
+    with worker_pool(2) as pool:
+        g1 = multiply_batch(G1, scalars, workers=2, chunk_size=3, pool=pool)
+        g2 = multiply_batch(G2, scalars, workers=2, chunk_size=4, pool=pool)
+    assert g1 == multiply_batch(G1, scalars)
+    assert g2 == multiply_batch(G2, scalars)
+    assert window_for(1) < window_for(1000) < window_for(10**6) <= MAX_WINDOW
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -3,24 +3,28 @@ Implement encrypted QAP with trusted setup
 """
 
 from enum import IntEnum
-import functools
 import typing
 import random
+from typing import Sequence
 from py_ecc.bn128 import (
     curve_order,
-    add,
-    multiply,
-    pairing,
+    neg,
     G1,
     G2,
     FQ,
     FQ2,
-    final_exponentiate,
 )
-import galois
 import pytest
 
-type Matrix = list[list[int]]
+from field import FrVector
+from fixed_base import multiply_batch, worker_pool
+from jacobian import JacobianPoint, batch_to_affine
+from msm import msm_jacobian
+from ntt import Domain, check_quotient, intt, quotient
+from pairings import pairing_check
+from r1cs import SparseMatrix, as_sparse
+
+type Matrix = list[list[int]] | SparseMatrix
 
 # Elliptic curve points can be None (point at infinity)
 type G1Point = tuple[FQ, FQ] | None
@@ -29,57 +33,52 @@ type TauG1 = tuple[G1Point, ...]
 type TauG2 = tuple[G2Point, ...]
 
 
-FIELD = galois.GF(
-    curve_order,
-    primitive_element=5,
-    verify=False,
-)
-
 random.seed(100500)
 
 
 def powers_of_tau(
-    n: int, interpolation_set: tuple[int, ...]
+    n: int, interpolation_set: tuple[int, ...], workers: int | None = None
 ) -> tuple[TauG1, TauG2, TauG1]:
+    # polynomials live on the whole power-of-two domain, which can be
+    # larger than the number of constraints n
+    assert n <= len(interpolation_set), "interpolation set is smaller than constraints"
+    domain = Domain.of_size(len(interpolation_set))
     tau = random.randint(1, curve_order)
-    powers_of_tau_g1 = tuple(
-        multiply(G1, tau**x) for x in range(n - 1, -1, -1)
-    )
-    powers_of_tau_g2 = tuple(
-        multiply(G2, tau**x) for x in range(n - 1, -1, -1)
-    )
-    t_of_tau = galois.Poly.Roots(FIELD(interpolation_set), field=FIELD)(tau)
-    t_of_tau_g1 = tuple(
-        multiply(G1, int(t_of_tau) * tau**x) for x in range(n - 2, -1, -1)
+    # all scalars are reduced mod curve_order, tau**x itself would grow to n * 254 bits
+    tau_powers = [pow(tau, x, curve_order) for x in range(domain.size - 1, -1, -1)]
+    t_of_tau = domain.vanishing_at(tau)
+    t_scalars = [t_of_tau * power % curve_order for power in tau_powers[1:]]
+    with worker_pool(workers) as pool:
+        g1_points = multiply_batch(G1, tau_powers + t_scalars, workers, pool=pool)
+        powers_of_tau_g2 = tuple(multiply_batch(G2, tau_powers, workers, pool=pool))
+    return (
+        tuple(g1_points[: domain.size]),
+        powers_of_tau_g2,
+        tuple(g1_points[domain.size :]),
     )
-    return powers_of_tau_g1, powers_of_tau_g2, t_of_tau_g1
 
 
 def build_interpolation_set(constraints: int) -> tuple[int, ...]:
-    start = random.randint(1, curve_order // 2)
-    increment = random.randint(13, 547)
-    return tuple(start + increment * x for x in range(0, constraints))
+    return tuple(Domain.for_constraints(constraints).elements())
 
 
 def to_poly(
     matrix: Matrix,
     witness: list[int],
-    interpolation_set: list[int] | galois.Array,
-) -> galois.Poly:
-    result = galois.Poly.Zero(field=FIELD)
-    for col in range(len(matrix[0])):
-        coeffs = []
-        for row in range(len(matrix)):
-            coeffs.append(matrix[row][col] % FIELD.order)
-        result += galois.lagrange_poly(interpolation_set, FIELD(coeffs)) * witness[col]
-    return result
-
-
-def at_tau_g(coefficients: galois.Array, tau_g: TauG1 | TauG2) -> G1Point | G2Point:
+    interpolation_set: Sequence[int],
+) -> FrVector:
+    """
+    Ascending coefficients of the polynomial of matrix * witness, interpolated
+    once over the domain instead of summing one lagrange polynomial per column
+    """
+    domain = Domain.of_size(len(interpolation_set))
+    evaluations = as_sparse(matrix).dot(witness, modulus=curve_order)
+    return FrVector.from_canonical(intt(evaluations, domain))
+
+
+def at_tau_g(coefficients: Sequence[int], tau_g: TauG1 | TauG2) -> JacobianPoint:
     assert len(coefficients) == len(tau_g), "coefficients size is not equal"
-    return functools.reduce(
-        add, map(multiply, tau_g, [int(x) for x in coefficients])
-    )
+    return msm_jacobian(tau_g, coefficients)
 
 
 def prove(
@@ -90,34 +89,35 @@ def prove(
     tau_g1: TauG1,
     tau_g2: TauG2,
     t_of_tau_g1: TauG1,
-    interpolation_set: galois.Array,
+    interpolation_set: Sequence[int],
     allow_fake_proof: bool = False,
 ) -> tuple[G1Point, G2Point, G1Point]:
-    m = len(A[0])
-    n = len(A)
+    A, B, C = as_sparse(A), as_sparse(B), as_sparse(C)
+    m = A.cols
+    domain = Domain.of_size(len(interpolation_set))
+    n = domain.size
     assert m == len(witness)
-    A_poly = to_poly(A, witness, interpolation_set)
-    B_poly = to_poly(B, witness, interpolation_set)
-    O_poly = to_poly(C, witness, interpolation_set)
-    T_poly = galois.Poly.Roots(interpolation_set)
-    h_poly = (A_poly * B_poly - O_poly) // T_poly
+    A_coeffs = to_poly(A, witness, interpolation_set).values
+    B_coeffs = to_poly(B, witness, interpolation_set).values
+    O_coeffs = to_poly(C, witness, interpolation_set).values
+    assert len(A_coeffs) == n
+    h_coeffs = quotient(A_coeffs, B_coeffs, O_coeffs, domain)
     if not allow_fake_proof:
-        remainder = (A_poly * B_poly - O_poly) % T_poly
-        assert remainder == galois.Poly.Zero(field=FIELD), "can't construct h_poly"
-    A_at_tau_g1 = typing.cast(G1Point, at_tau_g(A_poly.coefficients(order="desc", size=n), tau_g1))
-    B_at_tau_g2 = typing.cast(G2Point, at_tau_g(B_poly.coefficients(order="desc", size=n), tau_g2))
-    O_at_tau_g1 = typing.cast(G1Point, at_tau_g(O_poly.coefficients(order="desc", size=n), tau_g1))
-    HT_at_tau_g1 = typing.cast(G1Point, at_tau_g(
-        h_poly.coefficients(order="desc", size=n - 1), t_of_tau_g1
-    ))
-    C_at_tau_g1 = typing.cast(G1Point, add(O_at_tau_g1, HT_at_tau_g1))
-    return A_at_tau_g1, B_at_tau_g2, C_at_tau_g1
+        assert check_quotient(A_coeffs, B_coeffs, O_coeffs, h_coeffs, domain), (
+            "can't construct h_poly"
+        )
+    A_at_tau_g1 = at_tau_g(A_coeffs[::-1], tau_g1)
+    B_at_tau_g2 = at_tau_g(B_coeffs[::-1], tau_g2)
+    O_at_tau_g1 = at_tau_g(O_coeffs[::-1], tau_g1)
+    HT_at_tau_g1 = at_tau_g(h_coeffs[::-1], t_of_tau_g1)
+    C_at_tau_g1 = O_at_tau_g1 + HT_at_tau_g1
+    A_g1, C_g1 = typing.cast(list[G1Point], batch_to_affine([A_at_tau_g1, C_at_tau_g1]))
+    return A_g1, typing.cast(G2Point, B_at_tau_g2.to_affine()), C_g1
 
 
 def verify(A_g1: G1Point, B_g2: G2Point, C_g1: G1Point) -> bool:
-    return final_exponentiate(pairing(B_g2, A_g1)) == final_exponentiate(
-        pairing(G2, C_g1)
-    )
+    # e(B, A) == e(G2, C) as one pairing product
+    return pairing_check([(B_g2, neg(A_g1)), (G2, C_g1)])
 
 
 class Color(IntEnum):
@@ -197,7 +197,7 @@ def test_qap_at_points_3_coloring(color1: Color, color2: Color, expected: bool)
         tau_g1,
         tau_g2,
         t_of_tau_g1,
-        FIELD(interpolation_set),
+        FrVector(interpolation_set),
         allow_fake_proof=True,
     )
     assert verify(Ag1, Bg2, Cg1) == expected
@@ -235,7 +235,7 @@ def test_qap_at_points_3_some_function(
         tau_g1,
         tau_g2,
         t_of_tau_g1,
-        FIELD(interpolation_set),
+        FrVector(interpolation_set),
         allow_fake_proof=True,
     )
     assert verify(Ag1, Bg2, Cg1) == expected
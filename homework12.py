@@ -4,37 +4,51 @@ Implement encrypted Groth16 without public input
 
 from dataclasses import dataclass
 from enum import IntEnum
-import functools
+import os
 import typing
 import random
+from typing import Iterable, Sequence
 from py_ecc.bn128 import (
     curve_order,
-    add,
-    multiply,
-    pairing,
+    neg,
     G1,
     G2,
     FQ,
     FQ2,
-    final_exponentiate,
+    FQ12,
 )
-import galois
 import pytest
 
-type Matrix = list[list[int]]
+import profiling
+import prover_pool
+from circuit_cache import CircuitCache, circuit_key, compile_matrices
+from field import FrVector
+from fixed_base import multiply_groups, worker_pool
+from jacobian import JacobianPoint, batch_to_affine
+from keyfile import KeyFile
+from msm import msm_jacobian
+from msm_pool import MSMPool
+from ntt import Domain, check_quotient, intt_many, quotient
+from pairings import (
+    PreparedG2,
+    pairing,
+    pairing_check,
+    pairing_product,
+    prepare_g2,
+)
+from prover_pool import TimedProof, pool_serves
+from r1cs import SparseMatrix
+
+type Matrix = list[list[int]] | SparseMatrix
 
 # Elliptic curve points can be None (point at infinity)
 type G1Point = tuple[FQ, FQ] | None
 type G2Point = tuple[FQ2, FQ2] | None
-type TauG1 = tuple[G1Point, ...]
-type TauG2 = tuple[G2Point, ...]
-
+# tuples in memory, lazy PointViews when a key is loaded from a key file
+type TauG1 = Sequence[G1Point]
+type TauG2 = Sequence[G2Point]
+type Proof = tuple[G1Point, G2Point, G1Point]
 
-FIELD = galois.GF(
-    curve_order,
-    primitive_element=5,
-    verify=False,
-)
 
 random.seed(100500)
 
@@ -52,168 +66,297 @@ class TrustedSetup:
     powers_of_tau_g1: TauG1
     powers_of_tau_g2: TauG2
     t_of_tau_g1: TauG1
+    # [a_i(tau)]G1 and [b_i(tau)]G2 for every variable i
+    a_query_g1: TauG1
+    b_query_g2: TauG2
     alfa_g1: G1Point
     beta_g2: G2Point
-    psi: tuple[G1Point, ...]
+    psi: TauG1
     tau_g1: G1Point
     tau_g2: G2Point
 
+    def proving_key(self) -> "ProvingKey":
+        return ProvingKey(
+            a_query_g1=self.a_query_g1,
+            b_query_g2=self.b_query_g2,
+            t_of_tau_g1=self.t_of_tau_g1,
+            alfa_g1=self.alfa_g1,
+            beta_g2=self.beta_g2,
+            psi=self.psi,
+        )
+
+    def verifying_key(self) -> "VerifyingKey":
+        return VerifyingKey(alfa_g1=self.alfa_g1, beta_g2=self.beta_g2)
+
+
+@dataclass(frozen=True, slots=True)
+class ProvingKey:
+    """
+    The part of the setup prove reads. A and B are witness-weighted sums of
+    the per-variable queries, t_of_tau_g1 is the H query [tau**i * t(tau)]G1
+    in descending powers.
+    """
+
+    a_query_g1: TauG1
+    b_query_g2: TauG2
+    t_of_tau_g1: TauG1
+    alfa_g1: G1Point
+    beta_g2: G2Point
+    psi: TauG1
+
+
+@dataclass(frozen=True, slots=True)
+class VerifyingKey:
+    """
+    Without public input verify only needs alfa and beta
+    """
+
+    alfa_g1: G1Point
+    beta_g2: G2Point
+
+
+@dataclass(frozen=True, slots=True)
+class PreparedVerifyingKey:
+    """
+    Everything verify needs that does not depend on the proof:
+    e(alfa, beta) in GT and the Miller-loop lines of the G2 generator
+    """
+
+    alfa_beta: FQ12
+    g2: PreparedG2
+
+    @classmethod
+    def from_setup(cls, key: TrustedSetup | VerifyingKey) -> "PreparedVerifyingKey":
+        return cls(alfa_beta=pairing(key.beta_g2, key.alfa_g1), g2=prepare_g2(G2))
+
+
+def _proving_key(key: TrustedSetup | ProvingKey) -> ProvingKey:
+    return key.proving_key() if isinstance(key, TrustedSetup) else key
+
 
 @dataclass(frozen=True, slots=True)
 class Polinomials:
+    """
+    The QAP in Lagrange form: column i of A, B and C holds the values of
+    a_i(x), b_i(x) and c_i(x) on the domain, so the polynomials themselves
+    are never built. Setup evaluates them at tau with at, prove interpolates
+    only A * w, B * w and C * w.
+    """
+
     m: int
     n: int
-    a_polys: list[galois.Poly]
-    b_polys: list[galois.Poly]
-    c_polys: list[galois.Poly]
-    t_poly: galois.Poly
+    domain: Domain
+    # the sparse A, B and C the polynomials interpolate
+    matrices: tuple[SparseMatrix, SparseMatrix, SparseMatrix]
+
+    def at(self, x: int) -> list[list[int]]:
+        """
+        a_i(x), b_i(x) and c_i(x) for every column i without touching the
+        polynomials: with the Lagrange basis values L_j(x) of the domain,
+        a_i(x) = sum_j A[j][i] * L_j(x) is one sparse matrix-vector product
+        """
+        lagrange = self.domain.lagrange_at(x)
+        return [
+            matrix.transpose().dot(lagrange[: matrix.rows], curve_order)
+            for matrix in self.matrices
+        ]
 
 
 def prepare_trusted_setup(
     interpolation_set: tuple[int, ...],
     polinomilas: Polinomials,
+    workers: int | None = None,
 ) -> TrustedSetup:
+    """
+    workers > 1 spreads the scalar multiplications over a process pool,
+    the setup is the same as the sequential one for the same random state
+    """
     tau = random.randint(1, curve_order)
     alfa = random.randint(1, curve_order)
     beta = random.randint(1, curve_order)
-    powers_of_tau_g1 = tuple(
-        multiply(G1, tau**x) for x in range(polinomilas.n - 1, -1, -1)
-    )
-    powers_of_tau_g2 = tuple(
-        multiply(G2, tau**x) for x in range(polinomilas.n - 1, -1, -1)
-    )
-    t_of_tau = galois.Poly.Roots(interpolation_set, field=FIELD)(tau)
-    t_of_tau_g1 = tuple(
-        multiply(G1, int(t_of_tau) * tau**x) for x in range(polinomilas.n - 2, -1, -1)
-    )
-    psi = []
-    assert (
-        len(polinomilas.a_polys) == len(polinomilas.b_polys) == len(polinomilas.c_polys)
-    )
-    for idx in range(polinomilas.m):
-        psi_i = (
-            polinomilas.a_polys[idx](tau) * beta
-            + polinomilas.b_polys[idx](tau) * alfa
-            + polinomilas.c_polys[idx]
-        )
-        psi.append(multiply(G1, int(psi_i(tau))))
+    n = polinomilas.n
+    with profiling.phase("setup.tau_powers"):
+        # all scalars are reduced mod curve_order, tau**x would grow to n * 254 bits
+        tau_powers = [pow(tau, x, curve_order) for x in range(n - 1, -1, -1)]
+        t_of_tau = polinomilas.domain.vanishing_at(tau)
+        t_scalars = [t_of_tau * power % curve_order for power in tau_powers[1:]]
+    with profiling.phase("setup.psi"):
+        a_at_tau, b_at_tau, c_at_tau = polinomilas.at(tau)
+        psi = [
+            (a * beta + b * alfa + c) % curve_order
+            for a, b, c in zip(a_at_tau, b_at_tau, c_at_tau)
+        ]
+    # one fixed-base table per group serves the whole SRS, one pool both groups
+    g1_groups = [tau_powers, t_scalars, psi, a_at_tau, [alfa, tau]]
+    g2_groups = [tau_powers, b_at_tau, [beta, tau]]
+    with worker_pool(workers) as pool:
+        with profiling.phase("setup.g1"):
+            powers_of_tau_g1, t_of_tau_g1, psi_g1, a_query_g1, (alfa_g1, tau_g1) = (
+                multiply_groups(G1, g1_groups, workers, pool)
+            )
+        with profiling.phase("setup.g2"):
+            powers_of_tau_g2, b_query_g2, (beta_g2, tau_g2) = multiply_groups(
+                G2, g2_groups, workers, pool
+            )
     return TrustedSetup(
         powers_of_tau_g1=powers_of_tau_g1,
         powers_of_tau_g2=powers_of_tau_g2,
         t_of_tau_g1=t_of_tau_g1,
-        alfa_g1=multiply(G1, alfa),
-        beta_g2=multiply(G2, beta),
-        psi=tuple(psi),
-        tau_g1=multiply(G1, tau),
-        tau_g2=multiply(G2, tau),
+        a_query_g1=a_query_g1,
+        b_query_g2=b_query_g2,
+        alfa_g1=alfa_g1,
+        beta_g2=beta_g2,
+        psi=psi_g1,
+        tau_g1=tau_g1,
+        tau_g2=tau_g2,
     )
 
 
-def build_interpolation_set(constraints: int) -> galois.Array:
-    start = random.randint(1, curve_order // 2)
-    increment = random.randint(13, 547)
-    return FIELD(tuple(start + increment * x for x in range(0, constraints)))
-
-
-def to_polys(
-    matrix: Matrix,
-    interpolation_set: list[int] | galois.Array,
-) -> list[galois.Poly]:
-    result = []
-    for col in range(len(matrix[0])):
-        coeffs = []
-        for row in range(len(matrix)):
-            coeffs.append(matrix[row][col] % FIELD.order)
-        result.append(galois.lagrange_poly(interpolation_set, FIELD(coeffs)))
-    return result
+def build_interpolation_set(constraints: int) -> FrVector:
+    return FrVector.from_canonical(Domain.for_constraints(constraints).elements())
 
 
 def prepare_polinomials(
-    A: Matrix, B: Matrix, C: Matrix, interpolation_set, m: int, n: int
+    A: Matrix,
+    B: Matrix,
+    C: Matrix,
+    interpolation_set: Sequence[int],
+    m: int,
+    n: int,
+    cache: CircuitCache | None = None,
 ) -> Polinomials:
-    a_polys = to_polys(A, interpolation_set)
-    b_polys = to_polys(B, interpolation_set)
-    c_polys = to_polys(C, interpolation_set)
-    t_poly = galois.Poly.Roots(interpolation_set)
-    return Polinomials(
-        m=m,
-        n=n,
-        a_polys=a_polys,
-        b_polys=b_polys,
-        c_polys=c_polys,
-        t_poly=t_poly,
+    """
+    With a cache the compiled matrices are looked up by the content hash of
+    A, B, C and the domain, and only compiled and stored on a miss
+    """
+    # rows past n are zero constraints, so the polynomials are defined over
+    # the whole power-of-two domain and n becomes the domain size
+    domain = Domain.of_size(len(interpolation_set))
+    assert n <= domain.size, "interpolation set is smaller than constraints"
+    assert [int(x) for x in interpolation_set] == domain.elements(), (
+        "interpolation set is not a roots of unity domain"
     )
+    matrices = None
+    if cache is not None:
+        key = circuit_key([A, B, C], domain.size)
+        matrices = cache.get(key)
+    if matrices is None:
+        matrices = compile_matrices([A, B, C])
+        if cache is not None:
+            cache.put(key, matrices)
+    a, b, c = matrices
+    return Polinomials(m=m, n=domain.size, domain=domain, matrices=(a, b, c))
+
+
+def save_proving_key(pk: ProvingKey, path: str | os.PathLike) -> None:
+    prover_pool.save_proving_key(pk, path)
+
+
+def load_proving_key(path: str | os.PathLike) -> ProvingKey:
+    """
+    Point sequences are views of the mmap, which stays mapped as long as they
+    are alive; proving_key_from on a KeyFile in a with statement unmaps it
+    at the end of the block
+    """
+    return prover_pool.load_proving_key(path, ProvingKey)
+
+
+def proving_key_from(keys: KeyFile) -> ProvingKey:
+    return prover_pool.proving_key_from(keys, ProvingKey)
 
 
 def prove(
     polynomials: Polinomials,
     witness: list[int],
-    ts: TrustedSetup,
+    ts: TrustedSetup | ProvingKey,
     allow_fake_proof: bool = False,
+    pool: MSMPool | None = None,
 ) -> tuple[G1Point, G2Point, G1Point]:
-    def compute(polys: list[galois.Poly], witness: list[int]) -> galois.Poly:
-        assert len(polys) == len(witness)
-        return sum(
-            map(lambda x, y: x * y, polys, witness), galois.Poly.Zero(field=FIELD)
-        )
+    """
+    A, B and C are MSMs of the witness over the per-variable queries, the
+    only polynomial work left is h = (a * b - c) / t on the domain.
 
-    def calculate_h(
-        a: galois.Poly, b: galois.Poly, c: galois.Poly, t: galois.Poly
-    ) -> galois.Poly:
-        numerator = a * b - c
-        h_poly = numerator // t
-        if not allow_fake_proof:
-            remainder = numerator % t
-            if remainder != galois.Poly.Zero(field=FIELD):
-                raise NonZeroRemainder
-        return h_poly
-
-    def at_tau_g(coefficients: galois.Array, tau_g: TauG1 | TauG2) -> G1Point | G2Point:
-        return functools.reduce(
-            add, map(multiply, tau_g, [int(x) for x in coefficients])
+    With a pool opened on the file ts was saved to by save_proving_key, the
+    four MSMs run in its workers: B, A and psi while h is being computed,
+    then H, so the proof takes about as long as the G2 MSM.
+    """
+    pk = _proving_key(ts)
+    if pool is not None:
+        assert pool_serves(pool, pk), "pool is opened on the key of another setup"
+        # the slowest one goes first
+        b_future = pool.g2("b_query_g2", witness)
+        a_future = pool.g1("a_query_g1", witness)
+        psi_future = pool.g1("psi", witness)
+    domain = polynomials.domain
+    with profiling.phase("prove.compute"):
+        # a(x), b(x) and c(x) take the values A * w, B * w and C * w on the domain
+        a_coeffs, b_coeffs, c_coeffs = intt_many(
+            [matrix.dot(witness, curve_order) for matrix in polynomials.matrices],
+            domain,
+        )
+    with profiling.phase("prove.calculate_h"):
+        h_coeffs = quotient(a_coeffs, b_coeffs, c_coeffs, domain)
+        if not allow_fake_proof and not check_quotient(
+            a_coeffs, b_coeffs, c_coeffs, h_coeffs, domain
+        ):
+            raise NonZeroRemainder
+
+    if pool is None:
+        with profiling.phase("prove.a_at_tau_g1"):
+            a_sum = msm_jacobian(pk.a_query_g1, witness)
+        with profiling.phase("prove.b_at_tau_g2"):
+            b_sum = msm_jacobian(pk.b_query_g2, witness)
+        with profiling.phase("prove.psi_g1"):
+            psi_sum = msm_jacobian(pk.psi, witness)
+        with profiling.phase("prove.h_at_tau_g1"):
+            h_sum = msm_jacobian(pk.t_of_tau_g1, h_coeffs[::-1])
+    else:
+        h_future = pool.g1("t_of_tau_g1", h_coeffs[::-1])
+        with profiling.phase("prove.pool_wait"):
+            a_sum = JacobianPoint.from_affine(a_future.result())
+            b_sum = JacobianPoint.from_affine(b_future.result(), FQ2)
+            psi_sum = JacobianPoint.from_affine(psi_future.result())
+            h_sum = JacobianPoint.from_affine(h_future.result())
+
+    with profiling.phase("prove.to_affine"):
+        a_at_tau_g1 = JacobianPoint.from_affine(pk.alfa_g1) + a_sum
+        b_at_tau_g2 = JacobianPoint.from_affine(pk.beta_g2) + b_sum
+        c_at_tau_g1 = psi_sum + h_sum
+        a_g1, c_g1 = typing.cast(
+            list[G1Point], batch_to_affine([a_at_tau_g1, c_at_tau_g1])
         )
+        b_g2 = typing.cast(G2Point, b_at_tau_g2.to_affine())
+    return a_g1, b_g2, c_g1
 
-    a_poly = compute(polynomials.a_polys, witness)
-    b_poly = compute(polynomials.b_polys, witness)
-    c_poly = compute(polynomials.c_polys, witness)
-
-    a_at_tau_g1 = typing.cast(
-        G1Point,
-        add(
-            ts.alfa_g1,
-            at_tau_g(
-                a_poly.coefficients(order="desc", size=polynomials.n),
-                ts.powers_of_tau_g1,
-            ),
-        ),
-    )
-    b_at_tau_g2 = typing.cast(
-        G2Point,
-        add(
-            ts.beta_g2,
-            at_tau_g(
-                b_poly.coefficients(order="desc", size=polynomials.n),
-                ts.powers_of_tau_g2,
-            ),
-        ),
-    )
-    h_poly = calculate_h(a_poly, b_poly, c_poly, polynomials.t_poly)
-    psi = functools.reduce(add, map(lambda x, y: multiply(x, y), ts.psi, witness))
-
-    ht_at_tau_g1 = typing.cast(
-        G1Point,
-        at_tau_g(
-            h_poly.coefficients(order="desc", size=polynomials.n - 1),
-            ts.t_of_tau_g1,
-        ),
+
+def prove_many(
+    polynomials: Polinomials,
+    witnesses: Iterable[list[int]],
+    ts: TrustedSetup | ProvingKey,
+    workers: int | None = None,
+    allow_fake_proof: bool = False,
+) -> list[TimedProof]:
+    """
+    Proofs of many witnesses of one circuit with the time each took, see
+    prover_pool.prove_many
+    """
+    return prover_pool.prove_many(
+        prove, polynomials, witnesses, _proving_key(ts), workers, allow_fake_proof
     )
-    c_at_tau_g1 = typing.cast(G1Point, add(psi, ht_at_tau_g1))
-    return a_at_tau_g1, b_at_tau_g2, c_at_tau_g1
 
 
-def verify(A_g1: G1Point, B_g2: G2Point, C_g1: G1Point, ts: TrustedSetup) -> bool:
-    return final_exponentiate(pairing(B_g2, A_g1)) == final_exponentiate(
-        pairing(G2, C_g1) * pairing(ts.beta_g2, ts.alfa_g1)
+def verify(
+    A_g1: G1Point,
+    B_g2: G2Point,
+    C_g1: G1Point,
+    key: TrustedSetup | VerifyingKey | PreparedVerifyingKey,
+) -> bool:
+    if isinstance(key, PreparedVerifyingKey):
+        # e(B, A) * e(G2, -C) == e(alfa, beta), only B is not prepared
+        return pairing_product([(B_g2, A_g1), (key.g2, neg(C_g1))]) == key.alfa_beta
+    # e(B, A) == e(G2, C) * e(beta, alfa) as one pairing product
+    return pairing_check(
+        [(B_g2, neg(A_g1)), (G2, C_g1), (key.beta_g2, key.alfa_g1)]
     )
 
 
@@ -294,6 +437,29 @@ def test_qap_at_points_3_coloring(color1: Color, color2: Color, expected: bool)
         allow_fake_proof=True,
     )
     assert verify(Ag1, Bg2, Cg1, ts) == expected
+    assert verify(Ag1, Bg2, Cg1, PreparedVerifyingKey.from_setup(ts)) == expected
+    assert verify(Ag1, Bg2, Cg1, ts.verifying_key()) == expected
+
+
+def some_function_witness(x: int, y: int, noise: int = 0) -> list[int]:
+    # the witness vector with the intermediate variables inside,
+    # noise breaks it while keeping out and v2 as they were
+    v1 = 3 * x * x
+    out = v1 * y + 5 * x * y - x - 2 * y + 3
+    return [1, out, x, y + noise, v1, v1 * y]
+
+
+def some_function_setup() -> tuple[Polinomials, TrustedSetup]:
+    """
+    Polynomials and a trusted setup of out = 3x²y + 5xy - x - 2y + 3
+    over the witness [1, out, x, y, v1, v2]
+    """
+    A = [[0, 0, 3, 0, 0, 0], [0, 0, 0, 0, 1, 0], [0, 0, 1, 0, 0, 0]]
+    B = [[0, 0, 1, 0, 0, 0], [0, 0, 0, 1, 0, 0], [0, 0, 0, 5, 0, 0]]
+    C = [[0, 0, 0, 0, 1, 0], [0, 0, 0, 0, 0, 1], [-3, 1, 1, 2, 0, -1]]
+    interpolation_set = build_interpolation_set(len(A))
+    polynomials = prepare_polinomials(A, B, C, interpolation_set, len(A[0]), len(A))
+    return polynomials, prepare_trusted_setup(tuple(interpolation_set), polynomials)
 
 
 @pytest.mark.parametrize(
@@ -329,6 +495,30 @@ def test_qap_at_points_3_some_function(
         allow_fake_proof=True,
     )
     assert verify(Ag1, Bg2, Cg1, ts) == expected
+    assert verify(Ag1, Bg2, Cg1, PreparedVerifyingKey.from_setup(ts)) == expected
+
+
+def test_prove_with_msm_pool(tmp_path) -> None:
+    polynomials, ts = some_function_setup()
+    save_proving_key(ts.proving_key(), tmp_path / "pk.bin")
+    pk = load_proving_key(tmp_path / "pk.bin")
+    witness = some_function_witness(3, 4)
+    proof = prove(polynomials, witness, ts)
+    with MSMPool(tmp_path / "pk.bin", workers=2) as pool:
+        assert prove(polynomials, witness, pk, pool=pool) == proof
+    assert verify(*proof, ts.verifying_key())
+
+
+def test_prove_many() -> None:
+    polynomials, ts = some_function_setup()
+    witnesses = [some_function_witness(x, y) for x, y in [(3, 4), (10, 10), (2, 7)]]
+    expected = [prove(polynomials, w, ts) for w in witnesses]
+    for workers in (None, 2):
+        results = prove_many(polynomials, witnesses, ts, workers=workers)
+        assert [r.proof for r in results] == expected
+        assert all(r.seconds > 0 for r in results)
+    with pytest.raises(NonZeroRemainder):
+        prove_many(polynomials, [[1, 0, 3, 4, 27, 108]], ts)
 
 
 if __name__ == "__main__":
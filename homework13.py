@@ -3,38 +3,57 @@ Implement encrypted Groth16 with public input
 """
 
 from dataclasses import dataclass
-import functools
+import os
 import typing
 import random
+import secrets
+import sys
+from typing import Iterable, Sequence
 from py_ecc.bn128 import (
     curve_order,
-    add,
     multiply,
-    pairing,
+    neg,
     G1,
     G2,
     FQ,
     FQ2,
-    final_exponentiate,
+    FQ12,
 )
-import galois
 import pytest
 
-type Matrix = list[list[int]]
+import fixed_base
+import profiling
+import prover_pool
+from circuit_cache import CircuitCache, circuit_key, compile_matrices
+from field import FrVector
+from fixed_base import multiply_groups, worker_pool
+from jacobian import JacobianPoint, batch_to_affine
+from keyfile import KeyFile, write_keyfile
+from msm import msm, msm_jacobian
+from msm_pool import MSMPool
+from ntt import Domain, check_quotient, evaluate, intt, intt_many, quotient
+from pairings import (
+    PairingError,
+    PreparedG2,
+    pairing,
+    pairing_check,
+    pairing_product,
+    prepare_g2,
+)
+from prover_pool import TimedProof, pool_serves
+from r1cs import SparseMatrix
+
+type Matrix = list[list[int]] | SparseMatrix
 
 # Elliptic curve points can be None (point at infinity)
 type G1Point = tuple[FQ, FQ] | None
 type G2Point = tuple[FQ2, FQ2] | None
-type TauG1 = tuple[G1Point, ...]
-type TauG2 = tuple[G2Point, ...]
+# tuples in memory, lazy PointViews when the setup is loaded from a key file
+type TauG1 = Sequence[G1Point]
+type TauG2 = Sequence[G2Point]
+type Proof = tuple[G1Point, G2Point, G1Point]
 
 
-FIELD = galois.GF(
-    curve_order,
-    primitive_element=5,
-    verify=False,
-)
-
 random.seed(100500)
 
 
@@ -51,192 +70,514 @@ class TrustedSetup:
     powers_of_tau_g1: TauG1
     powers_of_tau_g2: TauG2
     t_of_tau_g1: TauG1
+    # [a_i(tau)]G1 and [b_i(tau)]G2 for every variable i
+    a_query_g1: TauG1
+    b_query_g2: TauG2
     alfa_g1: G1Point
     beta_g2: G2Point
     delta_g2: G2Point
     gamma_g2: G2Point
-    psi: tuple[G1Point, ...]
+    psi: TauG1
     tau_g1: G1Point
     tau_g2: G2Point
     l: int
 
+    def proving_key(self) -> "ProvingKey":
+        return ProvingKey(
+            a_query_g1=self.a_query_g1,
+            b_query_g2=self.b_query_g2,
+            t_of_tau_g1=self.t_of_tau_g1,
+            alfa_g1=self.alfa_g1,
+            beta_g2=self.beta_g2,
+            psi=self.psi[self.l :],
+            l=self.l,
+        )
+
+    def verifying_key(self) -> "VerifyingKey":
+        return VerifyingKey(
+            alfa_g1=self.alfa_g1,
+            beta_g2=self.beta_g2,
+            gamma_g2=self.gamma_g2,
+            delta_g2=self.delta_g2,
+            psi=self.psi[: self.l],
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ProvingKey:
+    """
+    The part of the setup prove reads. A and B are witness-weighted sums of
+    the per-variable queries, t_of_tau_g1 is the H query [tau**i * t(tau) / delta]G1
+    in descending powers and psi holds the private terms psi[l:].
+    """
+
+    a_query_g1: TauG1
+    b_query_g2: TauG2
+    t_of_tau_g1: TauG1
+    alfa_g1: G1Point
+    beta_g2: G2Point
+    psi: TauG1
+    l: int
+
+
+@dataclass(frozen=True, slots=True)
+class VerifyingKey:
+    """
+    The part of the setup verify reads, psi holds the public terms psi[:l],
+    so its size depends on the number of public inputs only
+    """
+
+    alfa_g1: G1Point
+    beta_g2: G2Point
+    gamma_g2: G2Point
+    delta_g2: G2Point
+    psi: TauG1
+
+
+@dataclass(frozen=True, slots=True)
+class PreparedVerifyingKey:
+    """
+    Everything verify needs that does not depend on the proof:
+    e(alfa, beta) in GT and the Miller-loop lines of gamma and delta
+    """
+
+    alfa_beta: FQ12
+    gamma_g2: PreparedG2
+    delta_g2: PreparedG2
+    psi: TauG1
+
+    @classmethod
+    def from_setup(cls, key: TrustedSetup | VerifyingKey) -> "PreparedVerifyingKey":
+        vk = _verifying_key(key)
+        return cls(
+            alfa_beta=pairing(vk.beta_g2, vk.alfa_g1),
+            gamma_g2=prepare_g2(vk.gamma_g2),
+            delta_g2=prepare_g2(vk.delta_g2),
+            psi=vk.psi,
+        )
+
+
+def _proving_key(key: TrustedSetup | ProvingKey) -> ProvingKey:
+    return key.proving_key() if isinstance(key, TrustedSetup) else key
+
+
+def _verifying_key(key: TrustedSetup | VerifyingKey) -> VerifyingKey:
+    return key.verifying_key() if isinstance(key, TrustedSetup) else key
+
 
 @dataclass(frozen=True, slots=True)
 class Polinomials:
+    """
+    The QAP in Lagrange form: column i of A, B and C holds the values of
+    a_i(x), b_i(x) and c_i(x) on the domain, so the polynomials themselves
+    are never built. Setup evaluates them at tau with at, prove interpolates
+    only A * w, B * w and C * w.
+    """
+
     m: int
     n: int
-    a_polys: list[galois.Poly]
-    b_polys: list[galois.Poly]
-    c_polys: list[galois.Poly]
-    t_poly: galois.Poly
+    domain: Domain
+    # the sparse A, B and C the polynomials interpolate
+    matrices: tuple[SparseMatrix, SparseMatrix, SparseMatrix]
+
+    def at(self, x: int) -> list[list[int]]:
+        """
+        a_i(x), b_i(x) and c_i(x) for every column i without touching the
+        polynomials: with the Lagrange basis values L_j(x) of the domain,
+        a_i(x) = sum_j A[j][i] * L_j(x) is one sparse matrix-vector product
+        """
+        lagrange = self.domain.lagrange_at(x)
+        return [
+            matrix.transpose().dot(lagrange[: matrix.rows], curve_order)
+            for matrix in self.matrices
+        ]
 
 
 def prepare_trusted_setup(
     interpolation_set: tuple[int, ...],
     polynomials: Polinomials,
-    l: int
+    l: int,
+    workers: int | None = None,
 ) -> TrustedSetup:
+    """
+    workers > 1 spreads the scalar multiplications over a process pool,
+    the setup is the same as the sequential one for the same random state
+    """
     tau = random.randint(1, curve_order)
     alfa = random.randint(1, curve_order)
     beta = random.randint(1, curve_order)
     delta = random.randint(1, curve_order)
     gamma = random.randint(1, curve_order)
-    powers_of_tau_g1 = tuple(
-        multiply(G1, tau**x) for x in range(polynomials.n - 1, -1, -1)
-    )
-    powers_of_tau_g2 = tuple(
-        multiply(G2, tau**x) for x in range(polynomials.n - 1, -1, -1)
-    )
-    t_of_tau = galois.Poly.Roots(interpolation_set, field=FIELD)(tau)
-    
-    t_of_tau_g1 = tuple(
-        multiply(G1, int(t_of_tau * tau**x / FIELD(delta))) for x in range(polynomials.n - 2, -1, -1)
+    n = polynomials.n
+    with profiling.phase("setup.tau_powers"):
+        # all scalars are reduced mod curve_order, tau**x would grow to n * 254 bits
+        tau_powers = [pow(tau, x, curve_order) for x in range(n - 1, -1, -1)]
+        delta_inv = pow(delta, -1, curve_order)
+        gamma_inv = pow(gamma, -1, curve_order)
+        t_of_tau = polynomials.domain.vanishing_at(tau) * delta_inv % curve_order
+        t_scalars = [t_of_tau * power % curve_order for power in tau_powers[1:]]
+    with profiling.phase("setup.psi"):
+        a_at_tau, b_at_tau, c_at_tau = polynomials.at(tau)
+        psi = [
+            (a * beta + b * alfa + c)
+            * (gamma_inv if idx < l else delta_inv)
+            % curve_order
+            for idx, (a, b, c) in enumerate(zip(a_at_tau, b_at_tau, c_at_tau))
+        ]
+
+    # one fixed-base table per group serves the whole SRS, one pool both groups
+    g1_groups = [tau_powers, t_scalars, psi, a_at_tau, [alfa, tau]]
+    g2_groups = [tau_powers, b_at_tau, [beta, tau, delta, gamma]]
+    with worker_pool(workers) as pool:
+        with profiling.phase("setup.g1"):
+            powers_of_tau_g1, t_of_tau_g1, psi_g1, a_query_g1, (alfa_g1, tau_g1) = (
+                multiply_groups(G1, g1_groups, workers, pool)
+            )
+        with profiling.phase("setup.g2"):
+            powers_of_tau_g2, b_query_g2, (beta_g2, tau_g2, delta_g2, gamma_g2) = (
+                multiply_groups(G2, g2_groups, workers, pool)
+            )
+    return TrustedSetup(
+        powers_of_tau_g1=powers_of_tau_g1,
+        powers_of_tau_g2=powers_of_tau_g2,
+        t_of_tau_g1=t_of_tau_g1,
+        a_query_g1=a_query_g1,
+        b_query_g2=b_query_g2,
+        alfa_g1=alfa_g1,
+        beta_g2=beta_g2,
+        psi=psi_g1,
+        tau_g1=tau_g1,
+        tau_g2=tau_g2,
+        delta_g2=delta_g2,
+        gamma_g2=gamma_g2,
+        l=l,
     )
-    psi = []
-    assert (
-        len(polynomials.a_polys) == len(polynomials.b_polys) == len(polynomials.c_polys)
+
+
+def save_trusted_setup(ts: TrustedSetup, path: str | os.PathLike) -> None:
+    write_keyfile(
+        path,
+        g1={
+            "tau_powers_g1": ts.powers_of_tau_g1,
+            "t_of_tau_g1": ts.t_of_tau_g1,
+            "a_query_g1": ts.a_query_g1,
+            "psi": ts.psi,
+            "alfa_g1": [ts.alfa_g1],
+            "tau_g1": [ts.tau_g1],
+        },
+        g2={
+            "tau_powers_g2": ts.powers_of_tau_g2,
+            "b_query_g2": ts.b_query_g2,
+            "beta_g2": [ts.beta_g2],
+            "delta_g2": [ts.delta_g2],
+            "gamma_g2": [ts.gamma_g2],
+            "tau_g2": [ts.tau_g2],
+        },
+        integers={"l": ts.l},
     )
 
-    for idx in range(l):
-        psi_i = (
-            polynomials.a_polys[idx](tau) * beta
-            + polynomials.b_polys[idx](tau) * alfa
-            + polynomials.c_polys[idx]
-        )
-        psi.append(multiply(G1, int(psi_i(tau) / FIELD(gamma))))
 
-    for idx in range(l, polynomials.m):
-        psi_i = (
-            polynomials.a_polys[idx](tau) * beta
-            + polynomials.b_polys[idx](tau) * alfa
-            + polynomials.c_polys[idx]
-        )  
-        psi.append(multiply(G1, int(psi_i(tau) / FIELD(delta))))
+def load_trusted_setup(path: str | os.PathLike) -> TrustedSetup:
+    """
+    Point sequences stay in the mmap and are decoded on access. The mapping
+    lives as long as the setup's views; to unmap it at a known point use
+    trusted_setup_from on a KeyFile in a with statement.
+    """
+    return trusted_setup_from(KeyFile(path))
+
 
+def trusted_setup_from(keys: KeyFile) -> TrustedSetup:
+    """
+    Setup whose point sequences are views of keys, valid until keys is closed
+    """
     return TrustedSetup(
-        powers_of_tau_g1=powers_of_tau_g1,
-        powers_of_tau_g2=powers_of_tau_g2,
-        t_of_tau_g1=t_of_tau_g1,
-        alfa_g1=multiply(G1, alfa),
-        beta_g2=multiply(G2, beta),
-        psi=tuple(psi),
-        tau_g1=multiply(G1, tau),
-        tau_g2=multiply(G2, tau),
-        delta_g2=multiply(G2, delta),
-        gamma_g2=multiply(G2, gamma),
-        l=l,
+        powers_of_tau_g1=keys.g1("tau_powers_g1"),
+        powers_of_tau_g2=keys.g2("tau_powers_g2"),
+        t_of_tau_g1=keys.g1("t_of_tau_g1"),
+        a_query_g1=keys.g1("a_query_g1"),
+        b_query_g2=keys.g2("b_query_g2"),
+        alfa_g1=keys.g1("alfa_g1")[0],
+        beta_g2=keys.g2("beta_g2")[0],
+        delta_g2=keys.g2("delta_g2")[0],
+        gamma_g2=keys.g2("gamma_g2")[0],
+        psi=keys.g1("psi"),
+        tau_g1=keys.g1("tau_g1")[0],
+        tau_g2=keys.g2("tau_g2")[0],
+        l=keys.integer("l"),
     )
 
 
-def build_interpolation_set(constraints: int) -> galois.Array:
-    start = random.randint(1, curve_order // 2)
-    increment = random.randint(13, 547)
-    return FIELD(tuple(start + increment * x for x in range(0, constraints)))
+def save_proving_key(pk: ProvingKey, path: str | os.PathLike) -> None:
+    prover_pool.save_proving_key(pk, path)
 
 
-def to_polys(
-    matrix: Matrix,
-    interpolation_set: list[int] | galois.Array,
-) -> list[galois.Poly]:
-    result = []
-    for col in range(len(matrix[0])):
-        coeffs = []
-        for row in range(len(matrix)):
-            coeffs.append(matrix[row][col] % FIELD.order)
-        result.append(galois.lagrange_poly(interpolation_set, FIELD(coeffs)))
-    return result
+def load_proving_key(path: str | os.PathLike) -> ProvingKey:
+    """
+    Like load_trusted_setup, the key's views keep the mapping alive
+    """
+    return prover_pool.load_proving_key(path, ProvingKey)
+
+
+def proving_key_from(keys: KeyFile) -> ProvingKey:
+    return prover_pool.proving_key_from(keys, ProvingKey)
+
+
+def save_verifying_key(vk: VerifyingKey, path: str | os.PathLike) -> None:
+    write_keyfile(
+        path,
+        g1={"alfa_g1": [vk.alfa_g1], "psi": vk.psi},
+        g2={
+            "beta_g2": [vk.beta_g2],
+            "delta_g2": [vk.delta_g2],
+            "gamma_g2": [vk.gamma_g2],
+        },
+    )
+
+
+def load_verifying_key(path: str | os.PathLike) -> VerifyingKey:
+    # the key is small, decode it right away and let the file go
+    with KeyFile(path) as keys:
+        return VerifyingKey(
+            alfa_g1=keys.g1("alfa_g1")[0],
+            beta_g2=keys.g2("beta_g2")[0],
+            gamma_g2=keys.g2("gamma_g2")[0],
+            delta_g2=keys.g2("delta_g2")[0],
+            psi=tuple(keys.g1("psi")),
+        )
+
+
+def build_interpolation_set(constraints: int) -> FrVector:
+    return FrVector.from_canonical(Domain.for_constraints(constraints).elements())
 
 
 def prepare_polinomials(
-    A: Matrix, B: Matrix, C: Matrix, interpolation_set: galois.Array, m: int, n: int
+    A: Matrix,
+    B: Matrix,
+    C: Matrix,
+    interpolation_set: Sequence[int],
+    m: int,
+    n: int,
+    cache: CircuitCache | None = None,
 ) -> Polinomials:
-    a_polys = to_polys(A, interpolation_set)
-    b_polys = to_polys(B, interpolation_set)
-    c_polys = to_polys(C, interpolation_set)
-    t_poly = galois.Poly.Roots(interpolation_set)
-    return Polinomials(
-        m=m,
-        n=n,
-        a_polys=a_polys,
-        b_polys=b_polys,
-        c_polys=c_polys,
-        t_poly=t_poly,
+    """
+    With a cache the compiled matrices are looked up by the content hash of
+    A, B, C and the domain, and only compiled and stored on a miss
+    """
+    # rows past n are zero constraints, so the polynomials are defined over
+    # the whole power-of-two domain and n becomes the domain size
+    domain = Domain.of_size(len(interpolation_set))
+    assert n <= domain.size, "interpolation set is smaller than constraints"
+    assert [int(x) for x in interpolation_set] == domain.elements(), (
+        "interpolation set is not a roots of unity domain"
     )
+    matrices = None
+    if cache is not None:
+        key = circuit_key([A, B, C], domain.size)
+        matrices = cache.get(key)
+    if matrices is None:
+        matrices = compile_matrices([A, B, C])
+        if cache is not None:
+            cache.put(key, matrices)
+    a, b, c = matrices
+    return Polinomials(m=m, n=domain.size, domain=domain, matrices=(a, b, c))
 
 
 def prove(
     polynomials: Polinomials,
     witness: list[int],
-    ts: TrustedSetup,
+    ts: TrustedSetup | ProvingKey,
     allow_fake_proof: bool = False,
+    pool: MSMPool | None = None,
 ) -> tuple[G1Point, G2Point, G1Point]:
-    def compute(polys: list[galois.Poly], witness: list[int]) -> galois.Poly:
-        assert len(polys) == len(witness)
-        return sum(
-            map(lambda x, y: x * y, polys, witness), galois.Poly.Zero(field=FIELD)
+    """
+    A, B and C are MSMs of the witness over the per-variable queries, the
+    only polynomial work left is h = (a * b - c) / t on the domain.
+
+    With a pool opened on the file ts was saved to by save_proving_key, the
+    four MSMs run in its workers: B, A and psi while h is being computed,
+    then H, so the proof takes about as long as the G2 MSM.
+    """
+    pk = _proving_key(ts)
+    if pool is not None:
+        assert pool_serves(pool, pk), "pool is opened on the key of another setup"
+        # the slowest one goes first
+        b_future = pool.g2("b_query_g2", witness)
+        a_future = pool.g1("a_query_g1", witness)
+        psi_future = pool.g1("psi", witness[pk.l :])
+    domain = polynomials.domain
+    with profiling.phase("prove.compute"):
+        # a(x), b(x) and c(x) take the values A * w, B * w and C * w on the domain
+        a_coeffs, b_coeffs, c_coeffs = intt_many(
+            [matrix.dot(witness, curve_order) for matrix in polynomials.matrices],
+            domain,
         )
-
-    def calculate_h(
-        a: galois.Poly, b: galois.Poly, c: galois.Poly, t: galois.Poly
-    ) -> galois.Poly:
-        numerator = a * b - c
-        h_poly = numerator // t
-        if not allow_fake_proof:
-            remainder = numerator % t
-            if remainder != galois.Poly.Zero(field=FIELD):
-                raise NonZeroRemainder
-        return h_poly
-
-    def at_tau_g(coefficients: galois.Array, tau_g: TauG1 | TauG2) -> G1Point | G2Point:
-        return functools.reduce(
-            add, map(multiply, tau_g, [int(x) for x in coefficients])
+    with profiling.phase("prove.calculate_h"):
+        h_coeffs = quotient(a_coeffs, b_coeffs, c_coeffs, domain)
+        if not allow_fake_proof and not check_quotient(
+            a_coeffs, b_coeffs, c_coeffs, h_coeffs, domain
+        ):
+            raise NonZeroRemainder
+
+    if pool is None:
+        with profiling.phase("prove.a_at_tau_g1"):
+            a_sum = msm_jacobian(pk.a_query_g1, witness)
+        with profiling.phase("prove.b_at_tau_g2"):
+            b_sum = msm_jacobian(pk.b_query_g2, witness)
+        with profiling.phase("prove.psi_g1"):
+            psi_sum = msm_jacobian(pk.psi, witness[pk.l :])
+        with profiling.phase("prove.h_at_tau_g1"):
+            h_sum = msm_jacobian(pk.t_of_tau_g1, h_coeffs[::-1])
+    else:
+        h_future = pool.g1("t_of_tau_g1", h_coeffs[::-1])
+        with profiling.phase("prove.pool_wait"):
+            a_sum = JacobianPoint.from_affine(a_future.result())
+            b_sum = JacobianPoint.from_affine(b_future.result(), FQ2)
+            psi_sum = JacobianPoint.from_affine(psi_future.result())
+            h_sum = JacobianPoint.from_affine(h_future.result())
+
+    with profiling.phase("prove.to_affine"):
+        a_at_tau_g1 = JacobianPoint.from_affine(pk.alfa_g1) + a_sum
+        b_at_tau_g2 = JacobianPoint.from_affine(pk.beta_g2) + b_sum
+        c_at_tau_g1 = psi_sum + h_sum
+        a_g1, c_g1 = typing.cast(
+            list[G1Point], batch_to_affine([a_at_tau_g1, c_at_tau_g1])
         )
+        b_g2 = typing.cast(G2Point, b_at_tau_g2.to_affine())
+    return a_g1, b_g2, c_g1
 
-    a_poly = compute(polynomials.a_polys, witness)
-    b_poly = compute(polynomials.b_polys, witness)
-    c_poly = compute(polynomials.c_polys, witness)
-
-    a_at_tau_g1 = typing.cast(
-        G1Point,
-        add(
-            ts.alfa_g1,
-            at_tau_g(
-                a_poly.coefficients(order="desc", size=polynomials.n),
-                ts.powers_of_tau_g1,
-            ),
-        ),
-    )
-    b_at_tau_g2 = typing.cast(
-        G2Point,
-        add(
-            ts.beta_g2,
-            at_tau_g(
-                b_poly.coefficients(order="desc", size=polynomials.n),
-                ts.powers_of_tau_g2,
-            ),
-        ),
-    )
-    h_poly = calculate_h(a_poly, b_poly, c_poly, polynomials.t_poly)
-    psi = functools.reduce(add, map(lambda x, y: multiply(x, y), ts.psi[ts.l:], witness[ts.l:]))
-    
-    ht_at_tau_g1 = typing.cast(
-        G1Point,
-        at_tau_g(
-            h_poly.coefficients(order="desc", size=polynomials.n - 1),
-            ts.t_of_tau_g1,
-        ),
+
+def prove_many(
+    polynomials: Polinomials,
+    witnesses: Iterable[list[int]],
+    ts: TrustedSetup | ProvingKey,
+    workers: int | None = None,
+    allow_fake_proof: bool = False,
+) -> list[TimedProof]:
+    """
+    Proofs of many witnesses of one circuit with the time each took, see
+    prover_pool.prove_many
+    """
+    return prover_pool.prove_many(
+        prove, polynomials, witnesses, _proving_key(ts), workers, allow_fake_proof
     )
-    c_at_tau_g1 = typing.cast(G1Point, add(psi, ht_at_tau_g1))
-    return a_at_tau_g1, b_at_tau_g2, c_at_tau_g1
 
 
-def verify(A_g1: G1Point, B_g2: G2Point, C_g1: G1Point, ts: TrustedSetup, public: list[int]) -> bool:
-    x1 = functools.reduce(add, map(multiply, ts.psi[:ts.l], public))
-    return final_exponentiate(pairing(B_g2, A_g1)) == final_exponentiate(
-        pairing(ts.delta_g2, C_g1) * pairing(ts.beta_g2, ts.alfa_g1) * pairing(ts.gamma_g2, x1)
+def verify(
+    A_g1: G1Point,
+    B_g2: G2Point,
+    C_g1: G1Point,
+    key: TrustedSetup | VerifyingKey | PreparedVerifyingKey,
+    public: list[int],
+) -> bool:
+    if isinstance(key, PreparedVerifyingKey):
+        x1 = msm(key.psi, public)
+        # e(B, A) * e(delta, -C) * e(gamma, -x1) == e(alfa, beta), only B is not prepared
+        return (
+            pairing_product(
+                [(B_g2, A_g1), (key.delta_g2, neg(C_g1)), (key.gamma_g2, neg(x1))]
+            )
+            == key.alfa_beta
+        )
+    vk = _verifying_key(key)
+    x1 = msm(vk.psi, public)
+    # e(B, A) == e(delta, C) * e(beta, alfa) * e(gamma, x1) as one pairing product
+    return pairing_check(
+        [
+            (B_g2, neg(A_g1)),
+            (vk.delta_g2, C_g1),
+            (vk.beta_g2, vk.alfa_g1),
+            (vk.gamma_g2, x1),
+        ]
     )
 
 
+def verify_batch(
+    proofs: Sequence[Proof],
+    publics: Sequence[list[int]],
+    key: TrustedSetup | VerifyingKey,
+) -> list[bool]:
+    """
+    Verify k proofs at once with a random linear combination:
+
+    prod e(B_j, r_j A_j) == e(beta, alfa)^sum(r_j) * e(delta, sum r_j C_j) * e(gamma, sum r_j x_j)
+
+    which is k + 3 Miller loops and one final exponentiation, and the public
+    input terms collapse into a single MSM over psi[:l]. When the combined
+    check fails, the batch is bisected to find the offending proofs. A public
+    input whose length is not l fails on its own and stays out of the batch.
+    """
+    assert len(proofs) == len(publics), "proofs and public inputs size is not equal"
+    vk = _verifying_key(key)
+
+    def combined_check(indices: list[int]) -> bool:
+        scalars = [1 + secrets.randbelow(2**128) for _ in indices]
+        a_terms = batch_to_affine(
+            [JacobianPoint.from_affine(proofs[idx][0]) * r for idx, r in zip(indices, scalars)]
+        )
+        c_sum = msm([proofs[idx][2] for idx in indices], scalars)
+        public_scalars = [
+            sum(r * publics[idx][col] for idx, r in zip(indices, scalars)) % curve_order
+            for col in range(len(vk.psi))
+        ]
+        x_sum = msm(vk.psi, public_scalars)
+        pairs = [(proofs[idx][1], neg(a)) for idx, a in zip(indices, a_terms)]
+        pairs += [
+            (vk.beta_g2, multiply(vk.alfa_g1, sum(scalars) % curve_order)),
+            (vk.delta_g2, c_sum),
+            (vk.gamma_g2, x_sum),
+        ]
+        try:
+            return pairing_check(pairs)
+        except PairingError:
+            return False
+
+    result = [False] * len(proofs)
+
+    def bisect(indices: list[int]) -> None:
+        if not indices or combined_check(indices):
+            for idx in indices:
+                result[idx] = True
+            return
+        if len(indices) > 1:
+            middle = len(indices) // 2
+            bisect(indices[:middle])
+            bisect(indices[middle:])
+
+    bisect([idx for idx, public in enumerate(publics) if len(public) == len(vk.psi)])
+    return result
+
+
+def some_function_circuit() -> tuple[Matrix, Matrix, Matrix]:
+    """
+    A, B and C of out = 3x²y + 5xy - x - 2y + 3 over [1, out, x, y, v1, v2]
+    """
+    A = [[0, 0, 3, 0, 0, 0], [0, 0, 0, 0, 1, 0], [0, 0, 1, 0, 0, 0]]
+    B = [[0, 0, 1, 0, 0, 0], [0, 0, 0, 1, 0, 0], [0, 0, 0, 5, 0, 0]]
+    C = [[0, 0, 0, 0, 1, 0], [0, 0, 0, 0, 0, 1], [-3, 1, 1, 2, 0, -1]]
+    return A, B, C
+
+
+def some_function_witness(x: int, y: int, noise: int = 0) -> list[int]:
+    # the witness vector with the intermediate variables inside,
+    # noise breaks it while keeping out and v2 as they were
+    v1 = 3 * x * x
+    out = v1 * y + 5 * x * y - x - 2 * y + 3
+    return [1, out, x, y + noise, v1, v1 * y]
+
+
+def some_function_polynomials() -> tuple[tuple[int, ...], Polinomials]:
+    A, B, C = some_function_circuit()
+    interpolation_set = build_interpolation_set(len(A))
+    polynomials = prepare_polinomials(A, B, C, interpolation_set, len(A[0]), len(A))
+    return tuple(interpolation_set), polynomials
+
+
+def some_function_setup() -> tuple[Polinomials, TrustedSetup]:
+    # the public input of the circuit is [1, out], so l is 2
+    interpolation_set, polynomials = some_function_polynomials()
+    return polynomials, prepare_trusted_setup(interpolation_set, polynomials, 2)
+
+
 @pytest.mark.parametrize(
     "x,y,noise,expected",
     [
@@ -271,6 +612,155 @@ def test_qap_at_points_3_some_function(
         allow_fake_proof=True,
     )
     assert verify(Ag1, Bg2, Cg1, ts, public_input) == expected
+    pvk = PreparedVerifyingKey.from_setup(ts)
+    assert verify(Ag1, Bg2, Cg1, pvk, public_input) == expected
+
+
+def test_trusted_setup_keyfile(tmp_path) -> None:
+    polynomials, ts = some_function_setup()
+    save_trusted_setup(ts, tmp_path / "setup.bin")
+    loaded = load_trusted_setup(tmp_path / "setup.bin")
+    for field in TrustedSetup.__dataclass_fields__:
+        value = getattr(loaded, field)
+        if isinstance(value, Sequence):
+            value = tuple(value)
+        assert value == getattr(ts, field)
+    witness = some_function_witness(3, 4)
+    proof = prove(polynomials, witness, loaded)
+    assert proof == prove(polynomials, witness, ts)
+    assert verify(*proof, loaded, witness[:2])
+
+
+def test_polinomials_at() -> None:
+    interpolation_set, polynomials = some_function_polynomials()
+    # coefficients of every column polynomial, interpolated one by one
+    columns = [
+        [intt(column, polynomials.domain) for column in zip(*matrix.to_dense())]
+        for matrix in polynomials.matrices
+    ]
+    for x in [random.randint(0, curve_order - 1), int(interpolation_set[2])]:
+        assert polynomials.at(x) == [
+            [evaluate(coeffs, x) for coeffs in group] for group in columns
+        ]
+
+
+def test_prepare_polinomials_cache(tmp_path, monkeypatch) -> None:
+    A, B, C = some_function_circuit()
+    interpolation_set = build_interpolation_set(len(A))
+    cache = CircuitCache(tmp_path)
+    expected = prepare_polinomials(A, B, C, interpolation_set, len(A[0]), len(A))
+    miss = prepare_polinomials(A, B, C, interpolation_set, len(A[0]), len(A), cache)
+    assert cache.size() > 0
+
+    def fail(*args) -> typing.NoReturn:
+        raise AssertionError("a cache hit compiles nothing")
+
+    monkeypatch.setattr(sys.modules[__name__], "compile_matrices", fail)
+    hit = prepare_polinomials(A, B, C, interpolation_set, len(A[0]), len(A), cache)
+    for polys in (miss, hit):
+        assert [m.to_dense() for m in polys.matrices] == [
+            m.to_dense() for m in expected.matrices
+        ]
+        assert polys.at(5) == expected.at(5)
+
+
+def test_proving_and_verifying_keys(tmp_path) -> None:
+    polynomials, ts = some_function_setup()
+    pk, vk = ts.proving_key(), ts.verifying_key()
+    assert len(vk.psi) == 2
+    save_proving_key(pk, tmp_path / "pk.bin")
+    save_verifying_key(vk, tmp_path / "vk.bin")
+    loaded_pk = load_proving_key(tmp_path / "pk.bin")
+    assert load_verifying_key(tmp_path / "vk.bin") == vk
+
+    witness = some_function_witness(3, 4)
+    proof = prove(polynomials, witness, loaded_pk)
+    assert proof == prove(polynomials, witness, ts)
+    with KeyFile(tmp_path / "pk.bin") as keys:
+        assert prove(polynomials, witness, proving_key_from(keys)) == proof
+    _, other = some_function_setup()
+    save_proving_key(other.proving_key(), tmp_path / "other.bin")
+    with MSMPool(tmp_path / "pk.bin", workers=2) as pool:
+        assert prove(polynomials, witness, loaded_pk, pool=pool) == proof
+    # a pool on another setup's key would mix its MSMs with pk's alfa and beta
+    with MSMPool(tmp_path / "other.bin", workers=1) as pool:
+        with pytest.raises(AssertionError):
+            prove(polynomials, witness, loaded_pk, pool=pool)
+    assert verify(*proof, vk, witness[:2])
+    assert not verify(*proof, vk, [1, 161])
+    assert verify(*proof, PreparedVerifyingKey.from_setup(vk), witness[:2])
+    assert verify_batch([proof, proof], [witness[:2], [1, 161]], vk) == [True, False]
+
+
+def test_prove_many() -> None:
+    polynomials, ts = some_function_setup()
+    pk, vk = ts.proving_key(), ts.verifying_key()
+    witnesses = [some_function_witness(x, y) for x, y in [(3, 4), (10, 10), (2, 7), (5, 1)]]
+    results = prove_many(polynomials, witnesses, pk, workers=2)
+    assert [r.proof for r in results] == [prove(polynomials, w, pk) for w in witnesses]
+    assert all(r.seconds > 0 for r in results)
+    assert verify_batch([r.proof for r in results], [w[:2] for w in witnesses], vk) == [
+        True
+    ] * len(witnesses)
+
+
+def test_profiled_prove() -> None:
+    interpolation_set, polynomials = some_function_polynomials()
+    with profiling.profile() as sink:
+        ts = prepare_trusted_setup(interpolation_set, polynomials, 2)
+        witness = some_function_witness(3, 4)
+        proof = prove(polynomials, witness, ts)
+        assert verify(*proof, ts, witness[:2])
+    assert {"setup.psi", "setup.g1", "setup.g2"} <= set(sink.phases)
+    assert {
+        "prove.compute",
+        "prove.calculate_h",
+        "prove.a_at_tau_g1",
+        "prove.b_at_tau_g2",
+        "prove.psi_g1",
+        "prove.h_at_tau_g1",
+    } <= set(sink.phases)
+    assert sink.counters[profiling.PAIRINGS] == 4
+    assert sink.counters[profiling.FINAL_EXPONENTIATIONS] == 1
+    assert sink.counters[profiling.FIELD_MULTIPLICATIONS] > 0
+    assert sink.counters[profiling.EC_ADDITIONS] > 0
+    assert sink.counters[profiling.SCALAR_MULTIPLICATIONS] > 0
+    # nothing is recorded once the profile is over
+    prove(polynomials, witness, ts)
+    assert sink.phases["prove.compute"].calls == 1
+
+
+def test_parallel_trusted_setup(monkeypatch) -> None:
+    interpolation_set, polynomials = some_function_polynomials()
+    # small chunks so that even this circuit is split between the workers
+    monkeypatch.setattr(fixed_base, "CHUNK_SIZE", 3)
+    state = random.getstate()
+    sequential = prepare_trusted_setup(interpolation_set, polynomials, 2)
+    random.setstate(state)
+    parallel = prepare_trusted_setup(interpolation_set, polynomials, 2, workers=2)
+    assert parallel == sequential
+
+
+def test_verify_batch() -> None:
+    polynomials, ts = some_function_setup()
+    proofs = []
+    publics = []
+    for x, y, noise in [(3, 4, 0), (10, 10, 0), (5, 7, 1), (2, 9, 0)]:
+        witness = some_function_witness(x, y, noise)
+        proofs.append(prove(polynomials, witness, ts, allow_fake_proof=True))
+        publics.append(witness[:2])
+    assert verify_batch(proofs, publics, ts) == [True, True, False, True]
+    assert verify_batch(proofs[:2], publics[:2], ts) == [True, True]
+    # a valid proof checked against somebody else's public input
+    assert verify_batch(proofs[:2], publics[1::-1], ts) == [False, False]
+    assert verify_batch([], [], ts) == []
+    # too long would be truncated to psi[:l], too short would index past it
+    wrong_sizes = [publics[0] + [0], publics[1][:1], publics[3]]
+    assert verify_batch([proofs[0], proofs[1], proofs[3]], wrong_sizes, ts) == [
+        False,
+        False,
+        True,
+    ]
 
 
 if __name__ == "__main__":
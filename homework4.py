@@ -19,10 +19,16 @@
 # You may use a library for point multiplication, but everything else you must do from scratch. Remember, when you compute the multiplicative inverse, you need to do it with respect to the curve order.
 # Pay close attention to the distinction between the curve order and the prime number $p$ we compute the modulus of $y^2=x^3+b \pmod p$.
 
+import functools
 import hashlib
 import hmac
+import random
+from typing import Sequence
 from ecpy.curves import Curve, Point
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+import pytest
+
+from field import batch_inverse
 
 
 # Extended Euclidean Algorithm
@@ -97,21 +103,158 @@ def sign(message: str, private_key: bytes) -> Signature:
     )
 
 
+class InvalidPublicKeyError(Exception):
+    pass
+
+
+def _check_pubkey(curve: Curve, pubkey: tuple[int, int]) -> None:
+    # the Shamir path does not go through ecpy's Point, which checked this;
+    # an off-curve key would be computed with on a different curve
+    x, y = pubkey
+    if not (0 <= x < curve.field and 0 <= y < curve.field) or not curve.is_on_curve(
+        Point(x, y, curve=curve, check=False)
+    ):
+        raise InvalidPublicKeyError(f"public key {pubkey} is not on {curve.name}")
+
+
 def verify(message: str, signature: Signature) -> bool:
     curve = Curve.get_curve("secp256k1")
-    msghash = int.from_bytes(_sha256_hash(message=message))
+    _check_pubkey(curve, signature.pubkey)
     s1 = _inverse(signature.s, curve.order)
-    part_a = curve.mul_point(msghash * s1, curve.generator)
-    part_b = curve.mul_point(
-        signature.r * s1,
-        Point(signature.pubkey[0], signature.pubkey[1], curve=curve),
-    )    
-    R_verify = add_points(
-        (part_a.x, part_a.y),
-        (part_b.x, part_b.y),
-        field=curve.field
+    return _verify(curve, message, signature, s1)
+
+
+def verify_many(messages: Sequence[str], signatures: Sequence[Signature]) -> list[bool]:
+    """
+    verify for every pair, the s of all signatures are inverted at once
+    """
+    assert len(messages) == len(signatures), "every message needs a signature"
+    curve = Curve.get_curve("secp256k1")
+    for signature in signatures:
+        _check_pubkey(curve, signature.pubkey)
+    if any(signature.s % curve.order == 0 for signature in signatures):
+        return [verify(m, sig) for m, sig in zip(messages, signatures)]
+    s_invs = batch_inverse([signature.s for signature in signatures], curve.order)
+    return [
+        _verify(curve, message, signature, s1)
+        for message, signature, s1 in zip(messages, signatures, s_invs)
+    ]
+
+
+def _verify(curve: Curve, message: str, signature: Signature, s1: int) -> bool:
+    msghash = int.from_bytes(_sha256_hash(message=message))
+    u1 = msghash * s1 % curve.order
+    u2 = signature.r * s1 % curve.order
+    R_verify = _to_affine(
+        _shamir(u1, u2, signature.pubkey, curve), field=curve.field
     )
-    return R_verify[0] == signature.r   
+    return R_verify is not None and R_verify[0] == signature.r
+
+
+# Shamir's trick: u1 * G + u2 * Q in one double-and-add pass over the joint
+# width-w NAF digits of u1 and u2, so the doublings are shared. The odd
+# multiples of G come from a table built once, the ones of Q are built per call.
+# Points are Jacobian (X, Y, Z) tuples of ints, x = X / Z**2 and y = Y / Z**3,
+# with None for infinity; secp256k1 has a = 0.
+G_WINDOW = 8
+Q_WINDOW = 4
+
+type JacobianPoint = tuple[int, int, int] | None
+
+
+def _wnaf(k: int, width: int) -> list[int]:
+    # little-endian digits, odd digits in (-2**(width - 1), 2**(width - 1)) and
+    # at least width - 1 zeros between any two non-zero digits
+    digits = []
+    while k:
+        digit = 0
+        if k & 1:
+            digit = k & ((1 << width) - 1)
+            if digit >= 1 << (width - 1):
+                digit -= 1 << width
+            k -= digit
+        digits.append(digit)
+        k >>= 1
+    return digits
+
+
+def _double(p: JacobianPoint, field: int) -> JacobianPoint:
+    if p is None or p[1] == 0:
+        return None
+    x, y, z = p
+    a = x * x % field
+    b = y * y % field
+    c = b * b % field
+    d = 2 * ((x + b) ** 2 - a - c) % field
+    e = 3 * a % field
+    x3 = (e * e - 2 * d) % field
+    return (x3, (e * (d - x3) - 8 * c) % field, 2 * y * z % field)
+
+
+def _add_affine(
+    p: JacobianPoint, q: tuple[int, int], field: int
+) -> JacobianPoint:
+    # mixed addition of an affine point
+    if p is None:
+        return (q[0], q[1], 1)
+    x1, y1, z1 = p
+    zz = z1 * z1 % field
+    h = (q[0] * zz - x1) % field
+    r = (q[1] * zz * z1 - y1) % field
+    if h == 0:
+        return _double(p, field) if r == 0 else None
+    hh = h * h % field
+    hhh = h * hh % field
+    v = x1 * hh % field
+    x3 = (r * r - hhh - 2 * v) % field
+    return (x3, (r * (v - x3) - y1 * hhh) % field, z1 * h % field)
+
+
+def _to_affine(p: JacobianPoint, field: int) -> tuple[int, int] | None:
+    if p is None:
+        return None
+    z_inv = _inverse(p[2], field)
+    z_inv2 = z_inv * z_inv % field
+    return (p[0] * z_inv2 % field, p[1] * z_inv2 * z_inv % field)
+
+
+def _odd_multiples(
+    point: tuple[int, int], width: int, field: int
+) -> list[tuple[int, int]]:
+    # point, 3 * point, ..., (2**(width - 1) - 1) * point, normalized together
+    twice = _to_affine(_double((*point, 1), field), field)
+    multiples: list[JacobianPoint] = [(*point, 1)]
+    for _ in range((1 << (width - 2)) - 1):
+        multiples.append(_add_affine(multiples[-1], twice, field))
+    z_invs = batch_inverse([z for _, _, z in multiples], field)
+    return [
+        (x * z_inv * z_inv % field, y * z_inv * z_inv * z_inv % field)
+        for (x, y, _), z_inv in zip(multiples, z_invs)
+    ]
+
+
+@functools.cache
+def _generator_table(curve_name: str) -> list[tuple[int, int]]:
+    curve = Curve.get_curve(curve_name)
+    generator = (curve.generator.x, curve.generator.y)
+    return _odd_multiples(generator, G_WINDOW, curve.field)
+
+
+def _shamir(u1: int, u2: int, pubkey: tuple[int, int], curve: Curve) -> JacobianPoint:
+    field = curve.field
+    tables = _generator_table(curve.name), _odd_multiples(pubkey, Q_WINDOW, field)
+    nafs = _wnaf(u1, G_WINDOW), _wnaf(u2, Q_WINDOW)
+    result: JacobianPoint = None
+    for idx in range(max(map(len, nafs)) - 1, -1, -1):
+        result = _double(result, field)
+        for naf, table in zip(nafs, tables):
+            digit = naf[idx] if idx < len(naf) else 0
+            if digit > 0:
+                result = _add_affine(result, table[digit >> 1], field)
+            elif digit < 0:
+                x, y = table[-digit >> 1]
+                result = _add_affine(result, (x, field - y), field)
+    return result
 
 
 def add_points(a: tuple[int, int] | None, b: tuple[int, int] | None, field: int) -> tuple[int, int] | None:
@@ -138,6 +281,56 @@ def add_points(a: tuple[int, int] | None, b: tuple[int, int] | None, field: int)
         return None
 
 
+def test_shamir_matches_separate_multiplications() -> None:
+    curve = Curve.get_curve("secp256k1")
+    rnd = random.Random(4)
+    G = curve.generator
+    Q = curve.mul_point(rnd.randrange(1, curve.order), G)
+    pubkey = (Q.x, Q.y)
+    cases = [(rnd.randrange(curve.order), rnd.randrange(curve.order)) for _ in range(5)]
+    cases += [(0, 5), (7, 0), (1, 1), (2**255 % curve.order, curve.order - 1)]
+    for u1, u2 in cases:
+        expected = add_points(
+            None if u1 == 0 else _affine(curve.mul_point(u1, G)),
+            None if u2 == 0 else _affine(curve.mul_point(u2, Q)),
+            field=curve.field,
+        )
+        assert _to_affine(_shamir(u1, u2, pubkey, curve), curve.field) == expected
+    # u1 * G + u2 * G with u1 + u2 = 0 and u1 = u2
+    g = (G.x, G.y)
+    assert _shamir(3, curve.order - 3, g, curve) is None
+    assert _to_affine(_shamir(3, 3, g, curve), curve.field) == _affine(
+        curve.mul_point(6, G)
+    )
+
+
+def _affine(point: Point) -> tuple[int, int]:
+    return (point.x, point.y)
+
+
+def test_verify_many() -> None:
+    messages = ["elliptic", "curve", "ecdsa"]
+    signatures = [sign(message=m, private_key=b"0xdead") for m in messages]
+    assert verify_many(messages, signatures) == [True] * 3
+    assert verify_many(messages[::-1], signatures) == [False, True, False]
+    assert verify_many([], []) == []
+
+
+@pytest.mark.parametrize("pubkey", [(1, 1), (0, 0)])
+def test_off_curve_pubkey_is_rejected(pubkey: tuple[int, int]) -> None:
+    signature = sign(message="ecdsa", private_key=b"0xdead")
+    forged = replace(signature, pubkey=pubkey)
+    with pytest.raises(InvalidPublicKeyError):
+        verify("ecdsa", forged)
+    with pytest.raises(InvalidPublicKeyError):
+        verify_many(["ecdsa", "ecdsa"], [signature, forged])
+    # the same point with a coordinate shifted by the field modulus
+    curve = Curve.get_curve("secp256k1")
+    shifted = (signature.pubkey[0] + curve.field, signature.pubkey[1])
+    with pytest.raises(InvalidPublicKeyError):
+        verify("ecdsa", replace(signature, pubkey=shifted))
+
+
 if __name__ == "__main__":
     from pprint import pprint
 
@@ -2,13 +2,19 @@ from typing import Sequence
 import pytest
 from enum import IntEnum
 import itertools
-from py_ecc.bn128 import G1, G2, pairing, add, multiply, curve_order
+import numpy.typing as npt
+from py_ecc.bn128 import G1, G2, curve_order
 from py_ecc.fields import (
     bn128_FQ as FQ,
     bn128_FQ2 as FQ2,
     bn128_FQ12 as FQ12,
 )
 
+from jacobian import JacobianPoint, batch_to_affine
+from msm import msm_jacobian
+from pairings import pairing
+from r1cs import BatchCheck, SparseMatrix, as_sparse, check_batch
+
 
 class Color(IntEnum):
     RED = 1
@@ -16,13 +22,11 @@ class Color(IntEnum):
     GREEN = 3
 
 
-def matrix_vec(mt: list[list[int]], vec: list[int]) -> list[int]:
-    assert len(mt[0]) == len(vec)
-    result = [0] * len(vec)
-    for i in range(len(mt)):
-        for j in range(len(mt[0])):
-            result[i] += mt[i][j] * vec[j]
-    return result
+type Matrix = list[list[int]] | SparseMatrix
+
+
+def matrix_vec(mt: Matrix, vec: list[int]) -> list[int]:
+    return as_sparse(mt).dot(vec)
 
 
 def hadamard(vec1: list[int], vec2: list[int]) -> list[int]:
@@ -35,13 +39,14 @@ def hadamard(vec1: list[int], vec2: list[int]) -> list[int]:
 type ECPointList = list[tuple[FQ, FQ]] | list[tuple[FQ2, FQ2]]
 
 
-def matrix_vec_point(mt: list[list[int]], vec: ECPointList) -> ECPointList:
-    assert len(mt[0]) == len(vec)
-    result = [None] * len(vec)
-    for i in range(len(mt)):
-        for j in range(len(mt[0])):
-            result[i] = add(result[i], multiply(vec[j], mt[i][j] % curve_order))
-    return result
+def matrix_vec_point(mt: Matrix, vec: ECPointList) -> ECPointList:
+    sparse = as_sparse(mt)
+    assert sparse.cols == len(vec)
+    result = []
+    for idx in range(sparse.rows):
+        indices, data = sparse.row(idx)
+        result.append(msm_jacobian([vec[j] for j in indices], data))
+    return batch_to_affine(result)
 
 
 def hadamard_points(vec1: list[FQ], vec2: list[FQ2]) -> list[FQ12]:
@@ -54,10 +59,44 @@ def hadamard_points(vec1: list[FQ], vec2: list[FQ2]) -> list[FQ12]:
 
 
 def vec_to_g(vec: Sequence[int], g: FQ | FQ2) -> ECPointList:
-    result = [0] * len(vec)
-    for i in range(len(vec)):
-        result[i] = multiply(g, vec[i] % curve_order)
-    return result
+    base = JacobianPoint.from_affine(g)
+    return batch_to_affine([base * (x % curve_order) for x in vec])
+
+
+# R1CS of the 3-coloring problem below, witness is [1, x, y, a, b, c, d]
+COLORING_L = SparseMatrix.from_dense(
+    [
+        [0, 1, 0, 0, 0, 0, 0],
+        [0, 0, 0, 1, 0, 0, 0],
+        [0, 0, 0, 1, 0, 0, 0],
+        [0, 1, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 1, 0],
+        [0, 0, 1, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 0, 1],
+    ]
+)
+COLORING_R = SparseMatrix.from_dense(
+    [
+        [0, 0, 1, 0, 0, 0, 0],
+        [0, 0, 0, 1, 0, 0, 0],
+        [-36, 0, 0, 11, -1, 0, 0],
+        [0, 1, 0, 0, 0, 0, 0],
+        [0, 1, 0, 0, 0, 0, 0],
+        [0, 0, 1, 0, 0, 0, 0],
+        [0, 0, 1, 0, 0, 0, 0],
+    ]
+)
+COLORING_O = SparseMatrix.from_dense(
+    [
+        [0, 0, 0, 1, 0, 0, 0],
+        [0, 0, 0, 0, 1, 0, 0],
+        [-36, 0, 0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0, 1, 0],
+        [6, -11, 0, 0, 0, 6, 0],
+        [0, 0, 0, 0, 0, 0, 1],
+        [6, 0, -11, 0, 0, 0, 6],
+    ]
+)
 
 
 # ======== problem 1
@@ -106,35 +145,19 @@ def graph_3_coloring_r1cs(w: list[int]) -> bool:
     # 6) y*y = d
     # 7) d*y = 6*d - 11*y + 6
 
-    # our witness in that case will be [1, x, y, a, b, c, d] and L, R, O is encoded below
-    L = [
-        [0, 1, 0, 0, 0, 0, 0],
-        [0, 0, 0, 1, 0, 0, 0],
-        [0, 0, 0, 1, 0, 0, 0],
-        [0, 1, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 1, 0],
-        [0, 0, 1, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 1],
-    ]
-    R = [
-        [0, 0, 1, 0, 0, 0, 0],
-        [0, 0, 0, 1, 0, 0, 0],
-        [-36, 0, 0, 11, -1, 0, 0],
-        [0, 1, 0, 0, 0, 0, 0],
-        [0, 1, 0, 0, 0, 0, 0],
-        [0, 0, 1, 0, 0, 0, 0],
-        [0, 0, 1, 0, 0, 0, 0],
-    ]
-    C = [
-        [0, 0, 0, 1, 0, 0, 0],
-        [0, 0, 0, 0, 1, 0, 0],
-        [-36, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 1, 0],
-        [6, -11, 0, 0, 0, 6, 0],
-        [0, 0, 0, 0, 0, 0, 1],
-        [6, 0, -11, 0, 0, 0, 6],
-    ]
-    return hadamard(matrix_vec(L, w), matrix_vec(R, w)) == matrix_vec(C, w)
+    # our witness in that case will be [1, x, y, a, b, c, d] and L, R, O is encoded
+    # in COLORING_L, COLORING_R and COLORING_O above
+    return hadamard(matrix_vec(COLORING_L, w), matrix_vec(COLORING_R, w)) == matrix_vec(
+        COLORING_O, w
+    )
+
+
+def graph_3_coloring_r1cs_batch(ws: list[list[int]] | npt.NDArray) -> BatchCheck:
+    """
+    Same check as graph_3_coloring_r1cs for many witnesses at once,
+    one row of ws per witness
+    """
+    return check_batch(COLORING_L, COLORING_R, COLORING_O, ws)
 
 
 def graph_3_coloring_r1cs_points(wG1: list[FQ], wG2: list[FQ2]) -> bool:
@@ -166,36 +189,9 @@ def graph_3_coloring_r1cs_points(wG1: list[FQ], wG2: list[FQ2]) -> bool:
     assert hadamard_points(wG1, [G2] * len(wG1)) == hadamard_points(
         [G1] * len(wG2), wG2
     )
-    L = [
-        [0, 1, 0, 0, 0, 0, 0],
-        [0, 0, 0, 1, 0, 0, 0],
-        [0, 0, 0, 1, 0, 0, 0],
-        [0, 1, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 1, 0],
-        [0, 0, 1, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 0, 1],
-    ]
-    R = [
-        [0, 0, 1, 0, 0, 0, 0],
-        [0, 0, 0, 1, 0, 0, 0],
-        [-36, 0, 0, 11, -1, 0, 0],
-        [0, 1, 0, 0, 0, 0, 0],
-        [0, 1, 0, 0, 0, 0, 0],
-        [0, 0, 1, 0, 0, 0, 0],
-        [0, 0, 1, 0, 0, 0, 0],
-    ]
-    C = [
-        [0, 0, 0, 1, 0, 0, 0],
-        [0, 0, 0, 0, 1, 0, 0],
-        [-36, 0, 0, 0, 0, 0, 0],
-        [0, 0, 0, 0, 0, 1, 0],
-        [6, -11, 0, 0, 0, 6, 0],
-        [0, 0, 0, 0, 0, 0, 1],
-        [6, 0, -11, 0, 0, 0, 6],
-    ]
     return hadamard_points(
-        matrix_vec_point(L, wG1), matrix_vec_point(R, wG2)
-    ) == hadamard_points(matrix_vec_point(C, wG1), [G2] * len(C[0]))
+        matrix_vec_point(COLORING_L, wG1), matrix_vec_point(COLORING_R, wG2)
+    ) == hadamard_points(matrix_vec_point(COLORING_O, wG1), [G2] * COLORING_O.cols)
 
 
 @pytest.mark.parametrize("color", [Color.RED, Color.GREEN, Color.BLUE])
@@ -256,6 +252,20 @@ def test_3_coloring_r1cs_not_happy_path_mess_constraints(
     assert not graph_3_coloring_r1cs(w)
 
 
+def test_3_coloring_r1cs_batch() -> None:
+    ws = []
+    for x, y in itertools.product([1, 2, 3], repeat=2):
+        a = x * y
+        ws.append([1, x, y, a, a * a, x * x, y * y])
+        ws.append([1, x, y, a + 1, a * a, x * x, y * y])
+    result = graph_3_coloring_r1cs_batch(ws)
+    assert result.satisfied.tolist() == [graph_3_coloring_r1cs(w) for w in ws]
+    # a + 1 breaks x * y = a, which is the first constraint
+    assert result.first_failure[1::2].tolist() == [0] * 9
+    # same colors pass the first two constraints and fail a * (-b + 11a - 36) = -36
+    assert result.first_failure[0] == 2
+
+
 @pytest.mark.parametrize("color", [Color.RED, Color.GREEN, Color.BLUE])
 def test_3_coloring_r1cs_points_not_happy_path(color: Color) -> None:
     x = color.value
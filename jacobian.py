@@ -0,0 +1,236 @@
+"""
+Jacobian coordinates for BN254 G1/G2 points
+
+An affine point (x, y) is stored as (X, Y, Z) with x = X / Z**2 and y = Y / Z**3,
+so addition and doubling need no field inversion. Points go back to the affine
+py_ecc representation (G1Point / G2Point) only at API boundaries, and
+batch_to_affine normalizes a whole list with a single inversion.
+"""
+
+from typing import Sequence
+import random
+from py_ecc.bn128 import (
+    curve_order,
+    add,
+    double,
+    multiply,
+    neg,
+    G1,
+    G2,
+    FQ,
+    FQ2,
+)
+import pytest
+
+from field import batch_inverse_elements
+import profiling
+from profiling import EC_ADDITIONS, EC_DOUBLINGS, SCALAR_MULTIPLICATIONS
+
+# Elliptic curve points can be None (point at infinity)
+type G1Point = tuple[FQ, FQ] | None
+type G2Point = tuple[FQ2, FQ2] | None
+type Field = FQ | FQ2
+
+
+class JacobianPoint:
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x: Field, y: Field, z: Field) -> None:
+        self.x = x
+        self.y = y
+        self.z = z
+
+    @classmethod
+    def infinity(cls, field: type[FQ] | type[FQ2] = FQ) -> "JacobianPoint":
+        return cls(field.one(), field.one(), field.zero())
+
+    @classmethod
+    def from_affine(
+        cls, pt: G1Point | G2Point, field: type[FQ] | type[FQ2] = FQ
+    ) -> "JacobianPoint":
+        """
+        field is only used for the point at infinity, which carries no coordinates
+        """
+        if pt is None:
+            return cls.infinity(field)
+        x, y = pt
+        return cls(x, y, type(x).one())
+
+    @property
+    def field(self) -> type[FQ] | type[FQ2]:
+        return type(self.z)
+
+    def is_infinity(self) -> bool:
+        return self.z == self.field.zero()
+
+    def to_affine(self) -> G1Point | G2Point:
+        if self.is_infinity():
+            return None
+        z_inv = self.field.one() / self.z
+        z_inv2 = z_inv * z_inv
+        return (self.x * z_inv2, self.y * z_inv2 * z_inv)
+
+    def double(self) -> "JacobianPoint":
+        # dbl-2009-l for a = 0
+        if self.is_infinity():
+            return self
+        profiling.count(EC_DOUBLINGS)
+        a = self.x * self.x
+        b = self.y * self.y
+        c = b * b
+        d = (self.x + b) * (self.x + b) - a - c
+        d = d + d
+        e = a + a + a
+        x3 = e * e - d - d
+        c8 = c + c
+        c8 = c8 + c8
+        c8 = c8 + c8
+        y3 = e * (d - x3) - c8
+        z3 = self.y * self.z
+        return JacobianPoint(x3, y3, z3 + z3)
+
+    def __add__(self, other: "JacobianPoint") -> "JacobianPoint":
+        # add-2007-bl
+        if self.is_infinity():
+            return other
+        if other.is_infinity():
+            return self
+        profiling.count(EC_ADDITIONS)
+        z1z1 = self.z * self.z
+        z2z2 = other.z * other.z
+        u1 = self.x * z2z2
+        u2 = other.x * z1z1
+        s1 = self.y * other.z * z2z2
+        s2 = other.y * self.z * z1z1
+        h = u2 - u1
+        r = s2 - s1
+        if h == self.field.zero():
+            if r == self.field.zero():
+                return self.double()
+            return JacobianPoint.infinity(self.field)
+        i = (h + h) * (h + h)
+        j = h * i
+        r = r + r
+        v = u1 * i
+        x3 = r * r - j - v - v
+        y3 = r * (v - x3) - (s1 + s1) * j
+        z3 = self.z * other.z * h
+        return JacobianPoint(x3, y3, z3 + z3)
+
+    def add_affine(self, pt: G1Point | G2Point) -> "JacobianPoint":
+        """
+        Mixed addition with an affine point (Z2 = 1), madd-2007-bl
+        """
+        if pt is None:
+            return self
+        x2, y2 = pt
+        if self.is_infinity():
+            return JacobianPoint(x2, y2, type(x2).one())
+        profiling.count(EC_ADDITIONS)
+        z1z1 = self.z * self.z
+        u2 = x2 * z1z1
+        s2 = y2 * self.z * z1z1
+        h = u2 - self.x
+        r = s2 - self.y
+        if h == self.field.zero():
+            if r == self.field.zero():
+                return self.double()
+            return JacobianPoint.infinity(self.field)
+        hh = h * h
+        i = hh + hh
+        i = i + i
+        j = h * i
+        r = r + r
+        v = self.x * i
+        x3 = r * r - j - v - v
+        y3 = r * (v - x3) - (self.y + self.y) * j
+        z3 = self.z * h
+        return JacobianPoint(x3, y3, z3 + z3)
+
+    def __neg__(self) -> "JacobianPoint":
+        return JacobianPoint(self.x, -self.y, self.z)
+
+    def __sub__(self, other: "JacobianPoint") -> "JacobianPoint":
+        return self + (-other)
+
+    def __mul__(self, n: int) -> "JacobianPoint":
+        n = int(n) % curve_order
+        profiling.count(SCALAR_MULTIPLICATIONS)
+        result = JacobianPoint.infinity(self.field)
+        for bit in bin(n)[2:]:
+            result = result.double()
+            if bit == "1":
+                result = result + self
+        return result
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, JacobianPoint):
+            return NotImplemented
+        if self.is_infinity() or other.is_infinity():
+            return self.is_infinity() and other.is_infinity()
+        z1z1 = self.z * self.z
+        z2z2 = other.z * other.z
+        return (
+            self.x * z2z2 == other.x * z1z1
+            and self.y * z2z2 * other.z == other.y * z1z1 * self.z
+        )
+
+    def __repr__(self) -> str:
+        return f"JacobianPoint({self.x!r}, {self.y!r}, {self.z!r})"
+
+
+def batch_to_affine(points: Sequence[JacobianPoint]) -> list[G1Point | G2Point]:
+    """
+    Normalize all points with one field inversion (Montgomery's trick)
+    """
+    finite = [idx for idx, pt in enumerate(points) if not pt.is_infinity()]
+    result: list[G1Point | G2Point] = [None] * len(points)
+    if not finite:
+        return result
+    field = points[finite[0]].field
+    z_invs = batch_inverse_elements([points[idx].z for idx in finite], field.one())
+    for idx, z_inv in zip(finite, z_invs):
+        pt = points[idx]
+        z_inv2 = z_inv * z_inv
+        result[idx] = (pt.x * z_inv2, pt.y * z_inv2 * z_inv)
+    return result
+
+
+@pytest.mark.parametrize("generator,field", [(G1, FQ), (G2, FQ2)])
+def test_jacobian_matches_affine(generator, field) -> None:
+    rnd = random.Random(7)
+    a = multiply(generator, rnd.randint(1, curve_order - 1))
+    b = multiply(generator, rnd.randint(1, curve_order - 1))
+    ja = JacobianPoint.from_affine(a)
+    jb = JacobianPoint.from_affine(b)
+    assert (ja + jb).to_affine() == add(a, b)
+    assert (ja.double() + jb.double()).to_affine() == add(double(a), double(b))
+    assert ja.double().add_affine(b).to_affine() == add(double(a), b)
+    assert (ja + ja).to_affine() == double(a)
+    assert ja.add_affine(a).to_affine() == double(a)
+    assert (ja - ja).is_infinity()
+    assert (ja.double() + (-ja)).to_affine() == a
+    assert (ja * 12345).to_affine() == multiply(a, 12345)
+    assert (-ja).to_affine() == neg(a)
+    assert ja.double() == jb.add_affine(a) - jb + ja
+    inf = JacobianPoint.infinity(field)
+    assert (inf + ja).to_affine() == a
+    assert inf.add_affine(b).to_affine() == b
+    assert inf.to_affine() is None
+    assert JacobianPoint.from_affine(None, field) == inf
+
+
+def test_batch_to_affine() -> None:
+    base = JacobianPoint.from_affine(G1)
+    points = [base * k for k in (3, 0, 5, 1, 0, 7)]
+    assert batch_to_affine(points) == [
+        multiply(G1, k) if k else None for k in (3, 0, 5, 1, 0, 7)
+    ]
+    assert batch_to_affine([JacobianPoint.infinity()]) == [None]
+    assert batch_to_affine([]) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
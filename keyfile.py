@@ -0,0 +1,297 @@
+"""
+Versioned fixed-width binary format for Groth16 keys
+
+    header   magic (8 bytes), version (u32), number of sections (u32)
+    table    per section: name (16 bytes), kind (u32), count (u32), offset (u64)
+    data     sections one after another
+
+G1 points take 64 bytes (x, y), G2 points 128 bytes (x.c0, x.c1, y.c0, y.c1),
+every coordinate is a 32 byte big-endian integer. The point at infinity is
+stored as all zeros, which is not on either curve. Integers are u64.
+
+Files are read through mmap and points are decoded only when accessed, so a
+prover can take a slice of a section without reading the rest of the file.
+"""
+
+from collections.abc import Mapping, Sequence
+import mmap
+import os
+import random
+import struct
+from typing import overload
+from py_ecc.bn128 import (
+    curve_order,
+    multiply,
+    G1,
+    G2,
+    FQ,
+    FQ2,
+)
+import pytest
+
+# Elliptic curve points can be None (point at infinity)
+type G1Point = tuple[FQ, FQ] | None
+type G2Point = tuple[FQ2, FQ2] | None
+type Point = G1Point | G2Point
+
+MAGIC = b"ZKGROTH\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sII")
+SECTION = struct.Struct("<16sIIQ")
+INTEGER = struct.Struct("<Q")
+COORDINATE_SIZE = 32
+
+KIND_G1 = 1
+KIND_G2 = 2
+KIND_INT = 3
+ITEM_SIZE = {
+    KIND_G1: 2 * COORDINATE_SIZE,
+    KIND_G2: 4 * COORDINATE_SIZE,
+    KIND_INT: INTEGER.size,
+}
+
+
+class KeyFileError(Exception):
+    pass
+
+
+def _encode_coordinates(coordinates: Sequence[int]) -> bytes:
+    return b"".join(int(c).to_bytes(COORDINATE_SIZE, "big") for c in coordinates)
+
+
+def _decode_coordinates(data: bytes) -> list[int]:
+    return [
+        int.from_bytes(data[start : start + COORDINATE_SIZE], "big")
+        for start in range(0, len(data), COORDINATE_SIZE)
+    ]
+
+
+def encode_g1(point: G1Point) -> bytes:
+    if point is None:
+        return bytes(ITEM_SIZE[KIND_G1])
+    return _encode_coordinates([int(point[0]), int(point[1])])
+
+
+def encode_g2(point: G2Point) -> bytes:
+    if point is None:
+        return bytes(ITEM_SIZE[KIND_G2])
+    x, y = point
+    return _encode_coordinates([*map(int, x.coeffs), *map(int, y.coeffs)])
+
+
+def decode_g1(data: bytes) -> G1Point:
+    if not any(data):
+        return None
+    x, y = _decode_coordinates(data)
+    return FQ(x), FQ(y)
+
+
+def decode_g2(data: bytes) -> G2Point:
+    if not any(data):
+        return None
+    x0, x1, y0, y1 = _decode_coordinates(data)
+    return FQ2([x0, x1]), FQ2([y0, y1])
+
+
+_DECODERS = {KIND_G1: decode_g1, KIND_G2: decode_g2}
+
+
+class PointView(Sequence):
+    """
+    Read-only sequence of points backed by the mmap of a key file.
+    Slicing returns another view, nothing is decoded until indexed.
+    """
+
+    __slots__ = ("_buffer", "_offset", "_kind", "_indices")
+
+    def __init__(
+        self, buffer: mmap.mmap, offset: int, kind: int, indices: range
+    ) -> None:
+        self._buffer = buffer
+        self._offset = offset
+        self._kind = kind
+        self._indices = indices
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    @overload
+    def __getitem__(self, idx: int) -> Point: ...
+
+    @overload
+    def __getitem__(self, idx: slice) -> "PointView": ...
+
+    def __getitem__(self, idx: int | slice) -> "Point | PointView":
+        if isinstance(idx, slice):
+            return PointView(self._buffer, self._offset, self._kind, self._indices[idx])
+        size = ITEM_SIZE[self._kind]
+        start = self._offset + self._indices[idx] * size
+        return _DECODERS[self._kind](self._buffer[start : start + size])
+
+    def __repr__(self) -> str:
+        return f"PointView(kind={self._kind}, len={len(self)})"
+
+
+def write_keyfile(
+    path: str | os.PathLike,
+    g1: Mapping[str, Sequence[G1Point]] | None = None,
+    g2: Mapping[str, Sequence[G2Point]] | None = None,
+    integers: Mapping[str, int] | None = None,
+) -> None:
+    sections: list[tuple[str, int, list[bytes]]] = []
+    for name, points in (g1 or {}).items():
+        sections.append((name, KIND_G1, [encode_g1(p) for p in points]))
+    for name, points in (g2 or {}).items():
+        sections.append((name, KIND_G2, [encode_g2(p) for p in points]))
+    for name, value in (integers or {}).items():
+        sections.append((name, KIND_INT, [INTEGER.pack(value)]))
+    names = [name for name, _, _ in sections]
+    assert len(set(names)) == len(names), "section names are not unique"
+    assert all(len(name.encode()) <= 16 for name in names), "section name is too long"
+
+    offset = HEADER.size + SECTION.size * len(sections)
+    table = []
+    for name, kind, items in sections:
+        table.append(SECTION.pack(name.encode(), kind, len(items), offset))
+        offset += ITEM_SIZE[kind] * len(items)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(sections)))
+        f.writelines(table)
+        for _, _, items in sections:
+            f.writelines(items)
+
+
+class KeyFile:
+    """
+    Memory-mapped key file, sections are looked up by name.
+
+    The KeyFile owns the mapping. PointViews it hands out read from the same
+    mapping, so they stay valid until close(), which a with statement calls on
+    exit. A KeyFile that is never closed is unmapped when it and all of its
+    views have been garbage collected.
+    """
+
+    def __init__(self, path: str | os.PathLike) -> None:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise KeyFileError("file is too short")
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.sections = self._read_table()
+        except KeyFileError:
+            self._buffer.close()
+            raise
+
+    def _read_table(self) -> dict[str, tuple[int, int, int]]:
+        magic, version, count = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise KeyFileError("not a key file")
+        if version != VERSION:
+            raise KeyFileError(f"unsupported version {version}, expected {VERSION}")
+        if HEADER.size + count * SECTION.size > len(self._buffer):
+            raise KeyFileError("section table is truncated")
+        sections = {}
+        for idx in range(count):
+            name, kind, items, offset = SECTION.unpack_from(
+                self._buffer, HEADER.size + idx * SECTION.size
+            )
+            if kind not in ITEM_SIZE:
+                raise KeyFileError(f"unknown section kind {kind}")
+            if offset + ITEM_SIZE[kind] * items > len(self._buffer):
+                raise KeyFileError("file is truncated")
+            sections[name.rstrip(b"\x00").decode()] = (kind, items, offset)
+        return sections
+
+    def _section(self, name: str, kind: int) -> tuple[int, int]:
+        if name not in self.sections:
+            raise KeyFileError(f"no section {name!r}")
+        section_kind, items, offset = self.sections[name]
+        if section_kind != kind:
+            raise KeyFileError(f"section {name!r} has kind {section_kind}, not {kind}")
+        return items, offset
+
+    def points(self, name: str, kind: int) -> PointView:
+        items, offset = self._section(name, kind)
+        return PointView(self._buffer, offset, kind, range(items))
+
+    def g1(self, name: str) -> PointView:
+        return self.points(name, KIND_G1)
+
+    def g2(self, name: str) -> PointView:
+        return self.points(name, KIND_G2)
+
+    def integer(self, name: str) -> int:
+        _, offset = self._section(name, KIND_INT)
+        return INTEGER.unpack_from(self._buffer, offset)[0]
+
+    def close(self) -> None:
+        """
+        Unmap the file, views of it raise ValueError afterwards
+        """
+        self._buffer.close()
+
+    def __enter__(self) -> "KeyFile":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+def test_keyfile_roundtrip(tmp_path) -> None:
+    rnd = random.Random(1)
+    g1 = [multiply(G1, rnd.randint(1, curve_order - 1)) for _ in range(6)] + [None]
+    g2 = [None, multiply(G2, rnd.randint(1, curve_order - 1)), G2]
+    path = tmp_path / "key.bin"
+    write_keyfile(
+        path, g1={"points": g1, "empty": []}, g2={"g2": g2}, integers={"l": 2}
+    )
+    with KeyFile(path) as keys:
+        assert list(keys.g1("points")) == g1
+        assert list(keys.g2("g2")) == g2
+        assert len(keys.g1("empty")) == 0
+        assert keys.integer("l") == 2
+        view = keys.g1("points")[2:6]
+        assert len(view) == 4
+        assert list(view[::-1]) == g1[2:6][::-1]
+        assert view[-1] == g1[5]
+        with pytest.raises(IndexError):
+            view[4]
+        with pytest.raises(KeyFileError):
+            keys.g2("points")
+        with pytest.raises(KeyFileError):
+            keys.integer("missing")
+
+
+def test_keyfile_rejects_foreign_files(tmp_path) -> None:
+    path = tmp_path / "key.bin"
+    path.write_bytes(b"")
+    with pytest.raises(KeyFileError):
+        KeyFile(path)
+    path.write_bytes(b"not a key file at all")
+    with pytest.raises(KeyFileError):
+        KeyFile(path)
+    path.write_bytes(HEADER.pack(MAGIC, VERSION + 1, 0))
+    with pytest.raises(KeyFileError):
+        KeyFile(path)
+    write_keyfile(path, g1={"points": [G1, G1]})
+    path.write_bytes(path.read_bytes()[:-1])
+    with pytest.raises(KeyFileError):
+        KeyFile(path)
+    # a header announcing more sections than the file holds
+    path.write_bytes(HEADER.pack(MAGIC, VERSION, 3) + bytes(SECTION.size))
+    with pytest.raises(KeyFileError):
+        KeyFile(path)
+
+
+def test_keyfile_close(tmp_path) -> None:
+    path = tmp_path / "key.bin"
+    write_keyfile(path, g1={"points": [G1]})
+    with KeyFile(path) as keys:
+        view = keys.g1("points")
+        assert view[0] == G1
+    with pytest.raises(ValueError):
+        view[0]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,360 @@
+"""
+Vectorized BN254 scalar field arithmetic on NumPy limb arrays
+
+An element is LIMBS little-endian limbs of LIMB_BITS bits in an int64 array,
+a vector of n elements is a limb-major (LIMBS, n) array (any trailing shape
+works), and values are kept in Montgomery form x * R mod MODULUS with
+R = 2**290. Every operation is a fixed sequence of NumPy passes, one per
+limb, each over a contiguous row of all elements.
+
+29-bit limbs leave room in 64 bits: a limb product is below 2**58 and a
+column of the 20-limb product accumulates at most 20 of them, so
+multiplication adds everything up first and propagates carries once. The
+290-bit R also leaves 36 bits above the modulus, so sums of up to 2**36
+reduced elements can go through one Montgomery reduction (reduce_sum).
+"""
+
+import random
+from typing import Sequence
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+from field import MODULUS
+
+LIMB_BITS = 29
+LIMBS = 10
+MASK = (1 << LIMB_BITS) - 1
+R_BITS = LIMB_BITS * LIMBS
+R = (1 << R_BITS) % MODULUS
+R2 = R * R % MODULUS
+# -MODULUS**-1 mod 2**LIMB_BITS, the per-limb Montgomery factor
+N_PRIME = -pow(MODULUS, -1, 1 << LIMB_BITS) % (1 << LIMB_BITS)
+WORDS = 8  # 32-bit words in the 32 byte encoding
+
+type Limbs = npt.NDArray[np.int64]
+
+
+def split(x: int) -> Limbs:
+    """
+    Limbs of a non-negative integer below 2**R_BITS, not converted to Montgomery form
+    """
+    return np.array([(x >> (LIMB_BITS * k)) & MASK for k in range(LIMBS)], np.int64)
+
+
+_P = split(MODULUS)
+_R2 = split(R2)
+_PLAIN_ONE = split(1)
+ONE = split(R)
+ZERO = split(0)
+
+
+def _align(a: Limbs, b: Limbs) -> tuple[Limbs, Limbs]:
+    # the element shapes a.shape[1:] and b.shape[1:] broadcast like NumPy
+    # shapes, aligned at the right, while the limb axes stay in front
+    ndim = max(a.ndim, b.ndim)
+    return (
+        a.reshape(a.shape[:1] + (1,) * (ndim - a.ndim) + a.shape[1:]),
+        b.reshape(b.shape[:1] + (1,) * (ndim - b.ndim) + b.shape[1:]),
+    )
+
+
+def _propagate(t: Limbs) -> Limbs:
+    # in place, with signed carries; returns the carry out of the top limb
+    for j in range(len(t) - 1):
+        t[j + 1] += t[j] >> LIMB_BITS
+        t[j] &= MASK
+    top = t[-1] >> LIMB_BITS
+    t[-1] &= MASK
+    return top
+
+
+def _subtract_modulus_if_above(t: Limbs) -> Limbs:
+    # t is normalized and below 2 * MODULUS
+    d = t - _align(_P, t)[0]
+    borrow = _propagate(d) < 0
+    return np.where(borrow, t, d)
+
+
+def add(a: Limbs, b: Limbs) -> Limbs:
+    a, b = _align(a, b)
+    t = a + b
+    _propagate(t)
+    return _subtract_modulus_if_above(t)
+
+
+def sub(a: Limbs, b: Limbs) -> Limbs:
+    a, b = _align(a, b)
+    t = a - b
+    negative = _propagate(t) < 0
+    # a - b + MODULUS wraps around 2**R_BITS back into range, so its carry is dropped
+    u = t + _align(_P, t)[0]
+    _propagate(u)
+    return np.where(negative, u, t)
+
+
+def neg(a: Limbs) -> Limbs:
+    return sub(np.zeros_like(a), a)
+
+
+def _redc(t: Limbs) -> Limbs:
+    # t has 2 * LIMBS + 1 rows with unpropagated carries and represents
+    # T < MODULUS * R; the result T / R mod MODULUS is fully reduced
+    p = _align(_P, t)[0]
+    for i in range(LIMBS):
+        m = ((t[i] & MASK) * N_PRIME) & MASK
+        t[i : i + LIMBS] += m * p
+        # the low LIMB_BITS of row i are zero now, only the carry moves on
+        t[i + 1] += t[i] >> LIMB_BITS
+    result = t[LIMBS:]
+    _propagate(result)
+    return _subtract_modulus_if_above(result[:LIMBS])
+
+
+def mul(a: Limbs, b: Limbs) -> Limbs:
+    """
+    Montgomery product a * b / R, element shapes broadcast like NumPy operands
+    """
+    a, b = _align(a, b)
+    shape = np.broadcast_shapes(a.shape[1:], b.shape[1:])
+    t = np.empty((2 * LIMBS + 1,) + shape, np.int64)
+    t[-2:] = 0
+    # column k of the schoolbook product sums a[i] * b[k - i] in one pass
+    for k in range(2 * LIMBS - 1):
+        low, high = max(0, k - LIMBS + 1), min(k, LIMBS - 1)
+        column = a[low : high + 1], b[k - high : k - low + 1][::-1]
+        t[k] = np.einsum("i...,i...->...", *column)
+    return _redc(t)
+
+
+def reduce_sum(t: Limbs) -> Limbs:
+    """
+    Reduce a limbwise sum of at most 2**36 reduced elements, e.g. from
+    a.sum(axis=1) or np.add.reduceat, back to reduced elements
+    """
+    t = t.copy()
+    assert not _propagate(t).any(), "sum does not fit into the limbs"
+    return mul(t, ONE)
+
+
+def power(a: Limbs, exponent: int) -> Limbs:
+    """
+    a**exponent for every element, one square-and-multiply shared by all of them
+    """
+    assert exponent >= 0, "exponent must not be negative"
+    result = np.broadcast_to(_align(ONE, a)[0], a.shape).copy()
+    for bit in bin(exponent)[2:]:
+        result = mul(result, result)
+        if bit == "1":
+            result = mul(result, a)
+    return result
+
+
+def powers(base: int, count: int) -> Limbs:
+    """
+    (LIMBS, count) array of base**i, doubling the known prefix with every step
+    """
+    result = np.empty((LIMBS, count), np.int64)
+    if not count:
+        return result
+    result[:, 0] = ONE
+    known = 1
+    step = from_ints([base])
+    while known < count:
+        size = min(known, count - known)
+        result[:, known : known + size] = mul(result[:, :size], step)
+        known += size
+        step = mul(step, step)
+    return result
+
+
+def is_zero(a: Limbs) -> npt.NDArray[np.bool_]:
+    return ~a.any(axis=0)
+
+
+def equal(a: Limbs, b: Limbs) -> npt.NDArray[np.bool_]:
+    # reduced elements have a unique representation
+    a, b = _align(a, b)
+    return (a == b).all(axis=0)
+
+
+def from_ints(values: Sequence[int] | npt.NDArray) -> Limbs:
+    """
+    (LIMBS, len(values)) array of the values in Montgomery form. An ndarray
+    keeps its shape, (LIMBS, *values.shape); int64 ones are split into limbs
+    by NumPy without going through python ints.
+    """
+    if isinstance(values, np.ndarray):
+        if np.can_cast(values.dtype, np.int64):
+            return _from_int64(values.astype(np.int64))
+        return from_ints(values.ravel().tolist()).reshape((LIMBS,) + values.shape)
+    data = b"".join((int(x) % MODULUS).to_bytes(4 * WORDS, "little") for x in values)
+    words = np.frombuffer(data, "<u4").reshape(len(values), WORDS).T.astype(np.int64)
+    words = np.concatenate([words, np.zeros((2, len(values)), np.int64)])
+    plain = np.empty((LIMBS, len(values)), np.int64)
+    for k in range(LIMBS):
+        word, shift = divmod(LIMB_BITS * k, 32)
+        plain[k] = ((words[word] >> shift) | (words[word + 1] << (32 - shift))) & MASK
+    return mul(plain, _R2)
+
+
+def _from_int64(values: npt.NDArray[np.int64]) -> Limbs:
+    negative = values < 0
+    # |x| as uint64, which also holds -2**63
+    magnitude = values.astype(np.uint64)
+    magnitude[negative] = -magnitude[negative]
+    plain = np.zeros((LIMBS,) + values.shape, np.int64)
+    for k in range(-(-64 // LIMB_BITS)):
+        plain[k] = (magnitude >> np.uint64(LIMB_BITS * k)) & np.uint64(MASK)
+    result = mul(plain, _R2)
+    return np.where(negative, neg(result), result)
+
+
+def to_ints(a: Limbs) -> list[int]:
+    """
+    Values of all elements of a, flattened in C order
+    """
+    plain = mul(a.reshape(LIMBS, -1), _PLAIN_ONE)
+    words = np.zeros((WORDS, plain.shape[1]), np.int64)
+    for k in range(LIMBS):
+        offset = LIMB_BITS * k
+        for word in range(offset // 32, min((offset + LIMB_BITS - 1) // 32 + 1, WORDS)):
+            shift = offset - 32 * word
+            if shift >= 0:
+                words[word] |= (plain[k] << shift) & 0xFFFFFFFF
+            else:
+                words[word] |= plain[k] >> -shift
+    data = words.T.astype("<u4").tobytes()
+    size = 4 * WORDS
+    return [
+        int.from_bytes(data[start : start + size], "little")
+        for start in range(0, len(data), size)
+    ]
+
+
+def batch_inverse(a: Limbs) -> Limbs:
+    """
+    Inverses of a vector (LIMBS, n) through a product tree: log(n) levels of
+    pairwise products up, one modular inversion, and the same levels down
+    """
+    if not a.shape[1]:
+        return a.copy()
+    levels = [a]
+    while levels[-1].shape[1] > 1:
+        level = levels[-1]
+        if level.shape[1] % 2:
+            level = levels[-1] = np.concatenate([level, ONE[:, None]], axis=1)
+        levels.append(mul(level[:, 0::2], level[:, 1::2]))
+    (root,) = to_ints(levels[-1])
+    if root == 0:
+        raise ZeroDivisionError("batch contains zero")
+    inverse = from_ints([pow(root, -1, MODULUS)])
+    for level in reversed(levels[:-1]):
+        # inverse[i] is 1 / (level[2i] * level[2i + 1]), minus the padding above
+        inverse = inverse[:, : level.shape[1] // 2]
+        down = np.empty_like(level)
+        down[:, 0::2] = mul(inverse, level[:, 1::2])
+        down[:, 1::2] = mul(inverse, level[:, 0::2])
+        inverse = down
+    return inverse[:, : a.shape[1]]
+
+
+def ntt(a: Limbs, twiddles: Limbs) -> Limbs:
+    """
+    Radix-2 transform of a (LIMBS, n) vector with twiddles (LIMBS, n / 2) in
+    Montgomery form, w**k for the primitive n-th root w. A (LIMBS, k, n)
+    array transforms k vectors at once. Every butterfly layer is three
+    whole-array operations.
+    """
+    n = a.shape[-1]
+    assert n & (n - 1) == 0 and (n == 1 or twiddles.shape[1] == n // 2), (
+        "values size does not match the twiddles"
+    )
+    bits = n.bit_length() - 1
+    reverse = np.zeros(n, np.int64)
+    for bit in range(bits):
+        reverse |= ((np.arange(n) >> bit) & 1) << (bits - 1 - bit)
+    a = a[..., reverse]
+    half = 1
+    while half < n:
+        blocks = a.reshape(a.shape[:-1] + (n // (2 * half), 2, half))
+        w = twiddles[:, :: n // (2 * half)][:, :half]
+        v = mul(blocks[..., 1, :], w)
+        u = blocks[..., 0, :]
+        a = np.stack([add(u, v), sub(u, v)], axis=-2).reshape(a.shape)
+        half *= 2
+    return a
+
+
+@pytest.fixture
+def rnd() -> random.Random:
+    return random.Random(7)
+
+
+def test_roundtrip_and_arithmetic(rnd) -> None:
+    values = [0, 1, MODULUS - 1, 2**254 % MODULUS]
+    values += [rnd.randrange(MODULUS) for _ in range(60)]
+    others = [rnd.randrange(MODULUS) for _ in values]
+    a, b = from_ints(values), from_ints(others)
+    assert to_ints(a) == values
+    assert to_ints(add(a, b)) == [(x + y) % MODULUS for x, y in zip(values, others)]
+    assert to_ints(sub(a, b)) == [(x - y) % MODULUS for x, y in zip(values, others)]
+    assert to_ints(neg(a)) == [-x % MODULUS for x in values]
+    assert to_ints(mul(a, b)) == [x * y % MODULUS for x, y in zip(values, others)]
+    assert to_ints(mul(a, a[:, 3])) == [x * values[3] % MODULUS for x in values]
+    assert to_ints(power(a, 5)) == [pow(x, 5, MODULUS) for x in values]
+    assert is_zero(a).tolist() == [x == 0 for x in values]
+    assert equal(a, a).all() and not equal(a, b).any()
+
+
+def test_extremes(rnd) -> None:
+    top = from_ints([MODULUS - 1] * 4)
+    assert to_ints(mul(top, top)) == [1] * 4
+    assert to_ints(add(top, top)) == [MODULUS - 2] * 4
+    assert to_ints(sub(from_ints([0]), top[:, :1])) == [1]
+    # a row sum of many reduced elements
+    terms = from_ints([MODULUS - 1] * 1000)
+    assert to_ints(reduce_sum(terms.sum(axis=1))) == [-1000 % MODULUS]
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 8, 33])
+def test_batch_inverse(rnd, size: int) -> None:
+    values = [rnd.randrange(1, MODULUS) for _ in range(size)]
+    assert to_ints(batch_inverse(from_ints(values))) == [
+        pow(x, -1, MODULUS) for x in values
+    ]
+    with pytest.raises(ZeroDivisionError):
+        batch_inverse(from_ints(values + [0]))
+
+
+@pytest.mark.parametrize("count", [0, 1, 7, 8])
+def test_powers(count: int) -> None:
+    assert to_ints(powers(5, count)) == [pow(5, i, MODULUS) for i in range(count)]
+
+
+def test_from_int64_array() -> None:
+    values = np.array([[0, 1, -1, 2**62], [-(2**63), 2**63 - 1, -5, 7]], np.int64)
+    a = from_ints(values)
+    assert a.shape == (LIMBS, 2, 4)
+    assert to_ints(a) == [int(x) % MODULUS for x in values.ravel()]
+    big = np.array([MODULUS - 1, -3, 2**300], dtype=object)
+    assert to_ints(from_ints(big)) == [int(x) % MODULUS for x in big]
+
+
+@pytest.mark.parametrize("size", [1, 2, 16])
+def test_ntt_matches_python(rnd, size: int) -> None:
+    from ntt import Domain, ntt as python_ntt
+
+    domain = Domain.of_size(size)
+    values = [rnd.randrange(MODULUS) for _ in range(size)]
+    twiddles = from_ints(domain.twiddles)
+    assert to_ints(ntt(from_ints(values), twiddles)) == python_ntt(values, domain)
+    # several vectors in one call
+    rows = np.array([values, values[::-1]], dtype=object)
+    assert to_ints(ntt(from_ints(rows), twiddles)) == python_ntt(
+        values, domain
+    ) + python_ntt(values[::-1], domain)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,146 @@
+"""
+Pippenger (bucket) multi-scalar multiplication over BN254 G1/G2
+"""
+
+import functools
+import random
+from typing import Sequence
+from py_ecc.bn128 import (
+    curve_order,
+    add,
+    multiply,
+    G1,
+    G2,
+    FQ,
+    FQ2,
+)
+import pytest
+
+from jacobian import JacobianPoint
+
+# Elliptic curve points can be None (point at infinity)
+type G1Point = tuple[FQ, FQ] | None
+type G2Point = tuple[FQ2, FQ2] | None
+type Point = G1Point | G2Point
+
+MAX_WINDOW = 16
+
+
+def window_size(n: int) -> int:
+    """
+    Bucket window width for n non-trivial scalars, roughly ln(n) bits.
+    Each window costs n additions plus 2 * 2**c additions to fold its buckets,
+    so c ~ ln(n) balances the two terms.
+    """
+    if n < 4:
+        return 1
+    return min(MAX_WINDOW, (n.bit_length() * 69) // 100 + 1)
+
+
+def msm_window(points: Sequence[Point], scalars: Sequence[int]) -> int:
+    """
+    The window msm_jacobian picks: only the terms left after dropping zero
+    and one scalars and points at infinity go into the buckets
+    """
+    terms = sum(
+        1
+        for point, scalar in zip(points, scalars)
+        if point is not None and int(scalar) % curve_order > 1
+    )
+    return window_size(terms)
+
+
+def msm_jacobian(points: Sequence[Point], scalars: Sequence[int]) -> JacobianPoint:
+    """
+    Compute sum(scalar_i * point_i) with the bucket method.
+
+    Zero scalars are dropped and scalars equal to one are added directly,
+    so sparse and bit-valued witnesses only pay for the entries that matter.
+    Buckets are kept in Jacobian coordinates and input points are mixed in
+    as affine, so no field inversion happens here.
+    """
+    assert len(points) == len(scalars), "points and scalars size is not equal"
+    field = next((type(pt[0]) for pt in points if pt is not None), FQ)
+    trivial = JacobianPoint.infinity(field)
+    pairs: list[tuple[Point, int]] = []
+    for point, scalar in zip(points, scalars):
+        scalar = int(scalar) % curve_order
+        if scalar == 0 or point is None:
+            continue
+        if scalar == 1:
+            trivial = trivial.add_affine(point)
+            continue
+        pairs.append((point, scalar))
+    if not pairs:
+        return trivial
+
+    c = window_size(len(pairs))
+    mask = (1 << c) - 1
+    max_bits = max(scalar for _, scalar in pairs).bit_length()
+    result = JacobianPoint.infinity(field)
+    for shift in range((max_bits - 1) // c * c, -1, -c):
+        for _ in range(c):
+            result = result.double()
+        buckets = [JacobianPoint.infinity(field) for _ in range(mask)]
+        for point, scalar in pairs:
+            digit = (scalar >> shift) & mask
+            if digit:
+                buckets[digit - 1] = buckets[digit - 1].add_affine(point)
+        # sum(d * bucket_d) as a running sum from the highest bucket down
+        running = JacobianPoint.infinity(field)
+        window = JacobianPoint.infinity(field)
+        for bucket in reversed(buckets):
+            running = running + bucket
+            window = window + running
+        result = result + window
+    return result + trivial
+
+
+def msm(points: Sequence[Point], scalars: Sequence[int]) -> Point:
+    return msm_jacobian(points, scalars).to_affine()
+
+
+def naive_msm(points: Sequence[Point], scalars: Sequence[int]) -> Point:
+    """
+    Reference implementation: one double-and-add per term and a chain of adds
+    """
+    assert len(points) == len(scalars), "points and scalars size is not equal"
+    return functools.reduce(
+        add, map(multiply, points, [int(x) % curve_order for x in scalars]), None
+    )
+
+
+@pytest.mark.parametrize("n", [0, 1, 3, 8, 17, 40])
+def test_msm_g1_matches_naive(n: int) -> None:
+    rnd = random.Random(n)
+    points = [multiply(G1, rnd.randint(1, curve_order - 1)) for _ in range(n)]
+    scalars = [rnd.choice([0, 1, rnd.randint(2, curve_order - 1)]) for _ in range(n)]
+    assert msm(points, scalars) == naive_msm(points, scalars)
+
+
+@pytest.mark.parametrize("n", [1, 5, 9])
+def test_msm_g2_matches_naive(n: int) -> None:
+    rnd = random.Random(n)
+    points = [multiply(G2, rnd.randint(1, curve_order - 1)) for _ in range(n)]
+    scalars = [rnd.randint(0, curve_order - 1) for _ in range(n)]
+    assert msm(points, scalars) == naive_msm(points, scalars)
+
+
+def test_msm_trivial_scalars() -> None:
+    points = [G1, multiply(G1, 2), multiply(G1, 3)]
+    assert msm(points, [0, 0, 0]) is None
+    assert msm(points, [1, 1, 0]) == multiply(G1, 3)
+    assert msm(points, [curve_order + 1, -1, 0]) == multiply(G1, curve_order - 1)
+    assert msm([None, G1], [5, 2]) == multiply(G1, 2)
+
+
+
+def test_msm_window() -> None:
+    points = [G1] * 40 + [None] * 8
+    scalars = [0, 1, 2, curve_order + 1] * 10 + [5] * 8
+    # 10 of the 48 terms reach the buckets
+    assert msm_window(points, scalars) == window_size(10) < window_size(48)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,136 @@
+"""
+Multi-scalar multiplications over a key file in a process pool
+
+The points never travel between processes: every worker maps the key file
+once, in the pool initializer, and reads the section it needs through a
+PointView. Only the scalars go to the worker and one encoded point comes
+back, so independent MSMs of a proof run side by side at the cost of
+pickling the witness.
+"""
+
+from concurrent.futures import Future, ProcessPoolExecutor
+import multiprocessing
+import os
+import random
+from typing import Sequence
+from py_ecc.bn128 import (
+    curve_order,
+    multiply,
+    G1,
+    G2,
+)
+import pytest
+
+from keyfile import (
+    KIND_G1,
+    KIND_G2,
+    KeyFile,
+    KeyFileError,
+    Point,
+    decode_g1,
+    decode_g2,
+    encode_g1,
+    encode_g2,
+    write_keyfile,
+)
+from msm import msm, naive_msm
+
+_CODECS = {KIND_G1: (encode_g1, decode_g1), KIND_G2: (encode_g2, decode_g2)}
+
+# key file of the current worker process, see _open_keyfile
+_worker_keys: KeyFile | None = None
+
+
+def _open_keyfile(path: str) -> None:
+    global _worker_keys
+    _worker_keys = KeyFile(path)
+
+
+def _section_msm(section: str, kind: int, start: int, scalars: list[int]) -> bytes:
+    assert _worker_keys is not None, "worker is not initialized"
+    points = _worker_keys.points(section, kind)[start : start + len(scalars)]
+    encode, _ = _CODECS[kind]
+    return encode(msm(points, scalars))
+
+
+class MSMPool:
+    """
+    Process pool computing MSMs over the sections of one key file.
+
+    keys is the pool's own mapping of the file, so callers can check which
+    key the workers read from; it is closed with the pool.
+    """
+
+    def __init__(self, path: str | os.PathLike, workers: int = 4) -> None:
+        self.path = os.fspath(path)
+        self.keys = KeyFile(self.path)
+        # workers start from a fork server, forking a threaded caller is unsafe
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_open_keyfile,
+            initargs=(self.path,),
+        )
+
+    def submit(
+        self, section: str, kind: int, scalars: Sequence[int], start: int = 0
+    ) -> Future[Point]:
+        """
+        sum(scalars[i] * section[start + i]) computed in a worker
+        """
+        _, decode = _CODECS[kind]
+        encoded = self._pool.submit(
+            _section_msm, section, kind, start, [int(s) for s in scalars]
+        )
+        result: Future[Point] = Future()
+
+        def done(future: Future[bytes]) -> None:
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                result.set_result(decode(future.result()))
+
+        encoded.add_done_callback(done)
+        return result
+
+    def g1(self, section: str, scalars: Sequence[int], start: int = 0) -> Future[Point]:
+        return self.submit(section, KIND_G1, scalars, start)
+
+    def g2(self, section: str, scalars: Sequence[int], start: int = 0) -> Future[Point]:
+        return self.submit(section, KIND_G2, scalars, start)
+
+    def close(self) -> None:
+        self._pool.shutdown()
+        self.keys.close()
+
+    def __enter__(self) -> "MSMPool":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+def test_msm_pool(tmp_path) -> None:
+    rnd = random.Random(4)
+    g1 = [multiply(G1, rnd.randint(1, curve_order - 1)) for _ in range(6)]
+    g2 = [multiply(G2, rnd.randint(1, curve_order - 1)) for _ in range(3)]
+    scalars = [rnd.randint(0, curve_order - 1) for _ in range(6)]
+    path = tmp_path / "key.bin"
+    write_keyfile(path, g1={"g1": g1}, g2={"g2": g2})
+    with MSMPool(path, workers=2) as pool:
+        futures = [
+            pool.g1("g1", scalars),
+            pool.g2("g2", scalars[:3]),
+            pool.g1("g1", scalars[:2], start=4),
+        ]
+        assert [f.result() for f in futures] == [
+            naive_msm(g1, scalars),
+            naive_msm(g2, scalars[:3]),
+            naive_msm(g1[4:], scalars[:2]),
+        ]
+        with pytest.raises(KeyFileError):
+            pool.g1("missing", scalars).result()
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
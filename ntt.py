@@ -0,0 +1,364 @@
+"""
+Radix-2 NTT over power-of-two multiplicative subgroups of the BN254 scalar field
+"""
+
+from dataclasses import dataclass
+import random
+import secrets
+from typing import Sequence
+import numpy as np
+from py_ecc.bn128 import curve_order
+import pytest
+
+from field import batch_inverse
+import limbs
+import profiling
+from profiling import FIELD_MULTIPLICATIONS
+
+MODULUS = curve_order
+# curve_order - 1 = 2**28 * odd, so subgroups of size up to 2**28 exist
+TWO_ADICITY = 28
+# same primitive element the homework FIELD uses
+GENERATOR = 5
+ROOT_OF_UNITY = pow(GENERATOR, (MODULUS - 1) >> TWO_ADICITY, MODULUS)
+# domain size from which quotient runs on limbs arrays by default
+VECTORIZED_MIN_SIZE = 2**12
+
+
+class DomainSizeError(Exception):
+    pass
+
+
+@dataclass(frozen=True, slots=True)
+class Domain:
+    """
+    Subgroup {omega**i} of size 2**k together with the twiddle factors
+    and the coset shift used to evaluate outside of it
+    """
+
+    size: int
+    omega: int
+    omega_inv: int
+    size_inv: int
+    coset: int
+    coset_inv: int
+    twiddles: tuple[int, ...]
+    inv_twiddles: tuple[int, ...]
+
+    @classmethod
+    def of_size(cls, size: int) -> "Domain":
+        if size < 1 or size & (size - 1):
+            raise DomainSizeError(f"{size} is not a power of two")
+        log_size = size.bit_length() - 1
+        if log_size > TWO_ADICITY:
+            raise DomainSizeError(f"no subgroup of size 2**{log_size}")
+        omega = pow(ROOT_OF_UNITY, 1 << (TWO_ADICITY - log_size), MODULUS)
+        omega_inv = pow(omega, -1, MODULUS)
+        return cls(
+            size=size,
+            omega=omega,
+            omega_inv=omega_inv,
+            size_inv=pow(size, -1, MODULUS),
+            coset=GENERATOR,
+            coset_inv=pow(GENERATOR, -1, MODULUS),
+            twiddles=_powers(omega, size // 2),
+            inv_twiddles=_powers(omega_inv, size // 2),
+        )
+
+    @classmethod
+    def for_constraints(cls, constraints: int) -> "Domain":
+        """
+        Smallest domain that fits the given number of constraints
+        """
+        return cls.of_size(1 << max(constraints - 1, 0).bit_length())
+
+    def elements(self) -> list[int]:
+        return list(_powers(self.omega, self.size))
+
+    def vanishing_at(self, x: int) -> int:
+        """
+        t(x) = x**size - 1 vanishes exactly on the domain
+        """
+        return (pow(x, self.size, MODULUS) - 1) % MODULUS
+
+    def lagrange_at(self, x: int) -> list[int]:
+        """
+        Values L_i(x) of the Lagrange basis of the domain, in the barycentric
+        form L_i(x) = omega**i * t(x) / (size * (x - omega**i)). All the
+        denominators are inverted at once, so this is O(size) field work.
+        """
+        x %= MODULUS
+        elements = self.elements()
+        t = self.vanishing_at(x)
+        if t == 0:
+            # x is omega**k itself: L_k(x) = 1 and all the other ones vanish
+            return [int(e == x) for e in elements]
+        scale = t * self.size_inv % MODULUS
+        inverses = batch_inverse([(x - e) % MODULUS for e in elements])
+        return [
+            scale * e % MODULUS * inv % MODULUS for e, inv in zip(elements, inverses)
+        ]
+
+
+def _powers(base: int, count: int) -> tuple[int, ...]:
+    result = []
+    acc = 1
+    for _ in range(count):
+        result.append(acc)
+        acc = acc * base % MODULUS
+    return tuple(result)
+
+
+def _transform(values: Sequence[int], twiddles: tuple[int, ...]) -> list[int]:
+    # iterative Cooley-Tukey: bit-reversal permutation, then log(n) butterfly layers
+    n = len(values)
+    assert n == 2 * len(twiddles) or n == 1, "values size does not match the domain"
+    a = [int(x) % MODULUS for x in values]
+    j = 0
+    for i in range(1, n):
+        bit = n >> 1
+        while j & bit:
+            j ^= bit
+            bit >>= 1
+        j |= bit
+        if i < j:
+            a[i], a[j] = a[j], a[i]
+    half = 1
+    while half < n:
+        step = n // (2 * half)
+        for start in range(0, n, 2 * half):
+            for k in range(half):
+                u = a[start + k]
+                v = a[start + k + half] * twiddles[k * step] % MODULUS
+                a[start + k] = (u + v) % MODULUS
+                a[start + k + half] = (u - v) % MODULUS
+        half *= 2
+    profiling.count(FIELD_MULTIPLICATIONS, n // 2 * (n.bit_length() - 1))
+    return a
+
+
+def ntt(coefficients: Sequence[int], domain: Domain) -> list[int]:
+    """
+    Evaluations of the polynomial (ascending coefficients) at omega**i
+    """
+    padded = list(coefficients) + [0] * (domain.size - len(coefficients))
+    return _transform(padded, domain.twiddles)
+
+
+def intt(evaluations: Sequence[int], domain: Domain) -> list[int]:
+    """
+    Ascending coefficients of the polynomial taking given values at omega**i
+    """
+    padded = list(evaluations) + [0] * (domain.size - len(evaluations))
+    profiling.count(FIELD_MULTIPLICATIONS, domain.size)
+    return [
+        x * domain.size_inv % MODULUS
+        for x in _transform(padded, domain.inv_twiddles)
+    ]
+
+
+def intt_many(
+    evaluations: Sequence[Sequence[int]], domain: Domain, vectorized: bool | None = None
+) -> list[list[int]]:
+    """
+    intt of every vector of evaluations, with vectorized as in quotient:
+    the limbs path transforms all of them in one batched call
+    """
+    if vectorized is None:
+        vectorized = domain.size >= VECTORIZED_MIN_SIZE
+    if not vectorized or not evaluations:
+        return [intt(values, domain) for values in evaluations]
+    n = domain.size
+    values = np.empty((len(evaluations), n), dtype=object)
+    values[...] = [_padded(vector, n) for vector in evaluations]
+    size_inv = limbs.from_ints([domain.size_inv])
+    coeffs = limbs.mul(
+        limbs.ntt(limbs.from_ints(values), limbs.from_ints(domain.inv_twiddles)),
+        size_inv,
+    )
+    # as many as the python path: n / 2 per butterfly layer and the scaling
+    profiling.count(
+        FIELD_MULTIPLICATIONS, len(evaluations) * n * (n.bit_length() + 1) // 2
+    )
+    flat = limbs.to_ints(coeffs)
+    return [flat[i * n : (i + 1) * n] for i in range(len(evaluations))]
+
+
+def coset_ntt(coefficients: Sequence[int], domain: Domain) -> list[int]:
+    """
+    Evaluations at coset * omega**i, outside of the domain itself
+    """
+    shift = 1
+    scaled = []
+    for x in coefficients:
+        scaled.append(int(x) * shift % MODULUS)
+        shift = shift * domain.coset % MODULUS
+    profiling.count(FIELD_MULTIPLICATIONS, 2 * len(scaled))
+    return ntt(scaled, domain)
+
+
+def coset_intt(evaluations: Sequence[int], domain: Domain) -> list[int]:
+    shift = 1
+    result = []
+    for x in intt(evaluations, domain):
+        result.append(x * shift % MODULUS)
+        shift = shift * domain.coset_inv % MODULUS
+    profiling.count(FIELD_MULTIPLICATIONS, 2 * len(result))
+    return result
+
+
+def quotient(
+    a: Sequence[int],
+    b: Sequence[int],
+    c: Sequence[int],
+    domain: Domain,
+    vectorized: bool | None = None,
+) -> list[int]:
+    """
+    Ascending coefficients of h = (a * b - c) / t for t(x) = x**size - 1.
+
+    a, b and c have degree < size, so h has degree <= size - 2 and is fully
+    determined by its values on a coset of the domain. t is the constant
+    coset**size - 1 there, so the division is pointwise. The result is only
+    meaningful when t divides a * b - c, see check_quotient.
+
+    vectorized runs the same steps on limbs arrays, whole vectors at a time;
+    by default it does so from VECTORIZED_MIN_SIZE on, where it is faster.
+    """
+    if vectorized is None:
+        vectorized = domain.size >= VECTORIZED_MIN_SIZE
+    if vectorized:
+        return _quotient_limbs(a, b, c, domain)
+    a_evals = coset_ntt(a, domain)
+    b_evals = coset_ntt(b, domain)
+    c_evals = coset_ntt(c, domain)
+    t_inv = pow(domain.vanishing_at(domain.coset), -1, MODULUS)
+    h_evals = [
+        (x * y - z) * t_inv % MODULUS for x, y, z in zip(a_evals, b_evals, c_evals)
+    ]
+    profiling.count(FIELD_MULTIPLICATIONS, 2 * len(h_evals))
+    return coset_intt(h_evals, domain)[: domain.size - 1]
+
+
+def _padded(values: Sequence[int], size: int) -> list[int]:
+    return list(values) + [0] * (size - len(values))
+
+
+def _quotient_limbs(
+    a: Sequence[int], b: Sequence[int], c: Sequence[int], domain: Domain
+) -> list[int]:
+    n = domain.size
+    twiddles = limbs.from_ints(domain.twiddles)
+    shifts = limbs.powers(domain.coset, n)
+    a_evals, b_evals, c_evals = (
+        limbs.ntt(limbs.mul(limbs.from_ints(_padded(p, n)), shifts), twiddles)
+        for p in (a, b, c)
+    )
+    t_inv = limbs.from_ints([pow(domain.vanishing_at(domain.coset), -1, MODULUS)])
+    h_evals = limbs.mul(limbs.sub(limbs.mul(a_evals, b_evals), c_evals), t_inv)
+    # coset_intt: the inverse transform, then size_inv * coset_inv**i
+    size_inv = limbs.from_ints([domain.size_inv])
+    unshifts = limbs.mul(limbs.powers(domain.coset_inv, n), size_inv)
+    h = limbs.mul(limbs.ntt(h_evals, limbs.from_ints(domain.inv_twiddles)), unshifts)
+    # as many as the python path: four transforms and the pointwise steps
+    profiling.count(FIELD_MULTIPLICATIONS, 2 * n * (n.bit_length() - 1) + 11 * n)
+    return limbs.to_ints(h[:, : n - 1])
+
+
+def check_quotient(
+    a: Sequence[int],
+    b: Sequence[int],
+    c: Sequence[int],
+    h: Sequence[int],
+    domain: Domain,
+) -> bool:
+    """
+    Schwartz-Zippel check of a * b - c == h * t at a random point,
+    a false positive happens with probability about 2 * size / MODULUS
+    """
+    r = secrets.randbelow(MODULUS)
+    left = evaluate(a, r) * evaluate(b, r) - evaluate(c, r)
+    return left % MODULUS == evaluate(h, r) * domain.vanishing_at(r) % MODULUS
+
+
+def evaluate(coefficients: Sequence[int], x: int) -> int:
+    """
+    Horner evaluation of ascending coefficients
+    """
+    result = 0
+    for c in reversed(coefficients):
+        result = (result * x + int(c)) % MODULUS
+    return result
+
+
+@pytest.mark.parametrize("size", [1, 2, 4, 8, 32])
+def test_ntt_matches_naive_evaluation(size: int) -> None:
+    rnd = random.Random(size)
+    domain = Domain.of_size(size)
+    coeffs = [rnd.randint(0, MODULUS - 1) for _ in range(size)]
+    assert ntt(coeffs, domain) == [evaluate(coeffs, x) for x in domain.elements()]
+    assert intt(ntt(coeffs, domain), domain) == coeffs
+    coset = [domain.coset * x % MODULUS for x in domain.elements()]
+    assert coset_ntt(coeffs, domain) == [evaluate(coeffs, x) for x in coset]
+    assert coset_intt(coset_ntt(coeffs, domain), domain) == coeffs
+
+
+@pytest.mark.parametrize("size", [1, 4, 16])
+def test_quotient(size: int) -> None:
+    rnd = random.Random(size)
+    domain = Domain.of_size(size)
+    a = [rnd.randint(0, MODULUS - 1) for _ in range(size)]
+    b = [rnd.randint(0, MODULUS - 1) for _ in range(size)]
+    # c agrees with a * b on the domain, so t divides a * b - c
+    c = intt(
+        [x * y % MODULUS for x, y in zip(ntt(a, domain), ntt(b, domain))], domain
+    )
+    h = quotient(a, b, c, domain, vectorized=False)
+    assert len(h) == size - 1
+    assert check_quotient(a, b, c, h, domain)
+    assert quotient(a, b, c, domain, vectorized=True) == h
+    c[0] = (c[0] + 1) % MODULUS
+    assert not check_quotient(a, b, c, quotient(a, b, c, domain), domain)
+
+
+def test_domain() -> None:
+    domain = Domain.for_constraints(7)
+    assert domain.size == 8
+    assert len(set(domain.elements())) == 8
+    assert all(domain.vanishing_at(x) == 0 for x in domain.elements())
+    assert domain.vanishing_at(domain.coset) != 0
+    assert Domain.for_constraints(8).size == 8
+    assert Domain.for_constraints(1).size == 1
+    with pytest.raises(DomainSizeError):
+        Domain.of_size(6)
+    with pytest.raises(DomainSizeError):
+        Domain.of_size(1 << 29)
+
+
+@pytest.mark.parametrize("size", [1, 4, 16])
+def test_intt_many(size: int) -> None:
+    rnd = random.Random(size)
+    domain = Domain.of_size(size)
+    vectors = [[rnd.randint(0, MODULUS - 1) for _ in range(size)] for _ in range(3)]
+    vectors[1] = vectors[1][: size // 2]
+    expected = [intt(values, domain) for values in vectors]
+    assert intt_many(vectors, domain, vectorized=True) == expected
+    assert intt_many(vectors, domain, vectorized=False) == expected
+    assert intt_many([], domain, vectorized=True) == []
+
+
+@pytest.mark.parametrize("size", [1, 2, 8])
+def test_lagrange_at(size: int) -> None:
+    rnd = random.Random(size)
+    domain = Domain.of_size(size)
+    coeffs = [rnd.randint(0, MODULUS - 1) for _ in range(size)]
+    evals = ntt(coeffs, domain)
+    for x in [rnd.randint(0, MODULUS - 1), domain.coset, domain.elements()[-1]]:
+        basis = domain.lagrange_at(x)
+        # sum y_i * L_i(x) interpolates the values back at x
+        assert sum(y * l for y, l in zip(evals, basis)) % MODULUS == evaluate(coeffs, x)
+    assert domain.lagrange_at(1) == [1] + [0] * (size - 1)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,420 @@
+"""
+Optimal ate pairing on BN254 with a shared multi-Miller loop
+
+A product of pairings e(Q_1, P_1) * ... * e(Q_k, P_k) runs all k Miller loops
+side by side, squaring the accumulator once per step, and pays for a single
+final exponentiation. G2 arithmetic stays on the twist over FQ2 and line
+functions are written straight into their sparse FQ12 coefficients, so no
+FQ12 inversions happen inside the loop. Line coefficients depend on the G2
+point only, so prepare_g2 computes them once for points that are paired
+over and over, like the ones in a verifying key. Values are bit-for-bit
+compatible with py_ecc.bn128: miller_loop + final_exponentiate equals
+py_ecc's pairing. P must be on the curve and Q in G2, not just on the twist,
+anything else raises PairingError.
+"""
+
+from dataclasses import dataclass
+import random
+from typing import Sequence
+from py_ecc import bn128
+from py_ecc.bn128 import (
+    curve_order,
+    field_modulus,
+    add,
+    is_on_curve,
+    multiply,
+    neg,
+    twist,
+    b,
+    b2,
+    G1,
+    G2,
+    FQ,
+    FQ2,
+    FQ12,
+)
+import pytest
+
+import profiling
+from profiling import FINAL_EXPONENTIATIONS, PAIRINGS
+
+# Elliptic curve points can be None (point at infinity)
+type G1Point = tuple[FQ, FQ] | None
+type G2Point = tuple[FQ2, FQ2] | None
+
+# raw representations: FQ2 as (c0, c1) for c0 + c1 * i, FQ12 as 12 coefficients of w
+type Fq2 = tuple[int, int]
+type Fq12 = tuple[int, ...]
+
+P = field_modulus
+ATE_LOOP_COUNT = 29793968203157093288
+LOG_ATE_LOOP_COUNT = 63
+FQ12_ONE: Fq12 = (1,) + (0,) * 11
+
+
+class PairingError(Exception):
+    pass
+
+
+def _f2_add(a: Fq2, b: Fq2) -> Fq2:
+    return ((a[0] + b[0]) % P, (a[1] + b[1]) % P)
+
+
+def _f2_sub(a: Fq2, b: Fq2) -> Fq2:
+    return ((a[0] - b[0]) % P, (a[1] - b[1]) % P)
+
+
+def _f2_mul(a: Fq2, b: Fq2) -> Fq2:
+    return ((a[0] * b[0] - a[1] * b[1]) % P, (a[0] * b[1] + a[1] * b[0]) % P)
+
+
+def _f2_inv(a: Fq2) -> Fq2:
+    norm_inv = pow(a[0] * a[0] + a[1] * a[1], -1, P)
+    return (a[0] * norm_inv % P, -a[1] * norm_inv % P)
+
+
+def _f2_pow(a: Fq2, e: int) -> Fq2:
+    result = (1, 0)
+    for bit in bin(e)[2:]:
+        result = _f2_mul(result, result)
+        if bit == "1":
+            result = _f2_mul(result, a)
+    return result
+
+
+def _f12_mul(a: Fq12, b: Fq12) -> Fq12:
+    # FQ12 = FQ[w] / (w**12 - 18 * w**6 + 82); zero coefficients of b are
+    # skipped, which makes multiplying by a sparse line value cheap
+    t = [0] * 23
+    for j, bj in enumerate(b):
+        if bj:
+            for i, ai in enumerate(a):
+                t[i + j] += ai * bj
+    for k in range(22, 11, -1):
+        top = t[k]
+        if top:
+            t[k - 6] += 18 * top
+            t[k - 12] -= 82 * top
+    return tuple(x % P for x in t[:12])
+
+
+def _f12_inv(a: Fq12) -> Fq12:
+    return tuple(int(c) for c in FQ12(list(a)).inv().coeffs)
+
+
+def _f12_pow(a: Fq12, e: int) -> Fq12:
+    result = FQ12_ONE
+    for bit in bin(e)[2:]:
+        result = _f12_mul(result, result)
+        if bit == "1":
+            result = _f12_mul(result, a)
+    return result
+
+
+# Frobenius x -> x**p is FQ-linear, row i holds the coefficients of (w**i)**p
+_W_P = _f12_pow((0, 1) + (0,) * 10, P)
+_FROBENIUS: list[Fq12] = [FQ12_ONE]
+for _ in range(11):
+    _FROBENIUS.append(_f12_mul(_FROBENIUS[-1], _W_P))
+
+
+def _frobenius(a: Fq12, power: int = 1) -> Fq12:
+    for _ in range(power):
+        t = [0] * 12
+        for i, ai in enumerate(a):
+            if ai:
+                for j, fj in enumerate(_FROBENIUS[i]):
+                    t[j] += ai * fj
+        a = tuple(x % P for x in t)
+    return a
+
+
+# twist(x, y) = (x * w**2, y * w**3), so Frobenius on the twist is conjugation
+# followed by multiplication with w**(2(p-1)) and w**(3(p-1)), both in FQ2
+_TWIST_FROB_X = _f2_pow((9, 1), (P - 1) // 3)
+_TWIST_FROB_Y = _f2_pow((9, 1), (P - 1) // 2)
+
+
+def _twist_frobenius(Q: tuple[Fq2, Fq2]) -> tuple[Fq2, Fq2]:
+    x, y = Q
+    return (
+        _f2_mul((x[0], -x[1] % P), _TWIST_FROB_X),
+        _f2_mul((y[0], -y[1] % P), _TWIST_FROB_Y),
+    )
+
+
+def _embed(a: Fq2, power: int, coeffs: list[int]) -> None:
+    # add a * w**power, with a + b*i mapped to (a - 9b) + b * w**6
+    coeffs[power] += a[0] - 9 * a[1]
+    coeffs[power + 6] += a[1]
+
+
+type LineCoeffs = tuple[Fq2 | None, Fq2]
+
+
+def _line(
+    R: tuple[Fq2, Fq2], T: tuple[Fq2, Fq2]
+) -> tuple[LineCoeffs, tuple[Fq2, Fq2] | None]:
+    """
+    Line through R and T on the twist, together with R + T.
+
+    Only the slope l and y_R - l * x_R depend on the G2 points, the value at P
+    is -y_P + x_P * l * w + (y_R - l * x_R) * w**3, which mirrors py_ecc
+    linefunc on twisted points. A vertical line is stored as (None, -x_R).
+    """
+    (x1, y1), (x2, y2) = R, T
+    if x1 != x2:
+        slope = _f2_mul(_f2_sub(y2, y1), _f2_inv(_f2_sub(x2, x1)))
+    elif y1 == y2:
+        x_sq = _f2_mul(x1, x1)
+        slope = _f2_mul((3 * x_sq[0], 3 * x_sq[1]), _f2_inv(_f2_add(y1, y1)))
+    else:
+        # R + T is the point at infinity
+        return (None, (-x1[0] % P, -x1[1] % P)), None
+    x3 = _f2_sub(_f2_sub(_f2_mul(slope, slope), x1), x2)
+    y3 = _f2_sub(_f2_mul(slope, _f2_sub(x1, x3)), y1)
+    return (slope, _f2_sub(y1, _f2_mul(slope, x1))), (x3, y3)
+
+
+def _g2_multiply(q: tuple[Fq2, Fq2], n: int) -> tuple[Fq2, Fq2] | None:
+    r: tuple[Fq2, Fq2] | None = None
+    for bit in bin(n)[2:]:
+        if r is not None:
+            _, r = _line(r, r)
+        if bit == "1":
+            r = q if r is None else _line(r, q)[1]
+    return r
+
+
+# the twist has points of order other than r, and the Miller loop hits the point
+# at infinity on some of them. Q is in G2 exactly when psi(Q) == [6u**2]Q, where
+# 6u + 2 is the ate loop count (El Housni, Guillevic, Piellard 2022), which
+# costs a 127-bit multiplication instead of one by r.
+_G2_EIGENVALUE = 6 * ((ATE_LOOP_COUNT - 2) // 6) ** 2
+
+
+def _in_g2(q: tuple[Fq2, Fq2]) -> bool:
+    return _g2_multiply(q, _G2_EIGENVALUE) == _twist_frobenius(q)
+
+
+def _evaluate_line(line: LineCoeffs, P1: tuple[int, int]) -> Fq12:
+    slope, const = line
+    xp, yp = P1
+    coeffs = [0] * 12
+    if slope is None:
+        # vertical line x_P - x_R * w**2
+        coeffs[0] = xp
+        _embed(const, 2, coeffs)
+    else:
+        coeffs[0] = -yp
+        _embed(_f2_mul(slope, (xp, 0)), 1, coeffs)
+        _embed(const, 3, coeffs)
+    return tuple(c % P for c in coeffs)
+
+
+def _raw_g2(Q: G2Point) -> tuple[Fq2, Fq2]:
+    x, y = Q
+    return (int(x.coeffs[0]), int(x.coeffs[1])), (int(y.coeffs[0]), int(y.coeffs[1]))
+
+
+@dataclass(frozen=True, slots=True)
+class PreparedG2:
+    """
+    Line coefficients of every Miller-loop step for a fixed G2 point,
+    in the order the loop consumes them. Pairing with a prepared point
+    skips all the G2 doubling and addition work.
+    """
+
+    point: G2Point
+    lines: tuple[LineCoeffs, ...]
+
+
+def prepare_g2(Q: G2Point) -> PreparedG2:
+    if not is_on_curve(Q, b2):
+        raise PairingError("point Q is not on the twisted curve")
+    if Q is None:
+        return PreparedG2(point=None, lines=())
+    q = _raw_g2(Q)
+    if not _in_g2(q):
+        raise PairingError("point Q is not in the G2 subgroup")
+    r: tuple[Fq2, Fq2] | None = q
+    lines = []
+    for i in range(LOG_ATE_LOOP_COUNT, -1, -1):
+        line, r = _line(r, r)
+        lines.append(line)
+        if ATE_LOOP_COUNT & (1 << i):
+            line, r = _line(r, q)
+            lines.append(line)
+    q1 = _twist_frobenius(q)
+    x2, y2 = _twist_frobenius(q1)
+    line, r = _line(r, q1)
+    lines.append(line)
+    line, _ = _line(r, (x2, (-y2[0] % P, -y2[1] % P)))
+    lines.append(line)
+    return PreparedG2(point=Q, lines=tuple(lines))
+
+
+def _miller_loop(pairs: Sequence[tuple[G2Point | PreparedG2, G1Point]]) -> Fq12:
+    states = []
+    for Q, P1 in pairs:
+        prepared = Q if isinstance(Q, PreparedG2) else prepare_g2(Q)
+        if not is_on_curve(P1, b):
+            raise PairingError("point P is not on the curve")
+        if prepared.point is None or P1 is None:
+            continue
+        states.append((iter(prepared.lines), (int(P1[0]), int(P1[1]))))
+    profiling.count(PAIRINGS, len(states))
+    f = FQ12_ONE
+    if not states:
+        return f
+    for i in range(LOG_ATE_LOOP_COUNT, -1, -1):
+        f = _f12_mul(f, f)
+        for lines, p1 in states:
+            f = _f12_mul(f, _evaluate_line(next(lines), p1))
+        if ATE_LOOP_COUNT & (1 << i):
+            for lines, p1 in states:
+                f = _f12_mul(f, _evaluate_line(next(lines), p1))
+    for lines, p1 in states:
+        for line in lines:
+            f = _f12_mul(f, _evaluate_line(line, p1))
+    return f
+
+
+def _final_exponentiate(f: Fq12) -> Fq12:
+    # (p**12 - 1) / r = (p**6 - 1) * (p**2 + 1) * ((p**4 - p**2 + 1) / r)
+    profiling.count(FINAL_EXPONENTIATIONS)
+    f = _f12_mul(_frobenius(f, 6), _f12_inv(f))
+    f = _f12_mul(_frobenius(f, 2), f)
+    return _f12_pow(f, (P**4 - P**2 + 1) // curve_order)
+
+
+def miller_loop(pairs: Sequence[tuple[G2Point | PreparedG2, G1Point]]) -> FQ12:
+    """
+    Product of the Miller loops of all (Q, P) pairs, without final exponentiation
+    """
+    return FQ12(list(_miller_loop(pairs)))
+
+
+def final_exponentiate(f: FQ12) -> FQ12:
+    return FQ12(list(_final_exponentiate(tuple(int(c) for c in f.coeffs))))
+
+
+def pairing(Q: G2Point | PreparedG2, P1: G1Point) -> FQ12:
+    return FQ12(list(_final_exponentiate(_miller_loop([(Q, P1)]))))
+
+
+def pairing_product(pairs: Sequence[tuple[G2Point | PreparedG2, G1Point]]) -> FQ12:
+    """
+    e(Q_1, P_1) * ... * e(Q_k, P_k) with one final exponentiation
+    """
+    return FQ12(list(_final_exponentiate(_miller_loop(pairs))))
+
+
+def pairing_check(pairs: Sequence[tuple[G2Point | PreparedG2, G1Point]]) -> bool:
+    """
+    True when the pairing product equals 1. Negate a G1 point to move its
+    pairing to the other side: e(Q1, P1) == e(Q2, P2) is
+    pairing_check([(Q1, neg(P1)), (Q2, P2)]).
+    """
+    return _final_exponentiate(_miller_loop(pairs)) == FQ12_ONE
+
+
+def test_twist_frobenius_matches_fq12() -> None:
+    q = multiply(G2, 1234567)
+    x, y = twist(q)
+    q1 = _twist_frobenius(_raw_g2(q))
+    tx, ty = twist((FQ2(list(q1[0])), FQ2(list(q1[1]))))
+    assert [int(c) for c in tx.coeffs] == list(_frobenius(tuple(int(c) for c in x.coeffs)))
+    assert [int(c) for c in ty.coeffs] == list(_frobenius(tuple(int(c) for c in y.coeffs)))
+
+
+def test_pairing_is_bilinear_and_non_degenerate() -> None:
+    rnd = random.Random(11)
+    a, c = rnd.randint(2, curve_order - 1), rnd.randint(2, curve_order - 1)
+    base = pairing(G2, G1)
+    assert base != FQ12.one()
+    assert _f12_pow(tuple(int(x) for x in base.coeffs), curve_order) == FQ12_ONE
+    assert pairing(multiply(G2, a), multiply(G1, c)) == pairing(multiply(G2, a * c), G1)
+    assert pairing(G2, None) == FQ12.one()
+    assert pairing_check([(multiply(G2, a), G1), (G2, neg(multiply(G1, a)))])
+
+
+def test_prepared_g2() -> None:
+    q, p1 = multiply(G2, 12), multiply(G1, 34)
+    prepared = prepare_g2(q)
+    assert pairing(prepared, p1) == pairing(q, p1)
+    assert pairing_check([(prepared, neg(p1)), (multiply(G2, 34), multiply(G1, 12))])
+    # the same prepared point is reused by several pairs of one product
+    assert pairing_product([(prepared, p1), (prepared, G1)]) == pairing(q, add(p1, G1))
+    assert pairing(prepare_g2(None), p1) == FQ12.one()
+    with pytest.raises(PairingError):
+        prepare_g2((FQ2([1, 0]), FQ2([1, 0])))
+
+
+def test_pairing_product() -> None:
+    p1, p2 = multiply(G1, 6), multiply(G1, 5)
+    q1, q2 = multiply(G2, 5), multiply(G2, 7)
+    # e(5 * G2, 6 * G1) == e(7 * G2, 5 * G1) * e(-5 * G2, G1)
+    assert pairing_check([(q1, neg(p1)), (q2, p2), (neg(q1), G1)])
+    assert not pairing_check([(q1, neg(p1)), (q2, p2)])
+    assert pairing_product([(q1, p1), (q2, p2)]) == pairing(q1, p1) * pairing(q2, p2)
+    assert final_exponentiate(miller_loop([(q1, p1)])) == pairing(q1, p1)
+    with pytest.raises(PairingError):
+        pairing_check([(G2, (FQ(1), FQ(3)))])
+
+
+def _twist_point(rnd: random.Random) -> G2Point:
+    # a random point of the twist, almost surely outside G2; p = 3 mod 4, so
+    # the square root in FQ2 follows Adj and Rodriguez-Henriquez
+    while True:
+        x = (rnd.randrange(P), rnd.randrange(P))
+        rhs = _f2_add(_f2_mul(_f2_mul(x, x), x), (int(b2.coeffs[0]), int(b2.coeffs[1])))
+        a1 = _f2_pow(rhs, (P - 3) // 4)
+        alpha = _f2_mul(_f2_mul(a1, a1), rhs)
+        if alpha == (P - 1, 0):
+            y = _f2_mul((0, 1), _f2_mul(a1, rhs))
+        else:
+            y = _f2_mul(_f2_pow(_f2_add((1, 0), alpha), (P - 1) // 2), _f2_mul(a1, rhs))
+        if _f2_mul(y, y) == rhs:
+            return FQ2(list(x)), FQ2(list(y))
+
+
+@pytest.fixture
+def py_ecc_pairing(monkeypatch) -> None:
+    # py_ecc's FQ12 power recurses once per bit of the exponent, deeper than the
+    # interpreter allows for (p**12 - 1) / r; square-and-multiply is the same value
+    def power(self: FQ12, e: int) -> FQ12:
+        result = FQ12.one()
+        for bit in bin(e)[2:]:
+            result = result * result
+            if bit == "1":
+                result = result * self
+        return result
+
+    monkeypatch.setattr(FQ12, "__pow__", power)
+
+
+def test_pairing_matches_py_ecc(py_ecc_pairing) -> None:
+    rnd = random.Random(19)
+    for _ in range(2):
+        q = multiply(G2, rnd.randint(1, curve_order - 1))
+        p1 = multiply(G1, rnd.randint(1, curve_order - 1))
+        assert pairing(q, p1) == bn128.pairing(q, p1)
+
+
+def test_g2_subgroup(py_ecc_pairing) -> None:
+    rnd = random.Random(23)
+    q = _twist_point(rnd)
+    assert is_on_curve(q, b2)
+    assert multiply(q, curve_order) is not None
+    with pytest.raises(PairingError, match="subgroup"):
+        pairing(q, G1)
+    with pytest.raises(PairingError, match="subgroup"):
+        prepare_g2(q)
+    # times the cofactor the point lands in G2
+    cleared = multiply(q, 2 * P - curve_order)
+    assert pairing(cleared, G1) == bn128.pairing(cleared, G1)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,200 @@
+"""
+Phase timers and operation counters for the prover and the setup
+
+Instrumented code marks phases and counts operations:
+
+    with profiling.phase("prove.compute"):
+        ...
+    profiling.count(profiling.PAIRINGS, len(pairs))
+
+Nothing is recorded unless a sink is installed for the duration of a call:
+
+    with profiling.profile() as sink:
+        prove(polynomials, witness, pk)
+    sink.phases["prove.calculate_h"].seconds, sink.counters[profiling.EC_ADDITIONS]
+
+Disabled, phase() returns one shared no-op context manager and count() is a
+function call and a None check. Counters are therefore added at the level of
+a point operation, a transform or a pairing, never per field multiplication
+of the Python ints themselves; NTTs and matrix products report the number
+they perform in one go.
+
+The sink is process wide. Work done in pool workers is not counted, only
+the time the caller spends waiting for it.
+"""
+
+import contextlib
+from dataclasses import dataclass
+import io
+import json
+import os
+import time
+from typing import IO, Iterator, Protocol
+import pytest
+
+FIELD_MULTIPLICATIONS = "field_multiplications"
+EC_ADDITIONS = "ec_additions"
+EC_DOUBLINGS = "ec_doublings"
+SCALAR_MULTIPLICATIONS = "scalar_multiplications"
+PAIRINGS = "pairings"
+FINAL_EXPONENTIATIONS = "final_exponentiations"
+
+
+class Sink(Protocol):
+    def phase(self, name: str, seconds: float) -> None: ...
+
+    def count(self, name: str, amount: int) -> None: ...
+
+
+@dataclass(slots=True)
+class PhaseStats:
+    seconds: float = 0.0
+    calls: int = 0
+
+
+class MemorySink:
+    """
+    Totals per phase name and per counter
+    """
+
+    def __init__(self) -> None:
+        self.phases: dict[str, PhaseStats] = {}
+        self.counters: dict[str, int] = {}
+
+    def phase(self, name: str, seconds: float) -> None:
+        stats = self.phases.setdefault(name, PhaseStats())
+        stats.seconds += seconds
+        stats.calls += 1
+
+    def count(self, name: str, amount: int) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self) -> dict:
+        return {
+            "phases": {
+                name: {"seconds": stats.seconds, "calls": stats.calls}
+                for name, stats in self.phases.items()
+            },
+            "counters": dict(self.counters),
+        }
+
+    def dump(self, path: str | os.PathLike) -> None:
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+class JSONLinesSink:
+    """
+    Writes every phase and counter update as a JSON line, as it happens
+    """
+
+    def __init__(self, stream: IO[str]) -> None:
+        self.stream = stream
+
+    def phase(self, name: str, seconds: float) -> None:
+        self.stream.write(json.dumps({"phase": name, "seconds": seconds}) + "\n")
+
+    def count(self, name: str, amount: int) -> None:
+        self.stream.write(json.dumps({"counter": name, "amount": amount}) + "\n")
+
+
+# installed sink, None when profiling is disabled
+_sink: Sink | None = None
+
+
+class _Phase:
+    __slots__ = ("sink", "name", "start")
+
+    def __init__(self, sink: Sink, name: str) -> None:
+        self.sink = sink
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.sink.phase(self.name, time.perf_counter() - self.start)
+
+
+_NO_PHASE = contextlib.nullcontext()
+
+
+def phase(name: str) -> contextlib.AbstractContextManager:
+    if _sink is None:
+        return _NO_PHASE
+    return _Phase(_sink, name)
+
+
+def count(name: str, amount: int = 1) -> None:
+    if _sink is not None:
+        _sink.count(name, amount)
+
+
+def enabled() -> bool:
+    return _sink is not None
+
+
+@contextlib.contextmanager
+def profile[S: Sink](sink: S | None = None) -> Iterator[S | MemorySink]:
+    """
+    Install sink (a new MemorySink by default) for the body of the with
+    statement, the previous sink is restored afterwards
+    """
+    global _sink
+    previous = _sink
+    _sink = MemorySink() if sink is None else sink
+    try:
+        yield _sink
+    finally:
+        _sink = previous
+
+
+def test_disabled_is_a_no_op() -> None:
+    assert not enabled()
+    assert phase("a") is phase("b")
+    with phase("a"):
+        count(PAIRINGS)
+
+
+def test_memory_sink(tmp_path) -> None:
+    with profile() as sink:
+        assert enabled()
+        for _ in range(3):
+            with phase("outer"):
+                with phase("inner"):
+                    count(EC_ADDITIONS, 2)
+        count(PAIRINGS)
+    assert not enabled()
+    assert set(sink.phases) == {"outer", "inner"}
+    assert sink.phases["outer"].calls == 3
+    assert sink.phases["outer"].seconds >= sink.phases["inner"].seconds > 0
+    assert sink.counters == {EC_ADDITIONS: 6, PAIRINGS: 1}
+    sink.dump(tmp_path / "profile.json")
+    with open(tmp_path / "profile.json") as f:
+        assert json.load(f) == sink.to_dict()
+
+
+def test_nested_profiles_and_json_lines() -> None:
+    stream = io.StringIO()
+    with profile() as outer:
+        with profile(JSONLinesSink(stream)):
+            with phase("a"):
+                count(PAIRINGS, 3)
+        count(PAIRINGS)
+    events = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert events[0] == {"counter": PAIRINGS, "amount": 3}
+    assert events[1]["phase"] == "a"
+    assert outer.counters == {PAIRINGS: 1}
+
+
+def test_phase_records_on_exception() -> None:
+    with profile() as sink:
+        with pytest.raises(ValueError):
+            with phase("failing"):
+                raise ValueError
+    assert sink.phases["failing"].calls == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,229 @@
+"""
+Proving keys on disk and batches of proofs in a process pool
+
+homework12 and homework13 have proving keys with the same point sections,
+homework13's also carries l. The functions here take the key class and read
+or write its integer fields next to the points, and prove_many takes the
+prove function, so both provers share one copy of the worker machinery.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, fields
+from itertools import repeat
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from typing import Any, Callable, Iterable, Protocol, Sequence
+from py_ecc.bn128 import (
+    curve_order,
+    multiply,
+    G1,
+    G2,
+)
+import pytest
+
+from keyfile import (
+    G1Point,
+    G2Point,
+    KeyFile,
+    KeyFileError,
+    decode_g1,
+    decode_g2,
+    encode_g1,
+    encode_g2,
+    write_keyfile,
+)
+from msm_pool import MSMPool
+
+type Proof = tuple[G1Point, G2Point, G1Point]
+
+G1_QUERIES = ("a_query_g1", "t_of_tau_g1", "psi")
+G2_QUERIES = ("b_query_g2",)
+POINT_FIELDS = (*G1_QUERIES, *G2_QUERIES, "alfa_g1", "beta_g2")
+
+
+class ProvingKey(Protocol):
+    """
+    The sections every proving key has; other fields of the key's dataclass
+    are integers
+    """
+
+    @property
+    def a_query_g1(self) -> Sequence[G1Point]: ...
+    @property
+    def b_query_g2(self) -> Sequence[G2Point]: ...
+    @property
+    def t_of_tau_g1(self) -> Sequence[G1Point]: ...
+    @property
+    def alfa_g1(self) -> G1Point: ...
+    @property
+    def beta_g2(self) -> G2Point: ...
+    @property
+    def psi(self) -> Sequence[G1Point]: ...
+
+
+def save_proving_key(pk: ProvingKey, path: str | os.PathLike) -> None:
+    write_keyfile(
+        path,
+        g1={name: getattr(pk, name) for name in G1_QUERIES} | {"alfa_g1": [pk.alfa_g1]},
+        g2={name: getattr(pk, name) for name in G2_QUERIES} | {"beta_g2": [pk.beta_g2]},
+        integers={name: getattr(pk, name) for name in _integer_fields(type(pk))},
+    )
+
+
+def load_proving_key[K: ProvingKey](path: str | os.PathLike, key_type: type[K]) -> K:
+    """
+    Point sequences are views of the mmap, which stays mapped as long as they
+    are alive; proving_key_from on a KeyFile in a with statement unmaps it
+    at the end of the block
+    """
+    return proving_key_from(KeyFile(path), key_type)
+
+
+def proving_key_from[K: ProvingKey](keys: KeyFile, key_type: type[K]) -> K:
+    values: dict[str, Any] = {name: keys.g1(name) for name in G1_QUERIES}
+    values |= {name: keys.g2(name) for name in G2_QUERIES}
+    values |= {"alfa_g1": keys.g1("alfa_g1")[0], "beta_g2": keys.g2("beta_g2")[0]}
+    values |= {name: keys.integer(name) for name in _integer_fields(key_type)}
+    return key_type(**values)
+
+
+def _integer_fields(key_type: type) -> list[str]:
+    # every field of the key's dataclass that is not a point, e.g. l
+    return [field.name for field in fields(key_type) if field.name not in POINT_FIELDS]
+
+
+def pool_serves(pool: MSMPool, pk: ProvingKey) -> bool:
+    # the MSMs come from the pool's file and alfa and beta from pk; every
+    # setup draws its own alfa and beta, so they identify the file's setup
+    keys = pool.keys
+    return (
+        keys.g1("alfa_g1")[0] == pk.alfa_g1
+        and keys.g2("beta_g2")[0] == pk.beta_g2
+        and len(keys.g1("a_query_g1")) == len(pk.a_query_g1)
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class TimedProof:
+    proof: Proof
+    seconds: float
+
+
+# prove(polynomials, witness, pk, allow_fake_proof) of a homework module
+type Prove[C, K] = Callable[[C, list[int], K, bool], Proof]
+
+# prove function, circuit and proving key of the current prover process,
+# see _init_prover
+_prover_state: tuple[Prove[Any, Any], Any, ProvingKey] | None = None
+
+
+def _init_prover[C, K: ProvingKey](
+    prove: Prove[C, K], polynomials: C, pk_path: str, key_type: type[K]
+) -> None:
+    global _prover_state
+    _prover_state = (prove, polynomials, load_proving_key(pk_path, key_type))
+
+
+def _prove_timed[C, K: ProvingKey](
+    prove: Prove[C, K],
+    polynomials: C,
+    pk: K,
+    witness: list[int],
+    allow_fake_proof: bool,
+) -> TimedProof:
+    start = time.perf_counter()
+    proof = prove(polynomials, witness, pk, allow_fake_proof)
+    return TimedProof(proof=proof, seconds=time.perf_counter() - start)
+
+
+def _prove_in_worker(
+    witness: list[int], allow_fake_proof: bool
+) -> tuple[bytes, bytes, bytes, float]:
+    assert _prover_state is not None, "worker is not initialized"
+    timed = _prove_timed(*_prover_state, witness, allow_fake_proof)
+    a_g1, b_g2, c_g1 = timed.proof
+    return encode_g1(a_g1), encode_g2(b_g2), encode_g1(c_g1), timed.seconds
+
+
+def prove_many[C, K: ProvingKey](
+    prove: Prove[C, K],
+    polynomials: C,
+    witnesses: Iterable[list[int]],
+    pk: K,
+    workers: int | None = None,
+    allow_fake_proof: bool = False,
+) -> list[TimedProof]:
+    """
+    Proofs of many witnesses of one circuit, in input order, each with the
+    time its prove took. With workers > 1 every worker process receives the
+    circuit once and maps the proving key from a temporary key file, after
+    that only witnesses go out and encoded proofs come back (py_ecc G2
+    points can't be pickled).
+    """
+    if workers is None or workers <= 1:
+        return [
+            _prove_timed(prove, polynomials, pk, w, allow_fake_proof) for w in witnesses
+        ]
+    with tempfile.TemporaryDirectory() as directory:
+        pk_path = os.path.join(directory, "pk.bin")
+        save_proving_key(pk, pk_path)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_init_prover,
+            initargs=(prove, polynomials, pk_path, type(pk)),
+        ) as pool:
+            return [
+                TimedProof(
+                    proof=(decode_g1(a_g1), decode_g2(b_g2), decode_g1(c_g1)),
+                    seconds=seconds,
+                )
+                for a_g1, b_g2, c_g1, seconds in pool.map(
+                    _prove_in_worker, witnesses, repeat(allow_fake_proof)
+                )
+            ]
+
+
+def test_proving_key_roundtrip(tmp_path) -> None:
+    @dataclass(frozen=True, slots=True)
+    class Key:
+        a_query_g1: Sequence[G1Point]
+        b_query_g2: Sequence[G2Point]
+        t_of_tau_g1: Sequence[G1Point]
+        alfa_g1: G1Point
+        beta_g2: G2Point
+        psi: Sequence[G1Point]
+
+    @dataclass(frozen=True, slots=True)
+    class KeyWithInput(Key):
+        l: int
+
+    rnd = random.Random(7)
+    g1 = [multiply(G1, rnd.randint(1, curve_order - 1)) for _ in range(5)]
+    g2 = [multiply(G2, rnd.randint(1, curve_order - 1)) for _ in range(2)]
+    key = Key(g1[:2], g2[:1], g1[2:4], g1[4], g2[1], g1[1:3])
+    with_input = KeyWithInput(g1[:2], g2[:1], g1[2:4], g1[4], g2[1], g1[1:3], l=3)
+    save_proving_key(key, tmp_path / "key.bin")
+    save_proving_key(with_input, tmp_path / "with_input.bin")
+    with KeyFile(tmp_path / "key.bin") as keys:
+        with pytest.raises(KeyFileError):
+            keys.integer("l")
+        loaded = proving_key_from(keys, Key)
+        assert [list(getattr(loaded, name)) for name in G1_QUERIES + G2_QUERIES] == [
+            list(getattr(key, name)) for name in G1_QUERIES + G2_QUERIES
+        ]
+        assert (loaded.alfa_g1, loaded.beta_g2) == (key.alfa_g1, key.beta_g2)
+    with KeyFile(tmp_path / "with_input.bin") as keys:
+        assert proving_key_from(keys, KeyWithInput).l == 3
+
+    with MSMPool(tmp_path / "key.bin", workers=1) as pool:
+        assert pool_serves(pool, key)
+        assert pool_serves(pool, with_input)
+        assert not pool_serves(pool, Key(g1[:2], g2[:1], g1[2:4], g1[0], g2[1], g1))
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
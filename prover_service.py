@@ -0,0 +1,476 @@
+"""
+asyncio front end for homework13 prove and verify
+
+prove and verify are CPU-bound synchronous calls, so the service never runs
+them on the event loop. Jobs go into a bounded queue, a dispatcher moves them
+into a process pool with at most `workers` of them in flight, and callers get
+a future per job. When the pool is busy the queue fills up and submitting
+waits, which is the backpressure a client sees.
+
+Verify jobs that are waiting together are coalesced into one verify_batch
+call, so under load k verifications cost one final exponentiation.
+
+Workers map the proving and verifying keys from temporary key files and
+exchange points in the key file encoding, py_ecc G2 points can't be pickled.
+
+serve_unix and ServiceClient are a line-delimited JSON transport over a Unix
+socket, good enough for tests and local tools:
+
+    {"id": 1, "op": "prove", "witness": [...]}
+    {"id": 1, "proof": ["<A hex>", "<B hex>", "<C hex>"]}
+    {"id": 2, "op": "verify", "proof": [...], "public": [...]}
+    {"id": 2, "valid": true}
+    {"id": 3, "error": "NonZeroRemainder"}
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+from typing import Any
+import pytest
+
+from homework13 import (
+    NonZeroRemainder,
+    Polinomials,
+    Proof,
+    ProvingKey,
+    TrustedSetup,
+    VerifyingKey,
+    load_proving_key,
+    load_verifying_key,
+    prove,
+    save_proving_key,
+    save_verifying_key,
+    some_function_setup,
+    some_function_witness,
+    verify,
+    verify_batch,
+)
+from keyfile import decode_g1, decode_g2, encode_g1, encode_g2
+
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_BATCH_SIZE = 32
+
+type EncodedProof = tuple[bytes, bytes, bytes]
+
+
+class ServiceError(Exception):
+    pass
+
+
+def encode_proof(proof: Proof) -> EncodedProof:
+    a_g1, b_g2, c_g1 = proof
+    return encode_g1(a_g1), encode_g2(b_g2), encode_g1(c_g1)
+
+
+def decode_proof(encoded: EncodedProof) -> Proof:
+    a_g1, b_g2, c_g1 = encoded
+    return decode_g1(a_g1), decode_g2(b_g2), decode_g1(c_g1)
+
+
+# circuit and keys of the current worker process, see _init_worker
+_worker_state: tuple[Polinomials, ProvingKey, VerifyingKey] | None = None
+
+
+def _init_worker(polynomials: Polinomials, pk_path: str, vk_path: str) -> None:
+    global _worker_state
+    _worker_state = (
+        polynomials,
+        load_proving_key(pk_path),
+        load_verifying_key(vk_path),
+    )
+
+
+def _prove_job(witness: list[int]) -> EncodedProof:
+    assert _worker_state is not None, "worker is not initialized"
+    polynomials, pk, _ = _worker_state
+    return encode_proof(prove(polynomials, witness, pk))
+
+
+def _verify_jobs(proofs: list[EncodedProof], publics: list[list[int]]) -> list[bool]:
+    assert _worker_state is not None, "worker is not initialized"
+    _, _, vk = _worker_state
+    return verify_batch([decode_proof(p) for p in proofs], publics, vk)
+
+
+@dataclass(frozen=True, slots=True)
+class _Job:
+    future: asyncio.Future
+    witness: list[int] | None = None
+    proof: EncodedProof | None = None
+    public: list[int] = field(default_factory=list)
+
+
+class ProofService:
+    """
+    Queue of prove and verify jobs in front of a process pool, use as
+
+        async with ProofService(polynomials, ts, workers=4) as service:
+            proof = await service.prove(witness)
+            assert await service.verify(proof, witness[:l])
+    """
+
+    def __init__(
+        self,
+        polynomials: Polinomials,
+        key: TrustedSetup | ProvingKey,
+        vk: VerifyingKey | None = None,
+        workers: int = 2,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> None:
+        assert workers >= 1, "there must be at least one worker"
+        assert vk is not None or isinstance(key, TrustedSetup), (
+            "verifying key is missing"
+        )
+        self.polynomials = polynomials
+        self.pk = key.proving_key() if isinstance(key, TrustedSetup) else key
+        self.vk = key.verifying_key() if vk is None else vk
+        self.workers = workers
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        # sizes of the verify_batch calls made, for monitoring and tests
+        self.verify_batches: list[int] = []
+        self._queue: asyncio.Queue[_Job] | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._running: set[asyncio.Task] = set()
+        self._dispatcher: asyncio.Task | None = None
+        self._pool: ProcessPoolExecutor | None = None
+        self._directory: tempfile.TemporaryDirectory | None = None
+
+    async def start(self) -> None:
+        assert self._dispatcher is None, "service is already started"
+        self._directory = tempfile.TemporaryDirectory()
+        pk_path = os.path.join(self._directory.name, "pk.bin")
+        vk_path = os.path.join(self._directory.name, "vk.bin")
+        save_proving_key(self.pk, pk_path)
+        save_verifying_key(self.vk, vk_path)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_init_worker,
+            initargs=(self.polynomials, pk_path, vk_path),
+        )
+        self._queue = asyncio.Queue(self.queue_size)
+        self._slots = asyncio.Semaphore(self.workers)
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def close(self) -> None:
+        """
+        Finish the queued jobs, then stop the workers
+        """
+        if self._dispatcher is None:
+            return
+        assert self._queue is not None and self._pool is not None
+        await self._queue.join()
+        self._dispatcher.cancel()
+        await asyncio.gather(self._dispatcher, return_exceptions=True)
+        await asyncio.gather(*self._running, return_exceptions=True)
+        self._pool.shutdown()
+        if self._directory is not None:
+            self._directory.cleanup()
+        self._dispatcher = None
+
+    async def __aenter__(self) -> "ProofService":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
+    async def _submit(self, job: _Job) -> asyncio.Future:
+        assert self._queue is not None, "service is not started"
+        # waits while the queue is full
+        await self._queue.put(job)
+        return job.future
+
+    async def submit_prove(self, witness: list[int]) -> "asyncio.Future[Proof]":
+        """
+        Queue a proof, the returned future resolves to it or to NonZeroRemainder
+        """
+        future = asyncio.get_running_loop().create_future()
+        return await self._submit(_Job(future, witness=[int(w) for w in witness]))
+
+    async def submit_verify(
+        self, proof: Proof, public: list[int]
+    ) -> "asyncio.Future[bool]":
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(future, proof=encode_proof(proof), public=[int(p) for p in public])
+        return await self._submit(job)
+
+    async def prove(self, witness: list[int]) -> Proof:
+        return await (await self.submit_prove(witness))
+
+    async def verify(self, proof: Proof, public: list[int]) -> bool:
+        return await (await self.submit_verify(proof, public))
+
+    async def _dispatch(self) -> None:
+        assert self._queue is not None and self._slots is not None
+        held: _Job | None = None
+        while True:
+            # with every worker busy the dispatcher stops taking jobs off the
+            # queue, so at most workers + queue_size jobs are accepted
+            await self._slots.acquire()
+            job = held or await self._queue.get()
+            held = None
+            if job.witness is not None:
+                self._launch(self._run_prove(job))
+                continue
+            # verify jobs queued right behind this one go into the same batch
+            jobs = [job]
+            while len(jobs) < self.batch_size and not self._queue.empty():
+                job = self._queue.get_nowait()
+                if job.witness is not None:
+                    held = job
+                    break
+                jobs.append(job)
+            self._launch(self._run_verify(jobs))
+
+    def _launch(self, work: Any) -> None:
+        task = asyncio.create_task(work)
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    def _done(self, count: int) -> None:
+        assert self._slots is not None and self._queue is not None
+        self._slots.release()
+        for _ in range(count):
+            self._queue.task_done()
+
+    async def _run_prove(self, job: _Job) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            encoded = await loop.run_in_executor(self._pool, _prove_job, job.witness)
+        except Exception as error:
+            if not job.future.done():
+                job.future.set_exception(error)
+        else:
+            if not job.future.done():
+                job.future.set_result(decode_proof(encoded))
+        finally:
+            self._done(1)
+
+    async def _run_verify(self, jobs: list[_Job]) -> None:
+        loop = asyncio.get_running_loop()
+        self.verify_batches.append(len(jobs))
+        try:
+            results = await loop.run_in_executor(
+                self._pool,
+                _verify_jobs,
+                [job.proof for job in jobs],
+                [job.public for job in jobs],
+            )
+        except Exception as error:
+            results = [error] * len(jobs)
+        finally:
+            self._done(len(jobs))
+        for job, result in zip(jobs, results):
+            if job.future.done():
+                continue
+            if isinstance(result, Exception):
+                job.future.set_exception(result)
+            else:
+                job.future.set_result(result)
+
+
+def _proof_to_json(proof: Proof) -> list[str]:
+    return [part.hex() for part in encode_proof(proof)]
+
+
+def _proof_from_json(data: list[str]) -> Proof:
+    if not isinstance(data, list) or len(data) != 3:
+        raise ServiceError("proof must be a list of three hex strings")
+    a_g1, b_g2, c_g1 = (bytes.fromhex(part) for part in data)
+    return decode_proof((a_g1, b_g2, c_g1))
+
+
+async def _answer(service: ProofService, request: dict) -> dict:
+    op = request.get("op")
+    if op == "prove":
+        return {"proof": _proof_to_json(await service.prove(request["witness"]))}
+    if op == "verify":
+        proof = _proof_from_json(request["proof"])
+        return {"valid": await service.verify(proof, request["public"])}
+    raise ServiceError(f"unknown op {op!r}")
+
+
+async def serve_unix(service: ProofService, path: str | os.PathLike) -> asyncio.Server:
+    """
+    Serve the service on a Unix socket, requests of one connection are
+    answered as they complete, not in order
+    """
+
+    async def handle(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        tasks = set()
+
+        async def respond(line: bytes) -> None:
+            request_id = None
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ServiceError("request must be a JSON object")
+                request_id = request.get("id")
+                response = await _answer(service, request)
+            except NonZeroRemainder:
+                response = {"error": "NonZeroRemainder"}
+            except Exception as error:
+                # whatever a worker raises, e.g. prove's assert on the witness
+                # size, is still an answer: the client waits for every id
+                response = {"error": f"{type(error).__name__}: {error}"}
+            response["id"] = request_id
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+    return await asyncio.start_unix_server(handle, os.fspath(path))
+
+
+class ServiceClient:
+    """
+    Client of serve_unix, several requests can be in flight on one connection
+    """
+
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._ids = itertools.count()
+        self._waiting: dict[int, asyncio.Future] = {}
+        self._receiver = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, path: str | os.PathLike) -> "ServiceClient":
+        reader, writer = await asyncio.open_unix_connection(os.fspath(path))
+        return cls(reader, writer)
+
+    async def _receive(self) -> None:
+        while line := await self._reader.readline():
+            response = json.loads(line)
+            future = self._waiting.pop(response["id"], None)
+            if future is None or future.done():
+                continue
+            if "error" in response:
+                future.set_exception(ServiceError(response["error"]))
+            else:
+                future.set_result(response)
+        for future in self._waiting.values():
+            future.set_exception(ServiceError("connection closed"))
+        self._waiting.clear()
+
+    async def _request(self, request: dict) -> dict:
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        self._writer.write(json.dumps({"id": request_id, **request}).encode() + b"\n")
+        await self._writer.drain()
+        return await future
+
+    async def prove(self, witness: list[int]) -> Proof:
+        response = await self._request({"op": "prove", "witness": witness})
+        return _proof_from_json(response["proof"])
+
+    async def verify(self, proof: Proof, public: list[int]) -> bool:
+        response = await self._request(
+            {"op": "verify", "proof": _proof_to_json(proof), "public": public}
+        )
+        return response["valid"]
+
+    async def close(self) -> None:
+        self._writer.close()
+        await self._writer.wait_closed()
+        await asyncio.gather(self._receiver, return_exceptions=True)
+
+
+def _setup() -> tuple[Polinomials, TrustedSetup, list[list[int]]]:
+    polynomials, ts = some_function_setup()
+    witnesses = [some_function_witness(x, y) for x, y in [(3, 4), (10, 10), (2, 7)]]
+    return polynomials, ts, witnesses
+
+
+def test_service_prove_and_coalesced_verify() -> None:
+    polynomials, ts, witnesses = _setup()
+    proofs = [prove(polynomials, w, ts) for w in witnesses]
+
+    async def scenario() -> None:
+        async with ProofService(polynomials, ts, workers=1, queue_size=8) as service:
+            prove_futures = [await service.submit_prove(w) for w in witnesses]
+            verify_futures = [
+                await service.submit_verify(proof, w[:2])
+                for proof, w in zip(proofs, witnesses)
+            ]
+            verify_futures.append(await service.submit_verify(proofs[0], [1, 161]))
+            bad = witnesses[0][:3] + [witnesses[0][3] + 1] + witnesses[0][4:]
+            bad_future = await service.submit_prove(bad)
+            assert await asyncio.gather(*prove_futures) == proofs
+            assert await asyncio.gather(*verify_futures) == [True, True, True, False]
+            with pytest.raises(NonZeroRemainder):
+                await bad_future
+            # the verifications were queued behind the proofs and went as one batch
+            assert service.verify_batches == [4]
+
+    asyncio.run(scenario())
+
+
+def test_service_backpressure() -> None:
+    polynomials, ts, witnesses = _setup()
+
+    async def scenario() -> None:
+        async with ProofService(polynomials, ts, workers=1, queue_size=1) as service:
+            # one job runs, one waits in the queue, the third submit has to wait
+            first = await service.submit_prove(witnesses[0])
+            await asyncio.sleep(0)
+            await service.submit_prove(witnesses[1])
+            third = asyncio.create_task(service.submit_prove(witnesses[2]))
+            await asyncio.sleep(0)
+            assert not third.done()
+            await first
+            assert verify(*await (await third), ts, witnesses[2][:2])
+
+    asyncio.run(scenario())
+
+
+def test_unix_socket_transport(tmp_path) -> None:
+    polynomials, ts, witnesses = _setup()
+    path = tmp_path / "prover.sock"
+
+    async def scenario() -> None:
+        async with ProofService(polynomials, ts, workers=2) as service:
+            server = await serve_unix(service, path)
+            async with server:
+                client = await ServiceClient.connect(path)
+                proofs = await asyncio.gather(*(client.prove(w) for w in witnesses))
+                assert proofs == [await service.prove(w) for w in witnesses]
+                assert await asyncio.gather(
+                    client.verify(proofs[1], witnesses[1][:2]),
+                    client.verify(proofs[1], witnesses[0][:2]),
+                ) == [True, False]
+                bad = witnesses[0][:3] + [0] + witnesses[0][4:]
+                with pytest.raises(ServiceError, match="NonZeroRemainder"):
+                    await client.prove(bad)
+                with pytest.raises(ServiceError, match="AssertionError"):
+                    await client.prove(witnesses[0][:-1])
+                with pytest.raises(ServiceError):
+                    await client._request({"op": "unknown"})
+                await client.close()
+
+    asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
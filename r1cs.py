@@ -0,0 +1,347 @@
+"""
+Sparse (CSR) constraint matrices for R1CS
+
+Real constraint rows have two or three non-zero entries, so the matrices are
+kept as three arrays: indptr (row offsets), indices (column of every non-zero)
+and data (its value). Memory and matrix-vector products are O(nnz).
+"""
+
+from dataclasses import dataclass
+import random
+from typing import Sequence
+import numpy as np
+import numpy.typing as npt
+import pytest
+
+import limbs
+import profiling
+
+type DenseMatrix = list[list[int]]
+
+
+@dataclass(frozen=True, slots=True)
+class SparseMatrix:
+    rows: int
+    cols: int
+    indptr: npt.NDArray[np.int64]
+    indices: npt.NDArray[np.int64]
+    # python ints, so BN254-sized and negative coefficients fit as they are
+    data: npt.NDArray[np.object_]
+
+    @classmethod
+    def from_dense(cls, matrix: DenseMatrix) -> "SparseMatrix":
+        cols = len(matrix[0]) if matrix else 0
+        indptr = [0]
+        indices = []
+        data = []
+        for row in matrix:
+            assert len(row) == cols, "matrix rows have different sizes"
+            for col, value in enumerate(row):
+                if value:
+                    indices.append(col)
+                    data.append(int(value))
+            indptr.append(len(indices))
+        return cls._build(len(matrix), cols, indptr, indices, data)
+
+    @classmethod
+    def from_coo(
+        cls, rows: int, cols: int, entries: Sequence[tuple[int, int, int]]
+    ) -> "SparseMatrix":
+        """
+        Build from (row, col, value) triplets, duplicates are summed
+        """
+        merged: dict[tuple[int, int], int] = {}
+        for row, col, value in entries:
+            assert 0 <= row < rows and 0 <= col < cols, "entry is out of bounds"
+            merged[(row, col)] = merged.get((row, col), 0) + int(value)
+        indptr = [0] * (rows + 1)
+        indices = []
+        data = []
+        for (row, col), value in sorted(merged.items()):
+            if value:
+                indptr[row + 1] += 1
+                indices.append(col)
+                data.append(value)
+        for row in range(rows):
+            indptr[row + 1] += indptr[row]
+        return cls._build(rows, cols, indptr, indices, data)
+
+    @classmethod
+    def _build(
+        cls, rows: int, cols: int, indptr: list[int], indices: list[int], data: list[int]
+    ) -> "SparseMatrix":
+        values = np.empty(len(data), dtype=object)
+        values[:] = data
+        return cls(
+            rows=rows,
+            cols=cols,
+            indptr=np.array(indptr, dtype=np.int64),
+            indices=np.array(indices, dtype=np.int64),
+            data=values,
+        )
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.rows, self.cols
+
+    @property
+    def nnz(self) -> int:
+        return len(self.data)
+
+    def row(self, idx: int) -> tuple[npt.NDArray[np.int64], npt.NDArray[np.object_]]:
+        start, end = self.indptr[idx], self.indptr[idx + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def dot(self, vec: Sequence[int], modulus: int | None = None) -> list[int]:
+        """
+        matrix * vec in O(nnz), reduced by modulus if one is given
+        """
+        assert len(vec) == self.cols, "vector size is not equal to matrix columns"
+        values = np.empty(self.cols, dtype=object)
+        values[:] = [int(x) for x in vec]
+        result = np.zeros(self.rows, dtype=object)
+        if self.nnz:
+            profiling.count(profiling.FIELD_MULTIPLICATIONS, self.nnz)
+            products = self.data * values[self.indices]
+            non_empty = np.diff(self.indptr) > 0
+            result[non_empty] = np.add.reduceat(products, self.indptr[:-1][non_empty])
+        if modulus is not None:
+            result %= modulus
+        return result.tolist()
+
+    def transpose(self) -> "SparseMatrix":
+        """
+        CSR of the transpose, i.e. the columns of this matrix as rows
+        """
+        order = np.argsort(self.indices, kind="stable")
+        row_ids = np.repeat(np.arange(self.rows, dtype=np.int64), np.diff(self.indptr))
+        counts = np.bincount(self.indices, minlength=self.cols)
+        indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        return SparseMatrix(
+            rows=self.cols,
+            cols=self.rows,
+            indptr=indptr,
+            indices=row_ids[order],
+            data=self.data[order],
+        )
+
+    def to_dense(self) -> DenseMatrix:
+        result = [[0] * self.cols for _ in range(self.rows)]
+        for idx in range(self.rows):
+            indices, data = self.row(idx)
+            for col, value in zip(indices, data):
+                result[idx][int(col)] = value
+        return result
+
+
+@dataclass(frozen=True, slots=True)
+class BatchCheck:
+    satisfied: npt.NDArray[np.bool_]
+    # index of the first violated constraint per witness, -1 when satisfied
+    first_failure: npt.NDArray[np.int64]
+
+
+def _bound(matrix: SparseMatrix, witness_bound: int) -> int:
+    # largest absolute value a row of matrix * w can reach
+    if not matrix.nnz:
+        return 0
+    row_sums = np.add.reduceat(
+        np.abs(matrix.data), matrix.indptr[:-1][np.diff(matrix.indptr) > 0]
+    )
+    return int(max(row_sums)) * witness_bound
+
+
+def _dot_batch(
+    matrix: SparseMatrix, witnesses: npt.NDArray, modulus: int | None
+) -> npt.NDArray:
+    # (rows, k): one column of matrix * w per witness
+    result = np.zeros((matrix.rows, witnesses.shape[0]), dtype=witnesses.dtype)
+    if matrix.nnz:
+        data = matrix.data.astype(witnesses.dtype)[:, None]
+        products = data * witnesses.T[matrix.indices]
+        non_empty = np.diff(matrix.indptr) > 0
+        result[non_empty] = np.add.reduceat(
+            products, matrix.indptr[:-1][non_empty], axis=0
+        )
+    if modulus is not None:
+        result %= modulus
+    return result
+
+
+def _dot_limbs(matrix: SparseMatrix, witnesses: limbs.Limbs) -> limbs.Limbs:
+    # (LIMBS, k, rows): matrix * w per witness of a (LIMBS, k, cols) array
+    result = np.zeros((limbs.LIMBS, witnesses.shape[1], matrix.rows), np.int64)
+    if matrix.nnz:
+        data = limbs.from_ints(matrix.data)
+        products = limbs.mul(data, witnesses[:, :, matrix.indices])
+        non_empty = np.diff(matrix.indptr) > 0
+        sums = np.add.reduceat(products, matrix.indptr[:-1][non_empty], axis=2)
+        result[:, :, non_empty] = limbs.reduce_sum(sums)
+    return result
+
+
+def _witness_matrix(
+    witnesses: Sequence[Sequence[int]] | npt.NDArray, cols: int, modulus: int | None
+) -> npt.NDArray:
+    # (k, cols) witnesses reduced by modulus: integer arrays stay int64 whenever
+    # the reduction allows it, anything else becomes python int objects
+    if isinstance(witnesses, np.ndarray) and np.can_cast(witnesses.dtype, np.int64):
+        assert witnesses.size == 0 or witnesses.shape[-1] == cols, (
+            "witness size is not equal to columns"
+        )
+        w = witnesses.astype(np.int64).reshape(len(witnesses), cols)
+        if modulus is None or (modulus >= 2**63 and not (w < 0).any()):
+            # non-negative int64 values are reduced already
+            return w
+        if modulus < 2**63:
+            return w % modulus
+        return w.astype(object) % modulus
+    rows = [[int(x) for x in w] for w in witnesses]
+    assert all(len(w) == cols for w in rows), "witness size is not equal to columns"
+    w = np.empty((len(rows), cols), dtype=object)
+    if rows:
+        w[...] = rows
+    return w if modulus is None else w % modulus
+
+
+def check_batch(
+    A: DenseMatrix | SparseMatrix,
+    B: DenseMatrix | SparseMatrix,
+    C: DenseMatrix | SparseMatrix,
+    witnesses: Sequence[Sequence[int]] | npt.NDArray,
+    modulus: int | None = None,
+    vectorized: bool = False,
+) -> BatchCheck:
+    """
+    Check Aw * Bw - Cw == 0 for every row w of witnesses in one vectorized pass.
+
+    Small inputs run on int64 arrays; when Aw * Bw could overflow 63 bits,
+    e.g. for BN254 field elements, the same code runs on python int objects.
+    vectorized runs BN254 scalar field checks on limbs arrays instead; it
+    takes about twice as long as the python int path, so it stays opt-in.
+    """
+    A, B, C = as_sparse(A), as_sparse(B), as_sparse(C)
+    assert A.shape == B.shape == C.shape, "matrices have different shapes"
+    # limbs.from_ints reduces by itself, int64 arrays included
+    w = _witness_matrix(witnesses, A.cols, None if vectorized else modulus)
+    if vectorized:
+        assert modulus == limbs.MODULUS, "limbs only support the BN254 scalar field"
+        w = limbs.from_ints(w)
+        Aw, Bw, Cw = (_dot_limbs(matrix, w) for matrix in (A, B, C))
+        return _batch_check(~limbs.is_zero(limbs.sub(limbs.mul(Aw, Bw), Cw)))
+    if w.dtype == np.int64:
+        witness_bound = max(-int(w.min()), int(w.max())) if w.size else 0
+    else:
+        witness_bound = max((abs(x) for x in w.flat), default=0)
+    raw = [_bound(matrix, witness_bound) for matrix in (A, B, C)]
+    reduced = raw if modulus is None else [min(b, modulus - 1) for b in raw]
+    if max(raw) < 2**62 and reduced[0] * reduced[1] + reduced[2] < 2**62:
+        w = w.astype(np.int64)
+    else:
+        w = w.astype(object)
+
+    residual = _dot_batch(A, w, modulus) * _dot_batch(B, w, modulus) - _dot_batch(
+        C, w, modulus
+    )
+    if modulus is not None:
+        residual %= modulus
+    return _batch_check((residual != 0).T)
+
+
+def _batch_check(failed: npt.NDArray[np.bool_]) -> BatchCheck:
+    # failed is (k, rows)
+    satisfied = ~failed.any(axis=1)
+    first_failure = np.where(satisfied, -1, failed.argmax(axis=1)).astype(np.int64)
+    return BatchCheck(satisfied=satisfied, first_failure=first_failure)
+
+
+def as_sparse(matrix: DenseMatrix | SparseMatrix) -> SparseMatrix:
+    if isinstance(matrix, SparseMatrix):
+        return matrix
+    return SparseMatrix.from_dense(matrix)
+
+
+def test_sparse_roundtrip_and_dot() -> None:
+    rnd = random.Random(3)
+    dense = [
+        [rnd.choice([0, 0, 0, 1, -36, rnd.randint(1, 2**254)]) for _ in range(9)]
+        for _ in range(6)
+    ]
+    dense[2] = [0] * 9
+    sparse = SparseMatrix.from_dense(dense)
+    assert sparse.shape == (6, 9)
+    assert sparse.nnz == sum(1 for row in dense for x in row if x)
+    assert sparse.to_dense() == dense
+    assert sparse.transpose().to_dense() == [list(col) for col in zip(*dense)]
+    vec = [rnd.randint(0, 2**254) for _ in range(9)]
+    expected = [sum(x * y for x, y in zip(row, vec)) for row in dense]
+    assert sparse.dot(vec) == expected
+    assert sparse.dot(vec, modulus=101) == [x % 101 for x in expected]
+
+
+def test_sparse_from_coo() -> None:
+    sparse = SparseMatrix.from_coo(3, 4, [(2, 1, 5), (0, 3, 1), (2, 1, 2), (1, 0, 0)])
+    assert sparse.to_dense() == [[0, 0, 0, 1], [0, 0, 0, 0], [0, 7, 0, 0]]
+    assert sparse.nnz == 2
+    empty = SparseMatrix.from_coo(2, 2, [])
+    assert empty.dot([1, 2]) == [0, 0]
+    assert as_sparse(sparse) is sparse
+
+
+def test_check_batch_small_ints() -> None:
+    # x * y = z and z * 1 = out over plain integers
+    A = [[0, 1, 0, 0, 0], [0, 0, 0, 1, 0]]
+    B = [[0, 0, 1, 0, 0], [1, 0, 0, 0, 0]]
+    C = [[0, 0, 0, 1, 0], [0, 0, 0, 0, 1]]
+    witnesses = [
+        [1, 3, 4, 12, 12],
+        [1, 3, 4, 11, 12],
+        [1, 3, 4, 12, 13],
+        [1, -2, 5, -10, -10],
+    ]
+    result = check_batch(A, B, C, witnesses)
+    assert result.satisfied.tolist() == [True, False, False, True]
+    assert result.first_failure.tolist() == [-1, 0, 1, -1]
+    empty = check_batch(A, B, C, [])
+    assert empty.satisfied.tolist() == []
+    array = np.array(witnesses, dtype=np.int64)
+    assert check_batch(A, B, C, array).first_failure.tolist() == [-1, 0, 1, -1]
+    assert check_batch(A, B, C, array, modulus=7).satisfied.tolist() == [
+        True,
+        False,
+        False,
+        True,
+    ]
+    assert check_batch(A, B, C, array[:0]).satisfied.tolist() == []
+
+
+def test_check_batch_field_elements() -> None:
+    modulus = 21888242871839275222246405745257275088548364400416034343698204186575808495617
+    rnd = random.Random(5)
+    A = SparseMatrix.from_dense([[0, 1, 0, 0], [0, 0, 0, 1]])
+    B = SparseMatrix.from_dense([[0, 0, 1, 0], [0, 0, 0, 1]])
+    C = SparseMatrix.from_dense([[0, 0, 0, 1], [-1, 0, 0, 2]])
+    witnesses = []
+    for _ in range(4):
+        x, y = rnd.randint(0, modulus - 1), rnd.randint(0, modulus - 1)
+        witnesses.append([1, x, y, x * y % modulus])
+    # second constraint z * z = 2z - 1 only holds for z = 1
+    witnesses.append([1, 1, 1, 1])
+    result = check_batch(A, B, C, witnesses, modulus=modulus)
+    assert result.satisfied.tolist() == [False] * 4 + [True]
+    # int64 arrays with negative entries are reduced by the big modulus too
+    small = np.array([[1, -2, 3, -6], [1, 1, 1, 1]], dtype=np.int64)
+    assert check_batch(A, B, C, small, modulus).satisfied.tolist() == [False, True]
+    assert result.first_failure.tolist() == [1] * 4 + [-1]
+    vectorized = check_batch(A, B, C, witnesses, modulus, vectorized=True)
+    assert vectorized.satisfied.tolist() == result.satisfied.tolist()
+    assert vectorized.first_failure.tolist() == result.first_failure.tolist()
+    witnesses[0][3] += 1
+    assert check_batch(A, B, C, witnesses[:1], modulus).first_failure.tolist() == [0]
+    assert check_batch(
+        A, B, C, witnesses[:1], modulus, vectorized=True
+    ).first_failure.tolist() == [0]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])